@@ -0,0 +1,602 @@
+"""
+OpenAI 兼容的 HTTP 服务：多个请求共用一个模型，连续批处理 (continuous batching) 解码
+
+chat.py、simple_chat.py、test_model.py 都是单用户的 input() 循环，各自加载一份模型；
+给内部应用提供服务时只能一个用户一个进程，显存和内存都放不下几份。这里：
+  - asyncio HTTP 服务 (只用标准库)：POST /v1/chat/completions、/v1/completions，
+    stream=true 时以 SSE (text/event-stream) 逐段返回；GET /v1/models、/metrics；
+  - 聊天请求的提示用 chat.format_prompt 拼接 (与 chat.py 的系统提示和 [INST] 模板一致)，
+    指定 --vault 时和 chat.py 一样检索知识库段落作为上下文；
+  - BatchEngine 在后台线程中运行，继承 multi_candidate.MultiCandidateGenerator 的多序列 llama.cpp 上下文：
+    每个请求占一个序列 (槽位)，每一步把所有在生成的序列的新 token 和新请求的提示片段 (分块 prefill)
+    放进同一个 batch 解码；请求结束立刻释放槽位，排队的请求在下一步就加入，不用等整批结束；
+  - 采样用 multi_candidate.sample_token，可选 cjk_logits 约束解码；
+  - ServerMetrics 统计排队数、首 token 延迟 (TTFT)、每个请求的解码速度和整体吞吐 (token/s)，
+    GET /metrics 返回 JSON，每个请求结束时打印一行。
+
+启动：python api_server.py --model path/to/model.gguf [--parallel 4] [--port 8000] [--vault E:/kubook]
+"""
+import argparse
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from http import HTTPStatus
+
+import numpy as np
+
+import chat
+from cjk_logits import TokenMask
+from dense_index import load_embedder
+from multi_candidate import MultiCandidateGenerator, sample_token
+from obsidian_loader import ObsidianLoader
+from passages import llama_token_counter, pack_context
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+# 同时生成的请求数 (llama.cpp 上下文中的序列数)
+DEFAULT_PARALLEL = 4
+# 每个序列的上下文长度 (提示 + 生成)，总 KV 缓存为它乘以序列数
+DEFAULT_SEQ_CTX = 2048
+# 每步 batch 最多的 token 数 (生成中的序列各 1 个，其余用于新请求的提示)
+DEFAULT_N_BATCH = 512
+# 排队的请求超过这个数时返回 503
+MAX_QUEUE = 64
+# 请求体大小上限
+MAX_BODY_BYTES = 1 << 20
+# 统计最近这么多个请求的 TTFT 和解码速度
+METRICS_WINDOW = 1000
+# 整体吞吐按最近这么多秒计算
+THROUGHPUT_WINDOW = 10.0
+# 采样参数的默认值与 chat.py 一致
+DEFAULT_SAMPLING = {"temperature": chat.PARAM_VARIATIONS[0]["temperature"], "top_p": chat.BASE_PARAMS["top_p"],
+                    "top_k": chat.BASE_PARAMS["top_k"], "repeat_penalty": chat.BASE_PARAMS["repeat_penalty"]}
+
+
+class RequestError(Exception):
+    """请求参数错误，返回给客户端的 HTTP 状态码和消息"""
+
+    def __init__(self, message, status=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class GenerationRequest:
+    """一个生成请求：提示 token、采样参数，以及把结果送回事件循环的队列"""
+
+    def __init__(self, loop, prompt_tokens, max_tokens, params, stop, seed=None, processor=None):
+        self.id = uuid.uuid4().hex[:24]
+        self.loop = loop
+        self.events = asyncio.Queue()
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.params = params
+        self.stop = stop
+        self.rng = np.random.default_rng(seed)
+        self.processor = processor
+        self.cancelled = False
+        self.arrival = time.perf_counter()
+        self.first_token = None
+        self.n_tokens = 0
+
+    def post(self, *event):
+        """在引擎线程中调用，把事件交给请求所在的事件循环"""
+        self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+
+class _Sequence:
+    """占用一个槽位的请求在引擎中的状态"""
+
+    def __init__(self, request, seq_id):
+        self.request = request
+        self.seq_id = seq_id
+        self.pending = list(request.prompt_tokens)  # 还没有送进模型的 token
+        self.pos = 0
+        self.history = list(request.prompt_tokens)
+        self.generated = []
+        self.sent = 0  # 已经发出的字符数
+
+
+def _stop_holdback(text, stops):
+    """text 末尾可能是某个停止词开头的最长长度，这部分先不发出"""
+    hold = 0
+    for stop in stops:
+        for n in range(min(len(stop) - 1, len(text)), hold, -1):
+            if text.endswith(stop[:n]):
+                hold = n
+                break
+    return hold
+
+
+class ServerMetrics:
+    """排队数、TTFT 和吞吐的统计 (引擎线程写，HTTP 处理读，加锁)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.ttft = deque(maxlen=METRICS_WINDOW)
+        self.decode_rate = deque(maxlen=METRICS_WINDOW)
+        self._steps = deque()  # (时间, 本步生成的 token 数)
+
+    def record_step(self, n_tokens):
+        now = time.perf_counter()
+        with self._lock:
+            self._steps.append((now, n_tokens))
+            while self._steps and self._steps[0][0] < now - THROUGHPUT_WINDOW:
+                self._steps.popleft()
+
+    def record_request(self, request, cancelled):
+        with self._lock:
+            self.prompt_tokens += len(request.prompt_tokens)
+            self.completion_tokens += request.n_tokens
+            if cancelled:
+                self.cancelled += 1
+                return
+            self.completed += 1
+            if request.first_token is not None:
+                self.ttft.append(request.first_token - request.arrival)
+                elapsed = time.perf_counter() - request.first_token
+                if request.n_tokens > 1 and elapsed > 0:
+                    self.decode_rate.append((request.n_tokens - 1) / elapsed)
+
+    @staticmethod
+    def _percentiles(values, scale=1.0):
+        if not values:
+            return None
+        p50, p95 = np.percentile(np.asarray(values) * scale, [50, 95])
+        return {"mean": float(np.mean(values) * scale), "p50": float(p50), "p95": float(p95)}
+
+    def snapshot(self, queue_depth, active, slots):
+        with self._lock:
+            now = time.perf_counter()
+            steps = [n for t, n in self._steps if t >= now - THROUGHPUT_WINDOW]
+            ttft, rates = list(self.ttft), list(self.decode_rate)
+            return {
+                "queue_depth": queue_depth, "active": active, "slots": slots,
+                "requests": self.requests, "completed": self.completed, "cancelled": self.cancelled,
+                "rejected": self.rejected, "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "tokens_per_second": sum(steps) / THROUGHPUT_WINDOW,
+                "ttft_ms": self._percentiles(ttft, 1000.0),
+                "request_tokens_per_second": self._percentiles(rates),
+                "uptime_seconds": time.time() - self.started,
+            }
+
+
+class BatchEngine(MultiCandidateGenerator):
+    """连续批处理：每个请求一个序列，所有序列每一步一起解码
+
+    n_seq 个槽位共用一个 llama.cpp 上下文，KV 缓存为 seq_ctx * n_seq (统一 KV 缓存，见 MultiCandidateGenerator)；
+    每个请求的提示 + 生成不超过 seq_ctx (与 KV 缓存是否在序列间统一分配无关，总能放下)。
+    """
+
+    def __init__(self, llm, n_seq=DEFAULT_PARALLEL, seq_ctx=DEFAULT_SEQ_CTX, n_batch=DEFAULT_N_BATCH,
+                 metrics=None, max_queue=MAX_QUEUE):
+        super().__init__(llm, n_seq=n_seq, n_ctx=seq_ctx * n_seq, n_batch=n_batch)
+        self.seq_ctx = self.n_ctx // n_seq
+        self.metrics = metrics or ServerMetrics()
+        self.max_queue = max_queue
+        self.waiting = queue.Queue()
+        self.free_slots = list(range(n_seq - 1, -1, -1))
+        self.running = {}  # 序列号 -> _Sequence
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+
+    def start(self):
+        self._clear()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.close()
+
+    @property
+    def queue_depth(self):
+        return self.waiting.qsize()
+
+    def submit(self, request):
+        if self.waiting.qsize() >= self.max_queue:
+            self.metrics.rejected += 1
+            raise RequestError("服务繁忙，请稍后重试", HTTPStatus.SERVICE_UNAVAILABLE)
+        self.metrics.requests += 1
+        self.waiting.put(request)
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                worked = self.step()
+            except Exception as e:
+                # 解码失败时结束所有进行中的请求，引擎继续服务后面的请求
+                print(f"❌ 批量解码出错: {str(e)}")
+                for seq in list(self.running.values()):
+                    self._finish(seq, "error")
+                self._clear()
+                worked = True
+            if not worked:
+                self._wakeup.wait(0.5)
+                self._wakeup.clear()
+
+    def _admit(self):
+        while self.free_slots and not self.waiting.empty():
+            request = self.waiting.get_nowait()
+            if request.cancelled:
+                self.metrics.record_request(request, cancelled=True)
+                continue
+            seq = _Sequence(request, self.free_slots.pop())
+            self.running[seq.seq_id] = seq
+
+    def step(self):
+        """解码一步：生成中的序列各 1 个 token，剩余的 batch 空间分给正在 prefill 的提示。返回是否有工作"""
+        self._admit()
+        for seq in list(self.running.values()):
+            if seq.request.cancelled:
+                self._finish(seq, "cancelled")
+        if not self.running:
+            return False
+
+        selected = []
+        budget = self.n_batch
+        # 生成中的序列 (只剩 1 个待处理 token) 先分 batch 空间，长提示的 prefill 不会拖慢它们
+        for seq in sorted(self.running.values(), key=lambda s: len(s.pending) > 1):
+            take = min(len(seq.pending), budget)
+            if take == 0:
+                break
+            done = take == len(seq.pending)
+            selected.append((seq, [(token, seq.pos + j, seq.seq_id, done and j == take - 1)
+                                   for j, token in enumerate(seq.pending[:take])], done))
+            seq.pos += take
+            del seq.pending[:take]
+            budget -= take
+        # batch 中的 token 按序列号排列：llama.cpp 按序列号连续的一段切分 ubatch，
+        # 按 running 的插入顺序排列 (槽位后进先出地复用) 时一步会被拆成多次解码
+        entries, owners = [], []
+        for seq, seq_entries, done in sorted(selected, key=lambda item: item[0].seq_id):
+            entries.extend(seq_entries)
+            if done:
+                owners.append((len(entries) - 1, seq))
+        self._decode(entries)
+
+        now = time.perf_counter()
+        for i, seq in owners:
+            request = seq.request
+            history = np.asarray(seq.history, dtype=np.intc)
+            token = sample_token(self._logits(i), request.params, history, request.rng, request.processor)
+            self._accept(seq, token, now)
+        self.metrics.record_step(len(owners))
+        return True
+
+    def _accept(self, seq, token, now):
+        request = seq.request
+        if token == self.eos:
+            self._finish(seq, "stop")
+            return
+        if request.first_token is None:
+            request.first_token = now
+        seq.history.append(token)
+        seq.generated.append(token)
+        request.n_tokens += 1
+        # 整段解码 (逐个 token 解码会丢掉 sentencepiece 的词首空格)；末尾不完整的 UTF-8 字符下一步再发
+        text = self.llm.detokenize(seq.generated).decode("utf-8", errors="ignore")
+        cut = min((text.find(s) for s in request.stop if s in text), default=-1)
+        if cut >= 0:
+            self._emit(seq, text[:cut])
+            self._finish(seq, "stop")
+            return
+        if request.n_tokens >= request.max_tokens or seq.pos >= self.seq_ctx:
+            self._emit(seq, text)
+            self._finish(seq, "length")
+            return
+        self._emit(seq, text[:len(text) - _stop_holdback(text, request.stop)])
+        seq.pending.append(token)
+
+    def _emit(self, seq, text):
+        if len(text) > seq.sent:
+            seq.request.post("text", text[seq.sent:])
+            seq.sent = len(text)
+
+    def _finish(self, seq, reason):
+        request = seq.request
+        self._seq_rm(seq.seq_id, -1, -1)
+        del self.running[seq.seq_id]
+        self.free_slots.append(seq.seq_id)
+        self.metrics.record_request(request, cancelled=reason == "cancelled")
+        request.post("done", reason)
+        if reason in ("stop", "length"):
+            ttft = (request.first_token - request.arrival) * 1000 if request.first_token else 0.0
+            elapsed = time.perf_counter() - (request.first_token or request.arrival)
+            rate = (request.n_tokens - 1) / elapsed if request.n_tokens > 1 and elapsed > 0 else 0.0
+            print(f"✅ {request.id}: 提示 {len(request.prompt_tokens)} token，生成 {request.n_tokens} token，"
+                  f"TTFT {ttft:.0f} ms，{rate:.1f} token/s，排队 {self.queue_depth}，进行中 {len(self.running)}")
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return value
+    raise RequestError("stop 必须是字符串或字符串列表")
+
+
+class CompletionServer:
+    """HTTP 层：解析请求、拼接提示、把 BatchEngine 的输出按 OpenAI 格式返回"""
+
+    def __init__(self, engine, model_name, token_mask=None, policy=None, knowledge=None, count_tokens=None):
+        self.engine = engine
+        self.model_name = model_name
+        self.token_mask = token_mask
+        self.policy = policy
+        self.knowledge = knowledge  # ObsidianLoader，None 表示不检索知识库
+        self.count_tokens = count_tokens
+
+    # ---- 提示 ----
+
+    def _retrieve(self, instruction, max_tokens):
+        """与 chat.py 相同：检索段落，按 token 预算拼成上下文 (在线程池中运行)"""
+        passages = self.knowledge.search_passages(instruction, expand=chat.GRAPH_EXPANSION)
+        overhead = self.count_tokens(chat.format_prompt(instruction, "-")) + 1
+        budget = max(0, min(chat.CONTEXT_TOKENS, self.engine.seq_ctx - overhead - max_tokens))
+        return pack_context(passages, budget, self.count_tokens)[0]
+
+    async def _chat_prompt(self, body, max_tokens):
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not messages:
+            raise RequestError("messages 不能为空")
+        user = [m.get("content") for m in messages if isinstance(m, dict) and m.get("role") == "user"]
+        if not user or not isinstance(user[-1], str):
+            raise RequestError("messages 中没有用户消息")
+        # 最后一条用户消息作为问题，system 消息作为补充资料放进上下文
+        instruction = user[-1].strip()
+        context = [m["content"] for m in messages if m.get("role") == "system" and isinstance(m.get("content"), str)]
+        if self.knowledge is not None and body.get("knowledge_base", True):
+            retrieved = await asyncio.to_thread(self._retrieve, instruction, max_tokens)
+            if retrieved:
+                context.append(retrieved)
+        return chat.format_prompt(instruction, "\n\n".join(context))
+
+    async def _make_request(self, body, is_chat):
+        if body.get("n", 1) != 1:
+            raise RequestError("只支持 n=1")
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or chat.BASE_PARAMS["max_tokens"]
+        if not isinstance(max_tokens, int) or max_tokens <= 0:
+            raise RequestError("max_tokens 必须是正整数")
+        if is_chat:
+            prompt = await self._chat_prompt(body, max_tokens)
+        else:
+            prompt = body.get("prompt")
+            if isinstance(prompt, list) and len(prompt) == 1:
+                prompt = prompt[0]
+            if not isinstance(prompt, str):
+                raise RequestError("prompt 必须是字符串")
+        tokens = self.engine.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+        if len(tokens) >= self.engine.seq_ctx:
+            raise RequestError(f"提示有 {len(tokens)} 个 token，超出每个请求的上下文长度 {self.engine.seq_ctx}")
+        params = dict(DEFAULT_SAMPLING)
+        for key in params:
+            if body.get(key) is not None:
+                if not isinstance(body[key], (int, float)):
+                    raise RequestError(f"{key} 必须是数字")
+                params[key] = body[key]
+        seed = body.get("seed")
+        if seed is not None and not isinstance(seed, int):
+            raise RequestError("seed 必须是整数")
+        stop = _as_list(body.get("stop")) + (chat.BASE_PARAMS["stop"] if is_chat else [])
+        processor = None
+        if is_chat and self.token_mask is not None and self.policy:
+            processor = self.token_mask.llama_processor(self.policy)
+        return GenerationRequest(asyncio.get_running_loop(), tokens,
+                                 min(max_tokens, self.engine.seq_ctx - len(tokens)), params, stop,
+                                 seed=seed, processor=processor)
+
+    # ---- 响应 ----
+
+    def _chunk(self, request, is_chat, text=None, finish_reason=None, created=None):
+        if is_chat:
+            delta = {"content": text} if text is not None else {}
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            kind = "chat.completion.chunk"
+        else:
+            choice = {"index": 0, "text": text or "", "logprobs": None, "finish_reason": finish_reason}
+            kind = "text_completion"
+        return {"id": ("chatcmpl-" if is_chat else "cmpl-") + request.id, "object": kind,
+                "created": created, "model": self.model_name, "choices": [choice]}
+
+    @staticmethod
+    def _usage(request):
+        n_prompt = len(request.prompt_tokens)
+        return {"prompt_tokens": n_prompt, "completion_tokens": request.n_tokens,
+                "total_tokens": n_prompt + request.n_tokens}
+
+    async def _complete(self, writer, body, is_chat):
+        request = await self._make_request(body, is_chat)
+        self.engine.submit(request)
+        created = int(time.time())
+        if body.get("stream"):
+            await _write_head(writer, HTTPStatus.OK, "text/event-stream", extra={"Cache-Control": "no-cache"})
+            try:
+                if is_chat:
+                    first = self._chunk(request, True, created=created)
+                    first["choices"][0]["delta"] = {"role": "assistant", "content": ""}
+                    await _write_event(writer, first)
+                while True:
+                    event = await request.events.get()
+                    if event[0] == "text":
+                        await _write_event(writer, self._chunk(request, is_chat, event[1], created=created))
+                    else:
+                        last = self._chunk(request, is_chat, finish_reason=event[1], created=created)
+                        last["usage"] = self._usage(request)
+                        await _write_event(writer, last)
+                        break
+                writer.write(b"data: [DONE]\n\n")
+                await writer.drain()
+            except (ConnectionError, asyncio.CancelledError):
+                request.cancelled = True  # 客户端断开，引擎在下一步释放槽位
+                raise
+            return
+
+        parts = []
+        try:
+            while True:
+                event = await request.events.get()
+                if event[0] == "text":
+                    parts.append(event[1])
+                else:
+                    finish_reason = event[1]
+                    break
+        except asyncio.CancelledError:
+            request.cancelled = True
+            raise
+        text = "".join(parts)
+        if is_chat:
+            choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}
+        else:
+            choice = {"index": 0, "text": text, "logprobs": None, "finish_reason": finish_reason}
+        response = {"id": ("chatcmpl-" if is_chat else "cmpl-") + request.id,
+                    "object": "chat.completion" if is_chat else "text_completion",
+                    "created": created, "model": self.model_name, "choices": [choice], "usage": self._usage(request)}
+        await _write_json(writer, HTTPStatus.OK, response)
+
+    # ---- HTTP ----
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, path, body = await _read_request(reader)
+                if method == "POST" and path in ("/v1/chat/completions", "/v1/completions"):
+                    await self._complete(writer, body, path == "/v1/chat/completions")
+                elif method == "GET" and path == "/v1/models":
+                    await _write_json(writer, HTTPStatus.OK, {"object": "list", "data": [
+                        {"id": self.model_name, "object": "model", "created": 0, "owned_by": "stylesphere"}]})
+                elif method == "GET" and path in ("/metrics", "/health"):
+                    engine = self.engine
+                    await _write_json(writer, HTTPStatus.OK, engine.metrics.snapshot(
+                        engine.queue_depth, len(engine.running), engine.n_seq))
+                else:
+                    raise RequestError(f"不支持 {method} {path}", HTTPStatus.NOT_FOUND)
+            except RequestError as e:
+                await _write_json(writer, e.status, {"error": {"message": str(e), "type": "invalid_request_error"}})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"❌ 处理请求出错: {str(e)}")
+        finally:
+            writer.close()
+
+
+async def _read_request(reader):
+    """读取一个 HTTP/1.1 请求，返回 (方法, 路径, JSON 请求体)；每个连接只处理一个请求"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise RequestError("请求头过长")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise RequestError("无法解析请求行")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_BODY_BYTES:
+        raise RequestError("请求体过大", HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    body = {}
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise RequestError("请求体不是合法的 JSON")
+        if not isinstance(body, dict):
+            raise RequestError("请求体必须是 JSON 对象")
+    return method.upper(), target.split("?", 1)[0], body
+
+
+async def _write_head(writer, status, content_type, length=None, extra=None):
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}", "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines += [f"{key}: {value}" for key, value in (extra or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+async def _write_json(writer, status, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await _write_head(writer, status, "application/json; charset=utf-8", len(data))
+    writer.write(data)
+    await writer.drain()
+
+
+async def _write_event(writer, payload):
+    writer.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+    await writer.drain()
+
+
+async def serve(server, host, port):
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"🚀 服务已启动：http://{host}:{port}/v1 ({server.engine.n_seq} 个并行序列，"
+          f"每个 {server.engine.seq_ctx} token 上下文)")
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的 StyleSphere 模型服务 (连续批处理)")
+    parser.add_argument("--model", default=chat.MODEL_PATH, help="gguf 模型文件或所在目录")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL, help="同时生成的请求数")
+    parser.add_argument("--seq-ctx", type=int, default=DEFAULT_SEQ_CTX, help="每个请求的上下文长度")
+    parser.add_argument("--n-gpu-layers", type=int, default=-1)
+    parser.add_argument("--constrained", choices=["hard", "soft", "none"],
+                        default=chat.CONSTRAINED_DECODING or "none", help="聊天请求的中文约束解码")
+    parser.add_argument("--vault", help="Obsidian vault 路径；指定时聊天请求会检索知识库")
+    args = parser.parse_args()
+    from llama_cpp import Llama
+
+    model_file = args.model if os.path.isfile(args.model) else chat.find_model_file(args.model)
+    if not model_file:
+        print(f"错误：在 {args.model} 中未找到.gguf模型文件")
+        return
+    print(f"加载模型: {os.path.basename(model_file)}...")
+    # 这个上下文只用来提供权重、分词和词表，生成在 BatchEngine 的多序列上下文中进行
+    llm = Llama(model_path=model_file, n_ctx=512, n_gpu_layers=args.n_gpu_layers, verbose=False)
+    policy = None if args.constrained == "none" else args.constrained
+    token_mask = TokenMask.from_llama(llm) if policy else None
+    knowledge = None
+    if args.vault:
+        knowledge = ObsidianLoader(args.vault, watch=True, embedder=load_embedder(chat.EMBEDDING_MODEL))
+
+    engine = BatchEngine(llm, n_seq=args.parallel, seq_ctx=args.seq_ctx)
+    engine.start()
+    server = CompletionServer(engine, os.path.splitext(os.path.basename(model_file))[0], token_mask, policy,
+                              knowledge, llama_token_counter(llm))
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        if knowledge is not None:
+            knowledge.close()
+
+
+if __name__ == "__main__":
+    main()
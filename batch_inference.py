@@ -0,0 +1,237 @@
+"""
+llama.cpp 批量离线推理
+
+原来的 inference_llama_cpp.main 逐条生成、逐条打开 results.jsonl 追加，
+中途崩溃只能从头再跑，结果文件里还会出现重复记录。这里提供：
+  - 多个工作线程，每个线程持有自己的 Llama 上下文 (llama-cpp-python 通过 ctypes 调用时会释放 GIL，
+    各上下文可以真正并行)；上下文数量受 CPU 核数和可用内存约束；
+  - 一个写入线程，用缓冲写把结果流式追加到同一个文件句柄，定期 flush + fsync；
+  - 按样本 id 做断点续跑：启动时读取已有结果文件中的 id，已完成的样本直接跳过；
+  - 结束时报告 items/s 和 tokens/s。
+
+CPU 推理时各上下文通过 mmap 共享同一份模型权重，每多一个上下文只增加 KV 缓存等开销；
+GPU 全量 offload 时每个上下文都会在显存里各加载一份权重，所以默认只开一个上下文。
+"""
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from tqdm import tqdm
+
+# 每个上下文 (KV 缓存 + 计算缓冲区) 大约占用的内存，7B 模型 n_ctx=2048 时约 1~1.5GB
+CONTEXT_RAM_BYTES = 3 << 29
+# 每个上下文至少使用的线程数
+MIN_THREADS_PER_CONTEXT = 4
+# 写入线程每攒够这么多条或者隔这么久就 flush 一次
+FLUSH_EVERY_ITEMS = 32
+FLUSH_EVERY_SECONDS = 5.0
+
+
+def item_id(item):
+    """样本 id：优先使用数据里的 id 字段，否则用 instruction + input 的哈希"""
+    if item.get("id") is not None:
+        return str(item["id"])
+    payload = json.dumps([item.get("instruction", ""), item.get("input", "")], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_finished_ids(path):
+    """读取结果文件中已完成的样本 id，忽略崩溃时写了一半的最后一行"""
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "id" in record:
+                finished.add(record["id"])
+    return finished
+
+
+def _repair_tail(path):
+    """结果文件不以换行结尾时 (上次写到一半崩溃)，补一个换行，避免新记录接在坏行后面"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def _available_ram():
+    """可用物理内存 (字节)，平台不支持时返回 None"""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def plan_contexts(requested=None, n_gpu_layers=0, cpu_count=None, available_ram=None):
+    """决定并行上下文数和每个上下文的线程数，返回 (contexts, threads_per_context)"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    if requested:
+        contexts = requested
+    elif n_gpu_layers:
+        # 每个上下文都会在显存中各加载一份权重
+        contexts = 1
+    else:
+        contexts = max(1, cpu_count // MIN_THREADS_PER_CONTEXT)
+        if available_ram is None:
+            available_ram = _available_ram()
+        if available_ram is not None:
+            contexts = max(1, min(contexts, available_ram // CONTEXT_RAM_BYTES))
+    threads = max(1, cpu_count // contexts)
+    return contexts, threads
+
+
+class ResultWriter(threading.Thread):
+    """唯一的写入线程：从队列取结果，缓冲写入 JSONL 文件"""
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.queue = queue.Queue()
+        self.written = 0
+
+    def run(self):
+        _repair_tail(self.path)
+        pending = 0
+        last_flush = time.monotonic()
+        with open(self.path, "a", encoding="utf-8", buffering=1 << 20) as f:
+            while True:
+                try:
+                    record = self.queue.get(timeout=FLUSH_EVERY_SECONDS)
+                except queue.Empty:
+                    record = None
+                    if not pending:
+                        continue
+                else:
+                    if record is _STOP:
+                        break
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    self.written += 1
+                    pending += 1
+                if pending >= FLUSH_EVERY_ITEMS or time.monotonic() - last_flush >= FLUSH_EVERY_SECONDS:
+                    self._sync(f)
+                    pending = 0
+                    last_flush = time.monotonic()
+            self._sync(f)
+
+    @staticmethod
+    def _sync(f):
+        # fsync 之后这些 id 才算真正完成，崩溃重跑时不会丢失也不会重复
+        f.flush()
+        os.fsync(f.fileno())
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.join()
+
+
+_STOP = object()
+
+
+class BatchStats:
+    """线程安全的吞吐统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.start = time.perf_counter()
+
+    def add(self, usage):
+        with self._lock:
+            self.items += 1
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+
+    def add_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (f"完成 {self.items} 条 (失败 {self.failed})，用时 {elapsed:.1f}s，"
+                f"{self.items / elapsed:.2f} items/s，"
+                f"生成 {self.completion_tokens / elapsed:.1f} tokens/s，"
+                f"prompt {self.prompt_tokens / elapsed:.1f} tokens/s")
+
+
+def run_batch(items, make_llm, generate, output_path, contexts=1):
+    """并行处理 items，结果流式写入 output_path
+
+    make_llm(): 在工作线程内创建该线程独占的 Llama 上下文 (以及需要的前缀缓存等)，返回任意对象
+    generate(worker, item): 用 worker 生成一条结果，返回 (record, usage)，
+        record 为写入结果文件的 dict，usage 为 completion["usage"]
+    已经写入 output_path 的样本 (按 item_id) 会被跳过。返回 BatchStats。
+    """
+    finished = load_finished_ids(output_path)
+    todo = queue.Queue()
+    skipped = 0
+    for item in items:
+        key = item_id(item)
+        if key in finished:
+            skipped += 1
+            continue
+        finished.add(key)  # 数据中重复的样本只处理一次
+        todo.put((key, item))
+    total = todo.qsize()
+    print(f"📋 共 {total + skipped} 条，已完成 {skipped} 条，本次处理 {total} 条，使用 {contexts} 个上下文")
+
+    stats = BatchStats()
+    if total == 0:
+        return stats
+
+    writer = ResultWriter(output_path)
+    writer.start()
+    progress = tqdm(total=total)
+    errors = []
+
+    def work():
+        try:
+            worker = make_llm()
+        except Exception as e:
+            errors.append(e)
+            return
+        while True:
+            try:
+                key, item = todo.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                record, usage = generate(worker, item)
+            except Exception as e:
+                stats.add_failure()
+                tqdm.write(f"生成过程中出错 ({key}): {e}")
+            else:
+                writer.put({"id": key, **record})
+                stats.add(usage or {})
+            progress.update(1)
+        if hasattr(worker, "close"):
+            worker.close()
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(contexts)]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    finally:
+        # Ctrl+C 时也把已经生成的结果写完
+        writer.close()
+        progress.close()
+    if errors and stats.items == 0 and stats.failed == 0:
+        raise errors[0]
+    return stats
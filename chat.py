@@ -1,12 +1,28 @@
-from llama_cpp import Llama
+from llama_cpp import Llama, LogitsProcessorList
 from obsidian_loader import ObsidianLoader
+from dense_index import load_embedder
+from passages import llama_token_counter, pack_context
+from stream_validator import StreamValidator, stream_completion
+from cjk_logits import TokenMask
+from multi_candidate import MultiCandidateGenerator
 import os
 import re
-import unicodedata
+import text_classify
 
 # 配置参数
 MODEL_PATH = "E:/R1/TheBloke/Llama-2-7B-Chat-GGUF"  # 替换为你的模型路径
 OBSIDIAN_VAULT = "E:/kubook"  # Obsidian vault 路径
+OBSIDIAN_WATCH = True  # 对话期间在后台监听笔记变化并增量更新索引
+# 知识库向量检索用的 GGUF 嵌入模型 (中文可用 bge-small-zh 等)；文件不存在时只用关键词检索
+EMBEDDING_MODEL = "E:/R1/embedding/bge-small-zh-v1.5-q8_0.gguf"
+CONSTRAINED_DECODING = "hard"  # 中文约束解码：hard / soft / None (关闭，只靠生成后检查和重新生成)
+# 多候选并行生成 (一次 prefill，各温度的候选一起解码)；会关闭实时输出。
+# 约束解码已经保证了语言，通常第一个候选就合格，所以只在关闭约束解码时默认开启
+MULTI_CANDIDATE = CONSTRAINED_DECODING is None
+STREAM_CHECK_WINDOW = 48  # 流式生成时，生成这么多个有效字符后开始检查，不合格立即中止
+CONTEXT_TOKENS = 640  # 知识库上下文最多占用的 token 数 (用模型的分词器计数)
+MIN_ANSWER_TOKENS = 512  # 上下文之外至少给回答留这么多 token
+GRAPH_EXPANSION = 2  # 再从与命中笔记相链接 ([[链接]]、共同标签) 的笔记中补充这么多篇参与段落打分
 
 def find_model_file(model_dir):
     """在指定目录中查找.gguf模型文件"""
@@ -59,28 +75,24 @@ def format_prompt(instruction, context=""):
     prompt += f"{instruction} [/INST]"
     return prompt
 
+def context_budget(llm, instruction, count_tokens):
+    """知识库上下文的 token 预算：不超过 CONTEXT_TOKENS，并保证 n_ctx 里还能放下 MIN_ANSWER_TOKENS 的回答"""
+    overhead = count_tokens(format_prompt(instruction, "-")) + 1  # 加上 BOS
+    return max(0, min(CONTEXT_TOKENS, llm.n_ctx() - overhead - MIN_ANSWER_TOKENS))
+
 def is_chinese_character(char):
     """判断一个字符是否是中文字符"""
-    return 'CJK UNIFIED IDEOGRAPH' in unicodedata.name(char, '')
+    return text_classify.is_ideograph(char)
 
 def is_chinese_sentence(text):
     """检查一段文本是否主要由中文组成"""
-    # 去除空白字符和标点符号
-    text = ''.join(char for char in text if not char.isspace() and not unicodedata.category(char).startswith('P'))
-    if not text:
-        return True  # 空文本视为有效
-    
-    # 提取可能的英文专业术语（括号内的内容和单个单词）
-    terms = re.findall(r'\([^)]*\)|[a-zA-Z]+', text)
-    # 移除这些术语
-    for term in terms:
-        text = text.replace(term, '')
-    
-    if not text:  # 如果移除术语后为空，说明都是合法术语
+    # 去除空白字符、标点符号和英文专业术语 (英文单词)，一次查表完成
+    text = text_classify.drop(text, text_classify.PUNCT | text_classify.SPACE | text_classify.LATIN)
+    if not text:  # 空文本或全是合法术语，视为有效
         return True
     
     # 计算中文字符的比例
-    chinese_chars = sum(1 for char in text if is_chinese_character(char))
+    chinese_chars = text_classify.count(text, text_classify.IDEOGRAPH)
     total_chars = len(text)
     
     # 如果中文字符占比超过50%，认为是中文句子
@@ -88,14 +100,7 @@ def is_chinese_sentence(text):
 
 def contains_emoji(text):
     """检查文本是否包含表情符号"""
-    try:
-        # 使用 unicodedata 检查字符类别
-        for char in text:
-            if 'EMOJI' in unicodedata.name(char, '') or 'EMOTICON' in unicodedata.name(char, ''):
-                return True
-        return False
-    except:
-        return False
+    return text_classify.contains_emoji(text)
 
 def filter_response(text):
     """过滤响应文本，优化中文输出"""
@@ -110,13 +115,10 @@ def filter_response(text):
                .strip())
     
     # 2. 处理表情符号
-    if contains_emoji(text):
-        text = ''.join(char for char in text if not ('EMOJI' in unicodedata.name(char, '') or 'EMOTICON' in unicodedata.name(char, '')))
+    text = text_classify.strip_emoji(text)
     
-    # 3. 分析中文内容比例
-    pure_text = ''.join(char for char in text if not unicodedata.category(char).startswith('P') and not char.isspace())
-    chinese_chars = sum(1 for char in pure_text if '\u4e00' <= char <= '\u9fff')
-    total_chars = len(pure_text)
+    # 3. 分析中文内容比例 (不计标点和空白)
+    chinese_chars, total_chars = text_classify.content_counts(text)
     
     if total_chars > 0 and chinese_chars / total_chars < 0.4:  # 降低阈值到40%
         return None, True
@@ -159,83 +161,136 @@ def filter_response(text):
     
     result = re.sub(r'([A-Za-z]+)[（(]([^)）]+)[)）]', format_term, result)
     
-    # 清理不需要的字符
-    allowed_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 \n。，、；：？！…—·ˉ¨''""々～‖∶＂＇｀｜〃〔〕〈〉《》「」『』．（）-')
-    result = ''.join(char for char in result if char in allowed_chars or '\u4e00' <= char <= '\u9fff')
+    # 清理不需要的字符 (只保留汉字和 text_classify.ALLOWED_CHARS)
+    result = text_classify.strip_disallowed(result)
     
     return result, False
 
-def enforce_chinese_response(llm, prompt, max_attempts=3):
-    """强制生成优质的中文回答"""
+# 生成参数配置
+BASE_PARAMS = {
+    "max_tokens": 1024,  # 增加最大token数
+    "top_p": 0.95,  # 稍微提高采样范围
+    "top_k": 50,    # 增加top_k值
+    "repeat_penalty": 1.2,  # 增加重复惩罚
+    "stop": ["[INST]", "[/INST]", "<<SYS>>", "<</SYS>>"],
+    "echo": False
+}
+
+# 不同的参数组合
+PARAM_VARIATIONS = [
+    {"temperature": 0.7},  # 第一次尝试：较高创造性
+    {"temperature": 0.5},  # 第二次尝试：平衡
+    {"temperature": 0.3},  # 第三次尝试：更保守
+]
+
+FALLBACK_ANSWER = "让我告诉您关于《塞尔达传说》系列游戏的情况。这是任天堂最著名的游戏系列之一，以其独特的冒险体验和创新玩法而闻名。最新作品是《王国之泪》，它延续了旷野之息的开放世界设计，同时加入了更多新玩法。您想了解哪些具体方面？"
+
+def score_response(answer, min_length=30):
+    """对一个候选回答评分
+
+    返回 (分数, 过滤后的文本, 中文比例, 有效句子数)，不合格时返回 None。
+    分数 = 中文比例 + 0.1 × 有效句子数 (至少 5 个字符的句子)。
+    """
+    if not answer:
+        return None
+    # 过滤和检查答案
+    filtered_answer, needs_regeneration = filter_response(answer.strip())
+    if needs_regeneration or not filtered_answer or len(filtered_answer) < min_length:
+        return None
+
+    # 计算中文字符比例
+    chinese_ratio = text_classify.chinese_ratio(filtered_answer)
+    if chinese_ratio is None:
+        return None
+
+    # 检查句子完整性
+    sentences = re.split(r'[。！？]', filtered_answer)
+    valid_sentences = [s.strip() for s in sentences if len(s.strip()) >= 5]  # 确保句子有实际内容
+    if len(valid_sentences) < 1:  # 降低句子数量要求
+        return None
+
+    score = chinese_ratio + 0.1 * len(valid_sentences)  # 根据句子数量加分
+    return score, filtered_answer, chinese_ratio, len(valid_sentences)
+
+def is_good_enough(chinese_ratio, n_sentences):
+    """达到这个质量就不再尝试其他候选"""
+    return chinese_ratio > 0.6 and n_sentences >= 2  # 降低标准
+
+def make_response(text, streamed=False):
+    return {
+        "choices": [{
+            "text": text,
+            "index": 0,
+            "logprobs": None,
+            "finish_reason": "stop"
+        }],
+        "streamed": streamed
+    }
+
+def enforce_chinese_response(llm, prompt, max_attempts=3, on_text=None, window=STREAM_CHECK_WINDOW,
+                             token_mask=None, policy=CONSTRAINED_DECODING, generator=None):
+    """强制生成优质的中文回答
+
+    使用流式生成，StreamValidator 在生成过程中检查中文比例、表情符号和句子状态，
+    生成 window 个有效字符后一旦不合格就中止本次尝试，不必等满 1024 个 token。
+    on_text(text) 用于把通过检查的文本实时输出；返回的结果中 "streamed" 为 True
+    表示最终答案就是最后一次实时输出的内容，不需要再打印一遍。
+    提供 token_mask (cjk_logits.TokenMask) 时在解码阶段直接约束中文输出，
+    第一次通过检查的回答即被采用，重新生成只在回答过短等情况下发生。
+    提供 generator (multi_candidate.MultiCandidateGenerator) 时改为一次 prefill、
+    多个候选并行生成后再评分 (不再实时输出)。
+    """
     best_response = None
     max_chinese_ratio = 0
     min_length = 30  # 降低最小回答长度要求
+    last_streamed = None  # 最后一次向终端输出内容的尝试
+    best_attempt = None
     
-    # 生成参数配置
-    base_params = {
-        "max_tokens": 1024,  # 增加最大token数
-        "top_p": 0.95,  # 稍微提高采样范围
-        "top_k": 50,    # 增加top_k值
-        "repeat_penalty": 1.2,  # 增加重复惩罚
-        "stop": ["[INST]", "[/INST]", "<<SYS>>", "<</SYS>>"],
-        "echo": False
-    }
-    
-    # 不同的参数组合
-    param_variations = [
-        {"temperature": 0.7},  # 第一次尝试：较高创造性
-        {"temperature": 0.5},  # 第二次尝试：平衡
-        {"temperature": 0.3},  # 第三次尝试：更保守
-    ]
-    
+    if generator is not None:
+        return parallel_candidates_response(generator, prompt, token_mask, policy, min_length)
+
     for attempt in range(max_attempts):
         try:
             # 更新生成参数
-            generation_params = base_params.copy()
-            generation_params.update(param_variations[attempt])
-            
-            # 生成回答
-            response = llm(prompt, **generation_params)
-            
-            if isinstance(response, dict) and "choices" in response:
-                answer = response["choices"][0]["text"].strip()
-                
-                # 过滤和检查答案
-                filtered_answer, needs_regeneration = filter_response(answer)
-                
-                if not needs_regeneration and filtered_answer and len(filtered_answer) >= min_length:
-                    # 计算中文字符比例
-                    pure_text = ''.join(char for char in filtered_answer if '\u4e00' <= char <= '\u9fff')
-                    total_text = ''.join(char for char in filtered_answer if not (unicodedata.category(char).startswith('P') or char.isspace()))
-                    
-                    if len(total_text) > 0:
-                        chinese_ratio = len(pure_text) / len(total_text)
-                        
-                        # 评分标准
-                        score = chinese_ratio
-                        
-                        # 检查句子完整性
-                        sentences = re.split(r'[。！？]', filtered_answer)
-                        valid_sentences = [s.strip() for s in sentences if len(s.strip()) >= 5]  # 确保句子有实际内容
-                        
-                        if len(valid_sentences) >= 1:  # 降低句子数量要求
-                            score += 0.1 * len(valid_sentences)  # 根据句子数量加分
-                            
-                            # 更新最佳答案
-                            if score > max_chinese_ratio:
-                                max_chinese_ratio = score
-                                best_response = {
-                                    "choices": [{
-                                        "text": filtered_answer,
-                                        "index": 0,
-                                        "logprobs": None,
-                                        "finish_reason": "stop"
-                                    }]
-                                }
-                                
-                                # 如果达到较好质量，直接返回
-                                if chinese_ratio > 0.6 and len(valid_sentences) >= 2:  # 降低标准
-                                    return best_response
+            generation_params = BASE_PARAMS.copy()
+            generation_params.update(PARAM_VARIATIONS[attempt])
+            if token_mask is not None and policy:
+                # 每次生成都需要新的处理器
+                generation_params["logits_processor"] = LogitsProcessorList([token_mask.llama_processor(policy)])
+
+            streamed = []
+
+            def emit(text):
+                streamed.append(text)
+                if on_text:
+                    on_text(text)
+
+            # 流式生成回答，不合格时提前中止
+            validator = StreamValidator(window=window)
+            answer, n_tokens = stream_completion(llm, prompt, validator, emit, **generation_params)
+            if streamed:
+                last_streamed = attempt
+
+            if validator.failed:
+                print(f"\n⚠️ 第 {attempt+1} 次生成在 {n_tokens} 个 token 后中止：{validator.reason}")
+                continue
+
+            scored = score_response(answer, min_length)
+            if scored is not None:
+                score, filtered_answer, chinese_ratio, n_sentences = scored
+                # 更新最佳答案
+                if score > max_chinese_ratio:
+                    max_chinese_ratio = score
+                    best_attempt = attempt
+                    best_response = make_response(filtered_answer)
+
+                    # 如果达到较好质量，直接返回 (约束解码时语言已经有保证，不再为了分数重新生成)
+                    if is_good_enough(chinese_ratio, n_sentences) or token_mask is not None:
+                        best_response["streamed"] = best_attempt == last_streamed
+                        return best_response
+
+            if streamed and attempt + 1 < max_attempts:
+                print(f"\n⚠️ 第 {attempt+1} 次回答质量不足，尝试重新生成...")
                                 
         except Exception as e:
             print(f"生成过程出错 (尝试 {attempt+1}/{max_attempts}): {str(e)}")
@@ -243,22 +298,38 @@ def enforce_chinese_response(llm, prompt, max_attempts=3):
     
     # 返回最佳结果或默认回答
     if best_response is not None:
+        best_response["streamed"] = best_attempt == last_streamed
         return best_response
     
     # 如果所有尝试都失败，返回一个更具体的回答
-    return {
-        "choices": [{
-            "text": "让我告诉您关于《塞尔达传说》系列游戏的情况。这是任天堂最著名的游戏系列之一，以其独特的冒险体验和创新玩法而闻名。最新作品是《王国之泪》，它延续了旷野之息的开放世界设计，同时加入了更多新玩法。您想了解哪些具体方面？",
-            "index": 0,
-            "logprobs": None,
-            "finish_reason": "stop"
-        }]
-    }
+    return make_response(FALLBACK_ANSWER)
+
+def parallel_candidates_response(generator, prompt, token_mask=None, policy=CONSTRAINED_DECODING, min_length=30):
+    """提示只 prefill 一次，PARAM_VARIATIONS 中的各组参数并行生成候选，用 score_response 选出最佳"""
+    params_list = [dict(BASE_PARAMS, **variation) for variation in PARAM_VARIATIONS[:generator.n_seq]]
+    processors = None
+    if token_mask is not None and policy:
+        processors = [token_mask.llama_processor(policy) for _ in params_list]
+    try:
+        candidates = generator.generate(prompt, params_list, max_tokens=BASE_PARAMS["max_tokens"],
+                                        stop=BASE_PARAMS["stop"], logits_processors=processors)
+    except Exception as e:
+        print(f"并行生成出错: {str(e)}")
+        candidates = []
+
+    best = None
+    for candidate in candidates:
+        scored = score_response(candidate["text"], min_length)
+        if scored is not None and (best is None or scored[0] > best[0]):
+            best = scored
+    if best is not None:
+        return make_response(best[1])
+    return make_response(FALLBACK_ANSWER)
 
 def main():
     # 初始化 Obsidian 加载器
     print("初始化 Obsidian 知识库...")
-    obsidian = ObsidianLoader(OBSIDIAN_VAULT)
+    obsidian = ObsidianLoader(OBSIDIAN_VAULT, watch=OBSIDIAN_WATCH, embedder=load_embedder(EMBEDDING_MODEL))
     
     # 加载模型
     model_file = find_model_file(MODEL_PATH)
@@ -279,51 +350,58 @@ def main():
         embedding=False,  # 禁用嵌入层，减少内存使用
         verbose=True
     )
+
+    # 词表分类只在第一次加载该模型时计算，之后从缓存读取
+    token_mask = TokenMask.from_llama(llm) if CONSTRAINED_DECODING else None
+    generator = MultiCandidateGenerator(llm, n_seq=len(PARAM_VARIATIONS)) if MULTI_CANDIDATE else None
+    count_tokens = llama_token_counter(llm)
     
     print("\n知识库助手已就绪！输入 'quit' 退出。")
     
-    def truncate_text(text, max_chars=1000):
-        """截断过长的文本"""
-        if len(text) <= max_chars:
-            return text
-        return text[:max_chars] + "..."
-    
     while True:
         user_input = input("\n请输入您的问题: ").strip()
         
         if user_input.lower() == 'quit':
+            obsidian.close()
+            print(f"📚 检索结果缓存：{obsidian.result_cache.summary()}")
+            if obsidian.dense is not None:
+                print(f"🧭 查询向量缓存：{obsidian.dense.embedding_cache.summary()}")
             break
             
         if not user_input:
             continue
             
         try:
-            # 搜索相关文档
+            # 搜索相关段落
             print("搜索知识库中...")
-            relevant_docs = obsidian.search_documents(user_input)
-            context = ""
-            
-            if relevant_docs:
-                print(f"找到 {len(relevant_docs)} 个相关文档")
-                context = "\n\n".join([
-                    f"文档：{doc['title']}\n{truncate_text(doc['content'], 300)}"
-                    for doc in relevant_docs[:2]  # 限制为最相关的2个文档
-                ])
-            else:
-                print("未找到相关文档，将使用模型直接回答")
+            passages = obsidian.search_passages(user_input, expand=GRAPH_EXPANSION)
             
             # 处理用户输入，移除潜在的特殊字符
-            user_input = re.sub(r'[\U0001F300-\U0001F9FF]', '', user_input)
+            user_input = text_classify.strip_emoji(user_input)
             user_input = user_input.strip()
             
+            # 按分数挑选段落，恰好填满上下文预算
+            context = ""
+            if passages:
+                budget = context_budget(llm, user_input, count_tokens)
+                context, used, selected = pack_context(passages, budget, count_tokens)
+                n_notes = len({p["path"] for p in selected})
+                print(f"找到 {len(selected)} 个相关段落 (来自 {n_notes} 篇笔记，{used}/{budget} token)")
+            else:
+                print("未找到相关文档，将使用模型直接回答")
+            
             # 生成提示
             prompt = format_prompt(user_input, context)
             
-            # 强制生成纯中文回答
-            print("\n生成回答中...")
-            response = enforce_chinese_response(llm, prompt)
+            # 强制生成纯中文回答，通过检查的文本实时输出
+            print("\n生成回答中..." if generator else "\n回答：")
+            response = enforce_chinese_response(llm, prompt, on_text=lambda text: print(text, end="", flush=True),
+                                                token_mask=token_mask, generator=generator)
             
-            if isinstance(response, dict) and "choices" in response:
+            if isinstance(response, dict) and response.get("streamed"):
+                # 最终答案已经实时输出过了
+                print()
+            elif isinstance(response, dict) and "choices" in response:
                 answer = response["choices"][0]["text"].strip()
                 
                 # 规范化专业术语
@@ -335,9 +413,9 @@ def main():
                 # 查找并规范化格式：术语(描述) 或 术语（描述）
                 answer = re.sub(r'([A-Za-z]+)[（(]([^)）]+)[)）]', format_term, answer)
                 
-                # 分段展示
+                # 分段展示 (实时输出的内容被中止或不是最佳答案时重新打印)
                 paragraphs = answer.split('\n')
-                print("\n回答：")
+                print("\n最终回答：")
                 for para in paragraphs:
                     if para.strip():
                         print(para.strip())
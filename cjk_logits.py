@@ -0,0 +1,320 @@
+"""
+中文约束解码：预先计算的词表掩码 + 每步向量化的 logits 偏置
+
+chat.py / inference_llama_cpp.py 原来在生成结束后才用 filter_response、contains_emoji、
+is_chinese_sentence 检查"只用中文、没有表情、没有英文句子"，不合格就整段重新生成。
+这里在加载模型时把词表中的每个 token 分一次类 (中文、中文标点、ASCII 字母、表情、其他文字、
+特殊 token、不完整的 UTF-8 字节片段)，结果作为 uint8 位掩码缓存成 .npy；
+生成时每一步只需要把预先算好的偏置向量加到 logits 上：
+  - soft: 压低表情、其他文字和英文 token 的概率，略微提高中文 token；
+  - hard: 直接禁止表情和其他文字；英文 token 连续超过 max_latin_run 个 (不再是 LLaMA 这类术语，
+    而是英文句子) 时禁止所有英文 token，直到再次出现中文。
+
+特殊 token (EOS 等) 和不完整的字节片段 (Llama 2 的 <0xE4>、Llama 3 的字节级 BPE 片段) 从不被限制，
+否则中文字符本身就无法生成。
+
+llama.cpp: Llama(..., logits_processor=LogitsProcessorList([mask.llama_processor("hard")]))
+transformers: model.generate(..., logits_processor=LogitsProcessorList([mask.hf_processor("hard")]))
+每次生成都要创建新的处理器 (处理器记录了本次生成的状态)。
+
+查看词表分类和每步开销：python cjk_logits.py --model path/to/model.gguf
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from text_classify import is_emoji
+
+# 分类逻辑改变时递增，让旧的缓存失效
+CLASSIFIER_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "token_masks")
+
+# token 类别位
+CJK = 1            # 含中文汉字
+CJK_PUNCT = 2      # 含中文 (全角) 标点
+LATIN = 4          # 含 ASCII 字母
+EMOJI = 8          # 含表情符号
+OTHER_SCRIPT = 16  # 含其他文字 (西里尔字母、假名、韩文等)
+SPECIAL = 32       # 特殊 / 控制 token
+PARTIAL = 64       # 不完整的 UTF-8 字节片段
+
+CLASS_NAMES = {CJK: "中文", CJK_PUNCT: "中文标点", LATIN: "英文字母", EMOJI: "表情",
+               OTHER_SCRIPT: "其他文字", SPECIAL: "特殊", PARTIAL: "字节片段"}
+
+NEG_INF = float("-inf")
+# 偏置策略：各类 token 的 logits 加成，max_latin_run 为允许的最长连续英文 token 数
+POLICIES = {
+    "soft": {"emoji": -10.0, "other_script": -5.0, "latin": -1.0, "cjk": 0.5, "max_latin_run": None},
+    "hard": {"emoji": NEG_INF, "other_script": NEG_INF, "latin": -1.5, "cjk": 0.0, "max_latin_run": 6},
+}
+
+_CJK_PUNCT_EXTRA = set("‘’“”…—·")
+
+
+def _char_class(char):
+    code = ord(char)
+    if 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0xF900 <= code <= 0xFAFF or 0x20000 <= code <= 0x2FFFF:
+        return CJK
+    if 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF or char in _CJK_PUNCT_EXTRA:
+        return CJK_PUNCT
+    if char.isascii():
+        return LATIN if char.isalpha() else 0
+    if code == 0xFFFD:
+        return PARTIAL
+    if is_emoji(char):
+        return EMOJI
+    if char.isalpha():
+        return OTHER_SCRIPT
+    return 0
+
+
+def classify_token_bytes(data):
+    """对一个 token 的原始字节分类，返回类别位的组合"""
+    if not data:
+        return SPECIAL
+    text = data.decode("utf-8", errors="replace")
+    flags = 0
+    for char in text:
+        flags |= _char_class(char)
+    return flags
+
+
+def classify_token_text(text):
+    """对解码后的 token 文本分类 (不完整的字节会被解码成 U+FFFD)"""
+    flags = 0
+    for char in text:
+        flags |= _char_class(char)
+    return flags
+
+
+def _load_or_classify(key, classify_fn, cache_dir):
+    path = os.path.join(cache_dir, f"{key}.npy")
+    if os.path.exists(path):
+        return np.load(path)
+    classes = classify_fn()
+    os.makedirs(cache_dir, exist_ok=True)
+    # 多个线程/进程同时构建时各写各的临时文件，最后原子替换
+    tmp_path = f"{path}.tmp{os.getpid()}_{id(classes)}.npy"
+    np.save(tmp_path, classes)
+    os.replace(tmp_path, path)
+    return classes
+
+
+class TokenMask:
+    """词表中每个 token 的类别位 (uint8 数组)，以及由它生成的偏置向量"""
+
+    def __init__(self, classes):
+        self.classes = np.asarray(classes, dtype=np.uint8)
+        self._bias_cache = {}
+
+    @classmethod
+    def from_llama(cls, llm, cache_dir=DEFAULT_CACHE_DIR):
+        """从 llama_cpp.Llama 的词表构建，按模型文件 (路径、大小、修改时间) 缓存"""
+        n_vocab = llm.n_vocab()
+        stat = os.stat(llm.model_path)
+        key = hashlib.sha256(json.dumps(
+            [os.path.abspath(llm.model_path), stat.st_size, stat.st_mtime_ns, n_vocab, CLASSIFIER_VERSION]
+        ).encode("utf-8")).hexdigest()[:24]
+
+        def classify():
+            classes = np.zeros(n_vocab, dtype=np.uint8)
+            for token in range(n_vocab):
+                try:
+                    # special=False 时控制 token 解码为空
+                    data = llm.detokenize([token], special=False)
+                except TypeError:
+                    data = llm.detokenize([token])
+                classes[token] = classify_token_bytes(data)
+            for token in (llm.token_bos(), llm.token_eos()):
+                if 0 <= token < n_vocab:
+                    classes[token] = SPECIAL
+            return classes
+
+        return cls(_load_or_classify(key, classify, cache_dir))
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer, cache_dir=DEFAULT_CACHE_DIR):
+        """从 transformers 分词器构建，按分词器指纹缓存"""
+        from dataset_cache import tokenizer_hash
+
+        n_vocab = len(tokenizer)
+        key = hashlib.sha256(f"{tokenizer_hash(tokenizer)}:{n_vocab}:{CLASSIFIER_VERSION}".encode("utf-8")).hexdigest()[:24]
+
+        def classify():
+            classes = np.zeros(n_vocab, dtype=np.uint8)
+            special_ids = set(tokenizer.all_special_ids)
+            for token in range(n_vocab):
+                if token in special_ids:
+                    classes[token] = SPECIAL
+                    continue
+                text = tokenizer.decode([token], skip_special_tokens=False, clean_up_tokenization_spaces=False)
+                classes[token] = classify_token_text(text) if text else SPECIAL
+            # 添加的 token (<|eot_id|> 等) 也视为特殊 token
+            for token in tokenizer.get_added_vocab().values():
+                if 0 <= token < n_vocab:
+                    classes[token] = SPECIAL
+            return classes
+
+        return cls(_load_or_classify(key, classify, cache_dir))
+
+    def counts(self):
+        """各类别的 token 数"""
+        return {name: int(np.count_nonzero(self.classes & bit)) for bit, name in CLASS_NAMES.items()}
+
+    def biases(self, policy):
+        """返回 (普通情况的偏置向量, 禁止英文时的偏置向量)，均为 float32"""
+        if policy in self._bias_cache:
+            return self._bias_cache[policy]
+        params = POLICIES[policy]
+        c = self.classes
+        # 字节片段和特殊 token 始终不加偏置
+        free = (c & (SPECIAL | PARTIAL)) != 0
+        bias = np.zeros(len(c), dtype=np.float32)
+        bias[(c & LATIN) != 0] = params["latin"]
+        bias[(c & CJK) != 0] = params["cjk"]
+        bias[(c & OTHER_SCRIPT) != 0] = params["other_script"]
+        bias[(c & EMOJI) != 0] = params["emoji"]
+        bias[free] = 0.0
+        banned = bias.copy()
+        banned[((c & LATIN) != 0) & ((c & CJK) == 0) & ~free] = NEG_INF
+        self._bias_cache[policy] = (bias, banned)
+        return bias, banned
+
+    def run_deltas(self):
+        """每个 token 对"连续英文 token 数"的影响：1 表示计数，-1 表示清零 (中文)，0 表示不变"""
+        c = self.classes
+        delta = np.zeros(len(c), dtype=np.int8)
+        delta[(c & LATIN) != 0] = 1
+        delta[(c & (CJK | CJK_PUNCT)) != 0] = -1
+        return delta
+
+    def llama_processor(self, policy="hard"):
+        return LlamaCJKProcessor(self, policy)
+
+    def hf_processor(self, policy="hard"):
+        return HFCJKProcessor(self, policy)
+
+
+class LlamaCJKProcessor:
+    """llama-cpp-python 的 logits 处理器：processor(input_ids, scores) -> scores"""
+
+    def __init__(self, mask, policy="hard"):
+        self.bias, self.banned = mask.biases(policy)
+        self.max_latin_run = POLICIES[policy]["max_latin_run"]
+        self.deltas = mask.run_deltas()
+        self.n_vocab = len(self.bias)
+        self.latin_run = 0
+        self._seen = None  # 已经处理过的 input_ids 长度，第一次调用时为提示长度
+
+    def __call__(self, input_ids, scores):
+        n = len(input_ids)
+        if self._seen is None:
+            self._seen = n
+        # 更新本次生成中连续英文 token 的计数 (通常每步只有一个新 token)
+        for token in input_ids[self._seen:n]:
+            d = self.deltas[token] if 0 <= token < self.n_vocab else 0
+            if d < 0:
+                self.latin_run = 0
+            elif d > 0:
+                self.latin_run += 1
+        self._seen = n
+
+        if self.max_latin_run is not None and self.latin_run >= self.max_latin_run:
+            bias = self.banned
+        else:
+            bias = self.bias
+        n = min(len(scores), self.n_vocab)
+        scores[:n] += bias[:n]
+        return scores
+
+
+class HFCJKProcessor:
+    """transformers 的 logits 处理器 (可放入 LogitsProcessorList)，支持批量生成"""
+
+    def __init__(self, mask, policy="hard"):
+        bias, banned = mask.biases(policy)
+        self._bias = bias
+        self._banned = banned
+        self._deltas = mask.run_deltas()
+        self.max_latin_run = POLICIES[policy]["max_latin_run"]
+        self._device_tensors = None
+        self.latin_run = None
+        self._seen = None
+
+    def _tensors(self, scores):
+        import torch
+
+        if self._device_tensors is None:
+            # 模型的 logits 维度可能大于分词器词表 (对齐填充)，多出的部分不加偏置
+            width = scores.shape[-1]
+            bias = torch.zeros(width, dtype=torch.float32)
+            banned = torch.zeros(width, dtype=torch.float32)
+            deltas = torch.zeros(width, dtype=torch.long)
+            n = min(width, len(self._bias))
+            bias[:n] = torch.from_numpy(self._bias[:n])
+            banned[:n] = torch.from_numpy(self._banned[:n])
+            deltas[:n] = torch.from_numpy(self._deltas[:n].astype(np.int64))
+            self._device_tensors = (bias.to(scores.device), banned.to(scores.device), deltas.to(scores.device))
+        return self._device_tensors
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        bias, banned, deltas = self._tensors(scores)
+        batch, n = input_ids.shape
+        if self._seen is None:
+            self._seen = n
+            self.latin_run = torch.zeros(batch, dtype=torch.long, device=scores.device)
+        for step in range(self._seen, n):
+            d = deltas[input_ids[:, step].clamp(0, len(deltas) - 1)]
+            self.latin_run = torch.where(d < 0, torch.zeros_like(self.latin_run), self.latin_run + d.clamp(min=0))
+        self._seen = n
+
+        if self.max_latin_run is None:
+            return scores + bias.to(scores.dtype)
+        ban = (self.latin_run >= self.max_latin_run)[:, None]
+        return scores + torch.where(ban, banned[None, :], bias[None, :]).to(scores.dtype)
+
+
+def benchmark(mask, steps=512):
+    """每一步施加偏置的开销 (与每步数十毫秒的解码相比应可忽略)"""
+    n_vocab = len(mask.classes)
+    processor = mask.llama_processor("hard")
+    scores = np.random.default_rng(0).standard_normal(n_vocab).astype(np.float32)
+    input_ids = np.zeros(steps + 1, dtype=np.intc)
+    processor(input_ids[:1], scores.copy())
+    start = time.perf_counter()
+    for step in range(2, steps + 2):
+        processor(input_ids[:step], scores.copy())
+    elapsed = (time.perf_counter() - start) / steps
+    print(f"词表 {n_vocab} 个 token，每步施加偏置 {elapsed * 1e6:.1f} µs")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="中文约束解码：词表分类统计和每步开销")
+    parser.add_argument("--model", help="gguf 模型路径 (只加载词表)")
+    parser.add_argument("--vocab-size", type=int, default=128256, help="没有模型时用随机类别测试开销")
+    args = parser.parse_args()
+
+    if args.model:
+        from llama_cpp import Llama
+
+        llm = Llama(model_path=args.model, vocab_only=True, verbose=False)
+        start = time.perf_counter()
+        mask = TokenMask.from_llama(llm)
+        print(f"词表分类 (含缓存读写) 耗时 {time.perf_counter() - start:.2f}s")
+        for name, count in mask.counts().items():
+            print(f"  {name}: {count}")
+    else:
+        rng = np.random.default_rng(0)
+        mask = TokenMask(rng.choice([CJK, CJK_PUNCT, LATIN, EMOJI, OTHER_SCRIPT, PARTIAL, 0], size=args.vocab_size))
+    benchmark(mask)
+
+
+if __name__ == "__main__":
+    main()
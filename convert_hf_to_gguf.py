@@ -11,6 +11,7 @@ import json
 import os
 import re
 import sys
+import weakref
 from enum import IntEnum
 from pathlib import Path
 from hashlib import sha256
@@ -24,10 +25,12 @@ import torch
 
 if TYPE_CHECKING:
     from torch import Tensor
+    from remote_safetensors import RangeFetcher
 
 if 'NO_LOCAL_GGUF' not in os.environ:
     sys.path.insert(1, str(Path(__file__).parent / 'gguf-py'))
 import gguf
+import parallel_quants
 # from gguf.vocab import MistralTokenizerType, MistralVocab
 try:
     from gguf.vocab import MistralTokenizerType, MistralVocab
@@ -97,6 +100,12 @@ class ModelBase:
     dry_run: bool
     hparams: dict[str, Any]
     model_tensors: dict[str, Callable[[], Tensor]]
+    remote_fetcher: RangeFetcher | None
+    quant_threads: int | None
+    # output tensor name -> source tensor name, filled by prepare_tensors()
+    tensor_plan: dict[str, str]
+    # output tensors whose data is not the source tensor itself (modify_tensors changed it)
+    tensor_transformed: set[str]
     gguf_writer: gguf.GGUFWriter
     model_name: str | None
     metadata_override: Path | None
@@ -121,7 +130,8 @@ class ModelBase:
                  split_max_tensors: int = 0, split_max_size: int = 0, dry_run: bool = False,
                  small_first_shard: bool = False, hparams: dict[str, Any] | None = None, remote_hf_model_id: str | None = None,
                  disable_mistral_community_chat_template: bool = False,
-                 sentence_transformers_dense_modules: bool = False):
+                 sentence_transformers_dense_modules: bool = False, remote_fetcher: RangeFetcher | None = None,
+                 model_tensors: dict[str, Callable[[], Tensor]] | None = None, quant_threads: int | None = None):
         if type(self) is ModelBase or \
                 type(self) is TextModel or \
                 type(self) is MmprojModel:
@@ -139,9 +149,18 @@ class ModelBase:
         self.lazy = not eager or (remote_hf_model_id is not None)
         self.dry_run = dry_run
         self.remote_hf_model_id = remote_hf_model_id
+        self.remote_fetcher = remote_fetcher
+        self.quant_threads = quant_threads
         self.sentence_transformers_dense_modules = sentence_transformers_dense_modules
         self.hparams = ModelBase.load_hparams(self.dir_model, self.is_mistral_format) if hparams is None else hparams
-        self.model_tensors = self.index_tensors(remote_hf_model_id=remote_hf_model_id)
+        if model_tensors is None:
+            self.model_tensors = self.index_tensors(remote_hf_model_id=remote_hf_model_id)
+        else:
+            # index shared with another model of the same checkpoint (see --with-mmproj);
+            # copied because dequant_model() edits it in place
+            self.model_tensors = dict(model_tensors)
+        self.tensor_plan = {}
+        self.tensor_transformed = set()
         self.metadata_override = metadata_override
         self.model_name = model_name
         self.dir_model_card = dir_model  # overridden in convert_lora_to_gguf.py
@@ -196,8 +215,14 @@ class ModelBase:
 
             logger.info(f"Using remote model with HuggingFace id: {remote_hf_model_id}")
             remote_tensors = gguf.utility.SafetensorRemote.get_list_tensors_hf_model(remote_hf_model_id)
-            for name, remote_tensor in remote_tensors.items():
-                tensors[name] = lambda r=remote_tensor: LazyTorchTensor.from_remote_tensor(r)
+            # tensors are usually evaluated in index order, so each one prefetches its successor
+            remote_list = list(remote_tensors.values())
+            for i, (name, remote_tensor) in enumerate(remote_tensors.items()):
+                next_tensor = remote_list[i + 1] if i + 1 < len(remote_list) else None
+                gen = lambda r=remote_tensor, n=next_tensor: LazyTorchTensor.from_remote_tensor(r, self.remote_fetcher, prefetch=n)  # noqa: E731
+                # lets --verify read the sampled rows instead of downloading the tensor again
+                gen.remote_tensor = remote_tensor  # type: ignore[attr-defined]
+                tensors[name] = gen
 
             return tensors
 
@@ -528,10 +553,23 @@ class ModelBase:
 
         return False
 
+    def quantize_tensor(self, name: str, new_name: str, data: np.ndarray, data_qtype: gguf.GGMLQuantizationType) -> np.ndarray:
+        del name, new_name  # unused
+
+        return parallel_quants.quantize(data, data_qtype, threads=self.quant_threads)
+
     # some models need extra generated tensors (like rope_freqs)
     def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
         return ()
 
+    # used by --verify: which source row each row of an output tensor was taken from,
+    # for tensors whose rows were reordered by modify_tensors (None: not a pure reordering,
+    # such tensors are reported as unchecked)
+    def tensor_row_map(self, name: str, new_name: str, n_rows: int) -> np.ndarray | None:
+        del name, new_name, n_rows  # unused
+
+        return None
+
     def prepare_tensors(self):
         # Handle empty tensor_map for models with block_count=0 (like MobileNetV5)
         if self.tensor_map.mapping:
@@ -557,7 +595,12 @@ class ModelBase:
                     bid = int(part)
                     break
 
+            source_torch = data_torch
             for new_name, data_torch in (self.modify_tensors(data_torch, name, bid)):
+                self.tensor_plan[new_name] = name
+                if data_torch is not source_torch:
+                    self.tensor_transformed.add(new_name)
+
                 # TODO: why do we squeeze here?
                 # data = data_torch.squeeze().numpy()
                 data = data_torch.numpy()
@@ -633,13 +676,21 @@ class ModelBase:
                     else:
                         raise ValueError(f"Unknown file type: {self.ftype.name}")
 
+                source = data
                 try:
-                    data = gguf.quants.quantize(data, data_qtype)
+                    data = self.quantize_tensor(name, new_name, data, data_qtype)
                 except gguf.QuantError as e:
                     logger.warning("%s, %s", e, "falling back to F16")
                     data_qtype = gguf.GGMLQuantizationType.F16
                     data = gguf.quants.quantize(data, data_qtype)
 
+                # swap right after quantization (and lazily, tensor by tensor) instead of
+                # letting the writer make another full copy of every tensor
+                data_endianess = gguf.GGUFEndian.BIG if sys.byteorder == 'big' else gguf.GGUFEndian.LITTLE
+                if data_endianess != self.endianess:
+                    data = byteswap_output(data, source)
+                    data_endianess = self.endianess
+
                 shape = gguf.quant_shape_from_byte_shape(data.shape, data_qtype) if data.dtype == np.uint8 else data.shape
 
                 # reverse shape to make it similar to the internal ggml dimension order
@@ -648,7 +699,7 @@ class ModelBase:
                 # n_dims is implicit in the shape
                 logger.info(f"{f'%-{max_name_len}s' % f'{new_name},'} {old_dtype} --> {data_qtype.name}, shape = {shape_str}")
 
-                self.gguf_writer.add_tensor(new_name, data, raw_dtype=data_qtype)
+                self.gguf_writer.add_tensor(new_name, data, raw_dtype=data_qtype, tensor_endianess=data_endianess)
 
     def set_type(self):
         self.gguf_writer.add_type(gguf.GGUFType.MODEL)
@@ -685,12 +736,15 @@ class ModelBase:
     def write_vocab(self):
         raise NotImplementedError("write_vocab() must be implemented in subclasses")
 
-    def write(self):
+    def write(self, progress: bool = True):
         self.prepare_tensors()
         self.prepare_metadata(vocab_only=False)
+        self.write_prepared(progress=progress)
+
+    def write_prepared(self, progress: bool = True):
         self.gguf_writer.write_header_to_file(path=self.fname_out)
         self.gguf_writer.write_kv_data_to_file()
-        self.gguf_writer.write_tensors_to_file(progress=True)
+        self.gguf_writer.write_tensors_to_file(progress=progress)
         self.gguf_writer.close()
 
     @staticmethod
@@ -2593,6 +2647,15 @@ class LlamaModel(TextModel):
                 .swapaxes(1, 2)
                 .reshape(weights.shape))
 
+    def tensor_row_map(self, name: str, new_name: str, n_rows: int) -> np.ndarray | None:
+        if not self.undo_permute or not name.endswith(("q_proj.weight", "q_proj.bias", "k_proj.weight", "k_proj.bias")):
+            return super().tensor_row_map(name, new_name, n_rows)
+        n_head = self.find_hparam(["n_heads", "num_attention_heads"])
+        n_kv_head = n_head if "q_proj" in name else self.find_hparam(["n_kv_heads", "num_key_value_heads"])
+        # permuting the row indices tells where every output row came from
+        rows = LlamaModel.permute(torch.arange(n_rows).reshape(n_rows, 1), n_head, n_kv_head)
+        return rows.reshape(n_rows).numpy()
+
     _experts: list[dict[str, Tensor]] | None = None
 
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
@@ -5796,12 +5859,12 @@ class XLMRobertaModel(BertModel):
             if lora_prompt_prefixes:
                 lora_writer.add_string(gguf.Keys.Adapter.LORA_PROMPT_PREFIX, lora_prompt_prefixes[lora_name])
 
-    def write(self):
-        super().write()
+    def write_prepared(self, progress: bool = True):
+        super().write_prepared(progress=progress)
         for lora_writer in self._lora_files.values():
             lora_writer.write_header_to_file()
             lora_writer.write_kv_data_to_file()
-            lora_writer.write_tensors_to_file(progress=True)
+            lora_writer.write_tensors_to_file(progress=progress)
             lora_writer.close()
 
 
@@ -11080,6 +11143,87 @@ class SolarOpenModel(Glm4MoeModel):
 ###### CONVERSION LOGIC ######
 
 
+def byteswap_chunked(data: np.ndarray, *, inplace: bool, chunk_bytes: int = 64 * 1024 * 1024) -> np.ndarray:
+    """Byteswap an array without holding two full copies of it at once.
+
+    With `inplace`, the array is swapped where it is (it must be writable and not shared).
+    Otherwise a single output buffer is filled chunk by chunk, which costs the same
+    as the copy a little-endian export makes when converting types.
+    """
+    if data.dtype.itemsize == 1:
+        return data
+    if inplace and data.flags.writeable and data.flags.c_contiguous:
+        out = data
+    else:
+        out = np.empty(data.shape, dtype=data.dtype)
+        inplace = False
+    src = data.reshape(-1)
+    dst = out.reshape(-1)
+    step = max(1, chunk_bytes // data.dtype.itemsize)
+    for i in range(0, dst.size, step):
+        if not inplace:
+            dst[i:i + step] = src[i:i + step]
+        dst[i:i + step].byteswap(inplace=True)
+    return out
+
+
+def byteswap_output(data: np.ndarray, source: np.ndarray) -> np.ndarray:
+    # quantization usually produces a fresh buffer, which can be swapped in place;
+    # F32/F16 outputs may still alias the (possibly shared) source tensor
+    if isinstance(data, gguf.LazyNumpyTensor):
+        return gguf.LazyNumpyTensor._wrap_fn(byteswap_output, meta_noop=True)(data, source)
+    # an eager result for a lazy source did not come from quantizing it (see ModelBase.quantize_tensor)
+    if isinstance(source, gguf.LazyNumpyTensor):
+        return byteswap_chunked(data, inplace=False)
+    return byteswap_chunked(data, inplace=not np.may_share_memory(data, source))
+
+
+def check_byteswap(chunk_bytes: int = 1000) -> bool:
+    """Compare byteswap_chunked()/byteswap_output() with numpy's byteswap(), which was used before,
+    for every safetensors source type and every output type."""
+    rng = np.random.default_rng(0)
+    ok = True
+
+    def report(kind: str, name: str, same: bool):
+        nonlocal ok
+        ok = ok and same
+        logger.info(f"{kind:<8}{name:<10}{'identical' if same else 'MISMATCH'}")
+
+    # source tensors are swapped in place right after reading (copy-on-write mmap, downloaded buffer);
+    # a small chunk size makes every array span several chunks and end in a partial one
+    for st_dtype, torch_dtype in LazyTorchTensor._dtype_str_map.items():
+        np_dtype = LazyTorchTensor._dtype_byteswap_map[torch_dtype]
+        raw = rng.integers(0, 256, size=(37, 61 * np.dtype(np_dtype).itemsize), dtype=np.uint8)
+        data = raw.view(np_dtype)
+        expected = data.byteswap(inplace=False)
+        inplace = byteswap_chunked(data.copy(), inplace=True, chunk_bytes=chunk_bytes)
+        copied = byteswap_chunked(data, inplace=False, chunk_bytes=chunk_bytes)
+        # strided views can't be swapped in place and must come back as a swapped copy
+        strided = byteswap_chunked(data[:, ::2], inplace=True, chunk_bytes=chunk_bytes)
+        report("source", st_dtype,
+               np.array_equal(inplace.view(np.uint8), expected.view(np.uint8))
+               and np.array_equal(copied.view(np.uint8), expected.view(np.uint8))
+               and np.array_equal(np.ascontiguousarray(strided).view(np.uint8),
+                                  np.ascontiguousarray(expected[:, ::2]).view(np.uint8))
+               and np.array_equal(data.view(np.uint8), raw))
+
+    # outputs are swapped after quantization, where GGUFWriter used to call byteswap() on them;
+    # F32 output aliases the source tensor, which must not be touched
+    for qtype in (gguf.GGMLQuantizationType.F32, gguf.GGMLQuantizationType.F16, gguf.GGMLQuantizationType.BF16,
+                  gguf.GGMLQuantizationType.Q8_0, gguf.GGMLQuantizationType.TQ1_0, gguf.GGMLQuantizationType.TQ2_0):
+        source = rng.standard_normal((16, 512), dtype=np.float32)
+        before = source.copy()
+        data = gguf.quants.quantize(source, qtype)
+        expected = data.byteswap(inplace=False)
+        swapped = byteswap_output(data, source)
+        report("output", qtype.name,
+               np.array_equal(swapped.view(np.uint8), expected.view(np.uint8))
+               and np.array_equal(source.view(np.uint8), before.view(np.uint8)))
+
+    logger.info("byteswap check " + ("passed" if ok else "FAILED"))
+    return ok
+
+
 # tree of lazy tensors
 class LazyTorchTensor(gguf.LazyBase):
     _tensor_type = torch.Tensor
@@ -11094,11 +11238,12 @@ class LazyTorchTensor(gguf.LazyBase):
         torch.uint8: np.uint8,
     }
 
-    # only used when byteswapping data. Only correct size is needed
+    # only used when byteswapping data. Only correct size is needed,
+    # so types without a numpy equivalent use the unsigned integer of the same width
     _dtype_byteswap_map: dict[torch.dtype, type] = {
         torch.float64: np.float64,
         torch.float32: np.float32,
-        torch.bfloat16: np.float16,
+        torch.bfloat16: np.uint16,
         torch.float16: np.float16,
         torch.int64: np.int64,
         torch.uint64: np.uint64,
@@ -11159,7 +11304,8 @@ class LazyTorchTensor(gguf.LazyBase):
             def byteswap_tensor(tensor: np.ndarray, dtype: type) -> np.ndarray:
                 if sys.byteorder == 'big':
                     # switch data back to big endian
-                    tensor = tensor.view(dtype).byteswap(inplace=False)
+                    # (the copy-on-write mmap is private to this tensor, so it can be swapped in place)
+                    tensor = byteswap_chunked(tensor.view(dtype), inplace=True)
                 return tensor
             dtype = cls._dtype_str_map[tensor.dtype]
             numpy_dtype = cls._dtype_byteswap_map[dtype]
@@ -11170,17 +11316,26 @@ class LazyTorchTensor(gguf.LazyBase):
         return cast(torch.Tensor, lazy)
 
     @classmethod
-    def from_remote_tensor(cls, remote_tensor: gguf.utility.RemoteTensor):
+    def from_remote_tensor(cls, remote_tensor: gguf.utility.RemoteTensor, fetcher: RangeFetcher | None = None,
+                           prefetch: gguf.utility.RemoteTensor | None = None):
         def byteswap_tensor(tensor: np.ndarray, dtype: type) -> np.ndarray:
             if sys.byteorder == 'big':
-                # switch data back to big endian
-                tensor = tensor.view(dtype).byteswap(inplace=False)
+                # switch data back to big endian (the downloaded buffer is not shared)
+                tensor = byteswap_chunked(tensor.view(dtype), inplace=True)
             return tensor
+
+        def read_data(r: gguf.utility.RemoteTensor) -> bytearray:
+            if fetcher is None:
+                return r.data()
+            if prefetch is not None:
+                fetcher.prefetch(prefetch.url, prefetch.offset_start, prefetch.size)
+            return fetcher.fetch(r.url, r.offset_start, r.size)
+
         dtype = cls._dtype_str_map[remote_tensor.dtype]
         numpy_dtype = cls._dtype_byteswap_map[dtype]
         shape = remote_tensor.shape
         meta = cls.meta_with_dtype_and_shape(dtype, shape)
-        lazy = cls(meta=meta, args=(remote_tensor,), func=lambda r: torch.from_numpy(byteswap_tensor(np.frombuffer(r.data(), dtype=numpy_dtype), numpy_dtype)).view(dtype).reshape(shape))
+        lazy = cls(meta=meta, args=(remote_tensor,), func=lambda r: torch.from_numpy(byteswap_tensor(np.frombuffer(read_data(r), dtype=numpy_dtype), numpy_dtype)).view(dtype).reshape(shape))
         return cast(torch.Tensor, lazy)
 
     @classmethod
@@ -11260,14 +11415,46 @@ def parse_args() -> argparse.Namespace:
         "--print-supported-models", action="store_true",
         help="Print the supported models"
     )
+    parser.add_argument(
+        "--check-byteswap", action="store_true",
+        help="Check that the big-endian byteswapping gives the same bytes as numpy's byteswap() for every tensor type, then exit",
+    )
     parser.add_argument(
         "--remote", action="store_true",
         help="(Experimental) Read safetensors file remotely without downloading to disk. Config and tokenizer files will still be downloaded. To use this feature, you need to specify Hugging Face model repo name instead of a local directory. For example: 'HuggingFaceTB/SmolLM2-1.7B-Instruct'. Note: To access gated repo, set HF_TOKEN environment variable to your Hugging Face token.",
     )
+    parser.add_argument(
+        "--verify", action="store_true",
+        help="after exporting, reopen the output and compare sampled rows of every tensor with the source model",
+    )
+    parser.add_argument(
+        "--verify-rows", type=int, default=16,
+        help="(with --verify) number of rows sampled per tensor",
+    )
+    parser.add_argument(
+        "--remote-connections", type=int, default=8,
+        help="(with --remote) number of parallel HTTP range requests",
+    )
+    parser.add_argument(
+        "--remote-chunk-size", type=str, default="16M",
+        help="(with --remote) size of each range request N(K|M|G)",
+    )
+    parser.add_argument(
+        "--remote-cache-dir", type=Path, default=None,
+        help="(with --remote) keep downloaded chunks in this directory, so an interrupted conversion resumes without downloading them again",
+    )
     parser.add_argument(
         "--mmproj", action="store_true",
         help="(Experimental) Export multimodal projector (mmproj) for vision models. This will only work on some vision models. A prefix 'mmproj-' will be added to the output file name.",
     )
+    parser.add_argument(
+        "--quant-threads", type=int, default=None,
+        help="threads used to quantize large tensors to q8_0/tq1_0/tq2_0 (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--with-mmproj", action="store_true",
+        help="Export the text model and the multimodal projector in one pass over the checkpoint. The projector is written next to the text model with a 'mmproj-' prefix.",
+    )
     parser.add_argument(
         "--mistral-format", action="store_true",
         help="Whether the model is stored following the Mistral format.",
@@ -11288,11 +11475,22 @@ def parse_args() -> argparse.Namespace:
     )
 
     args = parser.parse_args()
-    if not args.print_supported_models and args.model is None:
+    if not args.print_supported_models and not args.check_byteswap and args.model is None:
         parser.error("the following arguments are required: model")
     return args
 
 
+FTYPE_MAP: dict[str, gguf.LlamaFileType] = {
+    "f32": gguf.LlamaFileType.ALL_F32,
+    "f16": gguf.LlamaFileType.MOSTLY_F16,
+    "bf16": gguf.LlamaFileType.MOSTLY_BF16,
+    "q8_0": gguf.LlamaFileType.MOSTLY_Q8_0,
+    "tq1_0": gguf.LlamaFileType.MOSTLY_TQ1_0,
+    "tq2_0": gguf.LlamaFileType.MOSTLY_TQ2_0,
+    "auto": gguf.LlamaFileType.GUESSED,
+}
+
+
 def split_str_to_n_bytes(split_str: str) -> int:
     if split_str.endswith("K"):
         n = int(split_str[:-1]) * 1000
@@ -11333,6 +11531,167 @@ def get_model_architecture(hparams: dict[str, Any], model_type: ModelType) -> st
     return arch
 
 
+# max |error| / max |source| that each output type can introduce
+VERIFY_TOLERANCE: dict[gguf.GGMLQuantizationType, float] = {
+    gguf.GGMLQuantizationType.F32: 1e-6,
+    gguf.GGMLQuantizationType.F16: 1e-3,
+    gguf.GGMLQuantizationType.BF16: 8e-3,
+    gguf.GGMLQuantizationType.Q8_0: 1e-2,
+    gguf.GGMLQuantizationType.TQ1_0: 0.51,
+    gguf.GGMLQuantizationType.TQ2_0: 0.51,
+}
+
+
+def read_remote_rows(remote: gguf.utility.RemoteTensor, fetcher: RangeFetcher, rows: np.ndarray, n_cols: int) -> Tensor:
+    """Read only the given rows of a remote tensor (one range request per row)."""
+    dtype = LazyTorchTensor._dtype_str_map[remote.dtype]
+    numpy_dtype = LazyTorchTensor._dtype_byteswap_map[dtype]
+    row_bytes = n_cols * np.dtype(numpy_dtype).itemsize
+    buf = bytearray()
+    for row in rows.tolist():
+        buf += fetcher.fetch(remote.url, remote.offset_start + row * row_bytes, row_bytes)
+    data = np.frombuffer(buf, dtype=numpy_dtype)
+    if sys.byteorder == 'big':
+        data = byteswap_chunked(data, inplace=True)
+    return torch.from_numpy(data).view(dtype).reshape(len(rows), n_cols)
+
+
+def verify_tensor(model: ModelBase, tensor: Any, n_rows: int, rng: np.random.Generator) -> dict[str, Any]:
+    result: dict[str, Any] = {"name": tensor.name, "type": tensor.tensor_type.name}
+    src_name = model.tensor_plan.get(tensor.name)
+    if src_name is None or src_name not in model.model_tensors:
+        return {**result, "status": "skip", "reason": "generated tensor"}
+
+    data = tensor.data.reshape(-1, tensor.data.shape[-1])
+    total_rows = data.shape[0]
+    # only an unchanged tensor, or one whose rows modify_tensors merely reordered, can be
+    # compared with the source; anything else (norm offsets, scaling, merges) is reported unchecked
+    row_map = None
+    if tensor.name in model.tensor_transformed:
+        row_map = model.tensor_row_map(src_name, tensor.name, total_rows)
+        if row_map is None:
+            return {**result, "status": "unchecked", "reason": f"values of {src_name} changed by modify_tensors"}
+
+    n_cols = int(tensor.shape[0])
+    gen = model.model_tensors[src_name]
+    remote = getattr(getattr(gen, "__wrapped__", gen), "remote_tensor", None)
+    if remote is not None and model.remote_fetcher is not None:
+        src_shape = tuple(remote.shape)
+    elif model.remote_hf_model_id is not None:
+        # evaluating a remote source would download the whole tensor a second time
+        return {**result, "status": "unchecked", "reason": f"{src_name} is computed from remote tensors"}
+    else:
+        source = gen()
+        if isinstance(source, LazyTorchTensor):
+            # local safetensors evaluate to a view of the mmap, so only sampled rows are read
+            source = LazyTorchTensor.to_eager(source)
+        src_shape = tuple(source.shape)
+    if math.prod(src_shape) != tensor.n_elements or not src_shape or src_shape[-1] != n_cols:
+        return {**result, "status": "skip", "reason": f"not 1:1 with {src_name}"}
+
+    rows = np.arange(total_rows) if total_rows <= n_rows else np.sort(rng.choice(total_rows, n_rows, replace=False))
+    # raw bytes, so that quantized types see their block layout
+    got = gguf.quants.dequantize(np.ascontiguousarray(data[rows]).view(np.uint8), tensor.tensor_type).reshape(len(rows), n_cols)
+
+    src_rows = rows if row_map is None else row_map[rows]
+    if remote is not None and model.remote_fetcher is not None:
+        expected = read_remote_rows(remote, model.remote_fetcher, src_rows, n_cols).to(torch.float32).numpy()
+    else:
+        expected = source.reshape(-1, n_cols)[torch.from_numpy(src_rows)].to(torch.float32).numpy()
+
+    err = np.abs(got.astype(np.float64) - expected)
+    scale = float(np.abs(expected).max()) or 1.0
+    max_err, mean_err = float(err.max()), float(err.mean())
+    tolerance = VERIFY_TOLERANCE.get(tensor.tensor_type, 1e-2)
+    status = "ok" if max_err / scale <= tolerance else "FAIL"
+    return {**result, "status": status, "source": src_name, "rows": len(rows), "max_err": max_err, "mean_err": mean_err, "rel_err": max_err / scale}
+
+
+def verify_gguf(model: ModelBase, path: Path, n_rows: int = 16, threads: int | None = None, seed: int = 0) -> bool:
+    """Compare sampled rows of a written GGUF file with the source tensors."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    reader = gguf.GGUFReader(path, "r")
+    tensors = list(reader.tensors)
+    logger.info(f"Verifying {len(tensors)} tensors of {path} ({n_rows} sampled rows each)")
+
+    def run(i: int) -> dict[str, Any]:
+        with torch.inference_mode():
+            try:
+                return verify_tensor(model, tensors[i], n_rows, np.random.default_rng(seed + i))
+            except Exception as e:
+                return {"name": tensors[i].name, "type": tensors[i].tensor_type.name, "status": "FAIL", "reason": f"{type(e).__name__}: {e}"}
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+        results = list(pool.map(run, range(len(tensors))))
+
+    max_name_len = max((len(r["name"]) for r in results), default=0)
+    for r in results:
+        if r["status"] == "skip":
+            logger.debug(f"{r['name']:<{max_name_len}} {r['type']:>6}  skipped ({r['reason']})")
+        elif r["status"] == "unchecked":
+            logger.info(f"{r['name']:<{max_name_len}} {r['type']:>6}  unchecked ({r['reason']})")
+        elif "max_err" in r:
+            log = logger.info if r["status"] == "ok" else logger.error
+            log(f"{r['name']:<{max_name_len}} {r['type']:>6}  max {r['max_err']:.3e}  mean {r['mean_err']:.3e}  rel {r['rel_err']:.2e}  {r['status']}")
+        else:
+            logger.error(f"{r['name']:<{max_name_len}} {r['type']:>6}  {r['reason']}  FAIL")
+
+    n_fail = sum(1 for r in results if r["status"] == "FAIL")
+    n_skip = sum(1 for r in results if r["status"] == "skip")
+    n_unchecked = sum(1 for r in results if r["status"] == "unchecked")
+    n_ok = len(results) - n_fail - n_skip - n_unchecked
+    logger.info(f"Verification: {n_ok} ok, {n_fail} failed, {n_unchecked} unchecked, {n_skip} skipped")
+    return n_fail == 0
+
+
+def share_tensor_sources(model_tensors: dict[str, Callable[[], Tensor]]) -> dict[str, Callable[[], Tensor]]:
+    # While any model still holds the tensor returned for a name, every other model
+    # gets that same (lazy) tensor back, so its data is read from disk or network once.
+    live: weakref.WeakValueDictionary[str, Tensor] = weakref.WeakValueDictionary()
+
+    def get(name: str, gen: Callable[[], Tensor]) -> Tensor:
+        tensor = live.get(name)
+        if tensor is None:
+            tensor = gen()
+            live[name] = tensor
+        return tensor
+
+    def share(name: str, gen: Callable[[], Tensor]) -> Callable[[], Tensor]:
+        shared = lambda: get(name, gen)  # noqa: E731
+        shared.__wrapped__ = gen  # type: ignore[attr-defined]
+        return shared
+
+    return {name: share(name, gen) for name, gen in model_tensors.items()}
+
+
+def write_models(models: Sequence[ModelBase], progress: bool = True):
+    # Build the lazy tensor graph of every model before writing any of them, so tensors
+    # wanted by several models (e.g. token embeddings in some mmproj) are evaluated once.
+    for model in models:
+        model.prepare_tensors()
+        model.prepare_metadata(vocab_only=False)
+    for model in models:
+        model.write_prepared(progress=progress)
+
+
+def get_model_class(hparams: dict[str, Any], model_type: ModelType, is_mistral_format: bool = False) -> type[ModelBase]:
+    if not is_mistral_format:
+        model_architecture = get_model_architecture(hparams, model_type)
+        logger.info(f"Model architecture: {model_architecture}")
+        try:
+            return ModelBase.from_model_architecture(model_architecture, model_type=model_type)
+        except NotImplementedError:
+            raise NotImplementedError(f"Model {model_architecture} is not supported") from None
+    elif model_type == ModelType.MMPROJ:
+        assert hparams.get("vision_encoder") is not None, "This model does not support multimodal"
+        return PixtralModel
+    elif "moe" in hparams:
+        return MistralMoeModel
+    else:
+        return MistralModel
+
+
 def main() -> None:
     args = parse_args()
 
@@ -11341,6 +11700,10 @@ def main() -> None:
         ModelBase.print_registered_models()
         sys.exit(0)
 
+    if args.check_byteswap:
+        logging.basicConfig(level=logging.INFO)
+        sys.exit(0 if check_byteswap() else 1)
+
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
     else:
@@ -11358,24 +11721,23 @@ def main() -> None:
             allow_patterns=allowed_patterns)
         dir_model = Path(local_dir)
         logger.info(f"Downloaded config and tokenizer to {local_dir}")
+
+        # same endpoint as huggingface_hub, e.g. a mirror or a local test server
+        if endpoint := os.environ.get("HF_ENDPOINT"):
+            gguf.utility.SafetensorRemote.BASE_DOMAIN = endpoint.rstrip("/")
+        from remote_safetensors import RangeFetcher
+        remote_fetcher = RangeFetcher(connections=args.remote_connections,
+                                      chunk_size=split_str_to_n_bytes(args.remote_chunk_size),
+                                      cache_dir=args.remote_cache_dir)
     else:
         hf_repo_id = None
+        remote_fetcher = None
         dir_model = Path(args.model)
 
     if not dir_model.is_dir():
         logger.error(f'Error: {dir_model} is not a directory')
         sys.exit(1)
 
-    ftype_map: dict[str, gguf.LlamaFileType] = {
-        "f32": gguf.LlamaFileType.ALL_F32,
-        "f16": gguf.LlamaFileType.MOSTLY_F16,
-        "bf16": gguf.LlamaFileType.MOSTLY_BF16,
-        "q8_0": gguf.LlamaFileType.MOSTLY_Q8_0,
-        "tq1_0": gguf.LlamaFileType.MOSTLY_TQ1_0,
-        "tq2_0": gguf.LlamaFileType.MOSTLY_TQ2_0,
-        "auto": gguf.LlamaFileType.GUESSED,
-    }
-
     is_split = args.split_max_tensors > 0 or args.split_max_size != "0"
     if args.use_temp_file and is_split:
         logger.error("Error: Cannot use temp file when splitting")
@@ -11396,46 +11758,69 @@ def main() -> None:
         raise ImportError(_mistral_import_error_msg)
     disable_mistral_community_chat_template = args.disable_mistral_community_chat_template
 
+    if args.with_mmproj and (args.mmproj or args.vocab_only):
+        logger.error("Error: --with-mmproj cannot be combined with --mmproj or --vocab-only")
+        sys.exit(1)
+
     with torch.inference_mode():
-        output_type = ftype_map[args.outtype]
-        model_type = ModelType.MMPROJ if args.mmproj else ModelType.TEXT
+        output_type = FTYPE_MAP[args.outtype]
+        model_types = [ModelType.TEXT, ModelType.MMPROJ] if args.with_mmproj else [ModelType.MMPROJ if args.mmproj else ModelType.TEXT]
         hparams = ModelBase.load_hparams(dir_model, is_mistral_format)
-        if not is_mistral_format:
-            model_architecture = get_model_architecture(hparams, model_type)
-            logger.info(f"Model architecture: {model_architecture}")
-            try:
-                model_class = ModelBase.from_model_architecture(model_architecture, model_type=model_type)
-            except NotImplementedError:
-                logger.error(f"Model {model_architecture} is not supported")
-                sys.exit(1)
-        elif args.mmproj:
-            assert hparams.get("vision_encoder") is not None, "This model does not support multimodal"
-            model_class = PixtralModel
-        elif "moe" in hparams:
-            model_class = MistralMoeModel
-        else:
-            model_class = MistralModel
-
-        model_instance = model_class(dir_model, output_type, fname_out,
-                                     is_big_endian=args.bigendian, use_temp_file=args.use_temp_file,
-                                     eager=args.no_lazy,
-                                     metadata_override=args.metadata, model_name=args.model_name,
-                                     split_max_tensors=args.split_max_tensors,
-                                     split_max_size=split_str_to_n_bytes(args.split_max_size), dry_run=args.dry_run,
-                                     small_first_shard=args.no_tensor_first_split,
-                                     remote_hf_model_id=hf_repo_id, disable_mistral_community_chat_template=disable_mistral_community_chat_template,
-                                     sentence_transformers_dense_modules=args.sentence_transformers_dense_modules
-                                     )
+        try:
+            model_classes = [get_model_class(hparams, model_type, is_mistral_format) for model_type in model_types]
+        except NotImplementedError as e:
+            logger.error(str(e))
+            sys.exit(1)
+
+        models: list[ModelBase] = []
+        model_tensors: dict[str, Callable[[], Tensor]] | None = None
+        for model_class in model_classes:
+            model_fname_out = fname_out
+            if issubclass(model_class, MmprojModel) and args.with_mmproj and not fname_out.is_dir():
+                model_fname_out = ModelBase.add_prefix_to_filename(fname_out, "mmproj-")
+            model_instance = model_class(dir_model, output_type, model_fname_out,
+                                         is_big_endian=args.bigendian, use_temp_file=args.use_temp_file,
+                                         eager=args.no_lazy,
+                                         metadata_override=args.metadata, model_name=args.model_name,
+                                         split_max_tensors=args.split_max_tensors,
+                                         split_max_size=split_str_to_n_bytes(args.split_max_size), dry_run=args.dry_run,
+                                         small_first_shard=args.no_tensor_first_split,
+                                         remote_hf_model_id=hf_repo_id, disable_mistral_community_chat_template=disable_mistral_community_chat_template,
+                                         sentence_transformers_dense_modules=args.sentence_transformers_dense_modules,
+                                         remote_fetcher=remote_fetcher, model_tensors=model_tensors,
+                                         quant_threads=args.quant_threads,
+                                         )
+            if args.with_mmproj and model_tensors is None:
+                # index (and dequantize) the checkpoint once; the projector reuses the same source
+                # tensors, and its own dequant_model() finds no scale tensors left to fold
+                model_tensors = share_tensor_sources(model_instance.model_tensors)
+                model_instance.model_tensors = dict(model_tensors)
+            models.append(model_instance)
 
         if args.vocab_only:
+            model_instance = models[0]
             logger.info("Exporting model vocab...")
             model_instance.write_vocab()
             logger.info(f"Model vocab successfully exported to {model_instance.fname_out}")
         else:
             logger.info("Exporting model...")
-            model_instance.write()
-            out_path = f"{model_instance.fname_out.parent}{os.sep}" if is_split else model_instance.fname_out
-            logger.info(f"Model successfully exported to {out_path}")
+            if len(models) == 1:
+                models[0].write()
+            else:
+                write_models(models)
+            for model_instance in models:
+                out_path = f"{model_instance.fname_out.parent}{os.sep}" if is_split else model_instance.fname_out
+                logger.info(f"Model successfully exported to {out_path}")
+
+            if args.verify:
+                if is_split or args.dry_run:
+                    logger.warning("--verify is not supported with split or dry-run output, skipping")
+                elif not all([verify_gguf(model_instance, model_instance.fname_out, n_rows=args.verify_rows) for model_instance in models]):
+                    sys.exit(1)
+
+        if remote_fetcher is not None:
+            logger.info(f"Remote reads: {remote_fetcher.stats.summary()}")
+            remote_fetcher.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Batch driver for convert_hf_to_gguf.py
+#
+# Converts every model listed in a manifest (MODEL_ZOO keys or plain HF model
+# directories) to every requested outtype inside a single process, so the
+# torch/transformers import and the registered model classes are paid for once.
+# Independent conversions run concurrently under a global CPU and memory budget,
+# and outputs whose sources did not change since the last run are skipped.
+#
+# Example manifest (YAML or JSON):
+#
+#   outtypes: [q8_0, f16]
+#   outdir: outputs/gguf
+#   models:
+#     - llama3-8b                                  # MODEL_ZOO key
+#     - qwen2.5-7b
+#     - dir: outputs/mistral_qlora_v1_merged_full  # any HF model directory
+#       outtypes: [q8_0]
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import torch
+import yaml
+
+import convert_hf_to_gguf as hf
+from convert_hf_to_gguf import ModelBase, ModelType, gguf
+
+logger = logging.getLogger("zoo-to-gguf")
+
+STAMP_SUFFIX = ".sources.json"
+# files that never influence the converted weights or vocab
+IGNORED_SOURCE_FILES = ("README.md", "training_args.bin", "trainer_state.json", "optimizer.pt", "scheduler.pt", "rng_state.pth")
+
+
+@dataclass
+class ConversionJob:
+    label: str
+    dir_model: Path
+    outtype: str
+    fname_out: Path
+    mem_estimate: int = 0
+    fingerprint: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class JobResult:
+    job: ConversionJob
+    status: str  # "converted", "skipped", "failed"
+    seconds: float = 0.0
+    error: str | None = None
+
+
+class MemoryBudget:
+    """Counting semaphore over bytes. A job larger than the whole budget still runs, but alone."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n: int) -> int:
+        n = min(n, self.total)
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_use + n <= self.total)
+            self.in_use += n
+        return n
+
+    def release(self, n: int):
+        with self._cond:
+            self.in_use -= n
+            self._cond.notify_all()
+
+
+def resolve_zoo_dir(key: str) -> Path:
+    from model_config import MODEL_ZOO
+
+    if key not in MODEL_ZOO:
+        raise ValueError(f"Model {key!r} not found in MODEL_ZOO")
+    output_dir = Path(MODEL_ZOO[key]["output_dir"])
+    # merge_weights.py writes the standalone model next to the adapter
+    merged = output_dir.with_name(output_dir.name + "_merged_full")
+    return merged if merged.is_dir() else output_dir
+
+
+def load_manifest(path: Path) -> dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.suffix == ".json":
+            return json.load(f)
+        return yaml.safe_load(f)
+
+
+def source_files(dir_model: Path) -> list[Path]:
+    return sorted(p for p in dir_model.iterdir() if p.is_file() and p.name not in IGNORED_SOURCE_FILES)
+
+
+def hash_file(path: Path, chunk_size: int = 16 * 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint_sources(dir_model: Path, outtype: str, use_hash: bool) -> dict[str, Any]:
+    files = {}
+    for p in source_files(dir_model):
+        st = p.stat()
+        entry: dict[str, Any] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if use_hash:
+            entry["sha256"] = hash_file(p)
+        files[p.name] = entry
+    return {
+        "outtype": outtype,
+        # a newer converter may produce different output for the same sources
+        "converter": hash_file(Path(hf.__file__)),
+        "files": files,
+    }
+
+
+def is_up_to_date(job: ConversionJob) -> bool:
+    stamp = job.fname_out.with_name(job.fname_out.name + STAMP_SUFFIX)
+    if not job.fname_out.is_file() or not stamp.is_file():
+        return False
+    with open(stamp, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    if old.get("outtype") != job.fingerprint["outtype"] or old.get("converter") != job.fingerprint["converter"]:
+        return False
+    old_files: dict[str, Any] = old.get("files", {})
+    new_files: dict[str, Any] = job.fingerprint["files"]
+    if old_files.keys() != new_files.keys():
+        return False
+    for name, new in new_files.items():
+        prev = old_files[name]
+        if "sha256" in new and "sha256" in prev:
+            # content hashes win over timestamps (e.g. after copying a model around)
+            if new["sha256"] != prev["sha256"]:
+                return False
+        elif (new["size"], new["mtime_ns"]) != (prev["size"], prev["mtime_ns"]):
+            return False
+    return True
+
+
+def write_stamp(job: ConversionJob):
+    stamp = job.fname_out.with_name(job.fname_out.name + STAMP_SUFFIX)
+    with open(stamp, "w", encoding="utf-8") as f:
+        json.dump(job.fingerprint, f, indent=2)
+
+
+def estimate_peak_memory(dir_model: Path) -> int:
+    # Lazy conversion materializes about one tensor at a time: the source view,
+    # its float32 copy, and the converted output. Size it from the largest tensor.
+    largest = 0
+    for part in ModelBase.get_model_part_names(dir_model, "model", ".safetensors"):
+        with gguf.utility.SafetensorsLocal(dir_model / part) as tensors:
+            for t in tensors.values():
+                n_elements = 1
+                for dim in t.shape:
+                    n_elements *= dim
+                largest = max(largest, n_elements * 4)
+    if largest == 0:
+        # pytorch_model*.bin: no cheap header to read, assume the largest part file
+        parts = ModelBase.get_model_part_names(dir_model, "pytorch_model", ".bin")
+        largest = max((os.path.getsize(dir_model / p) for p in parts), default=0)
+    return 3 * largest
+
+
+def plan_jobs(manifest: dict[str, Any], outdir_override: Path | None) -> list[ConversionJob]:
+    default_outtypes: list[str] = manifest.get("outtypes", ["auto"])
+    outdir = outdir_override or (Path(manifest["outdir"]) if manifest.get("outdir") else None)
+
+    jobs: list[ConversionJob] = []
+    for entry in manifest.get("models", []):
+        if isinstance(entry, str):
+            entry = {"zoo": entry} if not Path(entry).is_dir() else {"dir": entry}
+        if "zoo" in entry:
+            label = entry["zoo"]
+            dir_model = resolve_zoo_dir(label)
+        else:
+            dir_model = Path(entry["dir"])
+            label = entry.get("name", dir_model.name)
+
+        for outtype in entry.get("outtypes", default_outtypes):
+            if outtype not in hf.FTYPE_MAP:
+                raise ValueError(f"{label}: unknown outtype {outtype!r}")
+            target_dir = outdir if outdir is not None else dir_model
+            fname_out = target_dir / f"{dir_model.name}-{outtype}.gguf"
+            jobs.append(ConversionJob(label=label, dir_model=dir_model, outtype=outtype, fname_out=fname_out))
+    return jobs
+
+
+def convert_one(job: ConversionJob, args: argparse.Namespace) -> None:
+    # inference_mode is thread-local, every worker needs its own
+    with torch.inference_mode():
+        hparams = ModelBase.load_hparams(job.dir_model, False)
+        model_class = hf.get_model_class(hparams, ModelType.TEXT)
+        job.fname_out.parent.mkdir(parents=True, exist_ok=True)
+        model_instance = model_class(job.dir_model, hf.FTYPE_MAP[job.outtype], job.fname_out,
+                                     is_big_endian=args.bigendian, use_temp_file=args.use_temp_file,
+                                     eager=args.no_lazy, hparams=hparams,
+                                     quant_threads=args.threads)
+        model_instance.write(progress=False)
+
+
+def run_job(job: ConversionJob, args: argparse.Namespace, budget: MemoryBudget) -> JobResult:
+    if not job.dir_model.is_dir():
+        return JobResult(job, "failed", error=f"{job.dir_model} is not a directory")
+
+    job.fingerprint = fingerprint_sources(job.dir_model, job.outtype, args.hash)
+    if not args.force and is_up_to_date(job):
+        return JobResult(job, "skipped")
+
+    job.mem_estimate = estimate_peak_memory(job.dir_model)
+    reserved = budget.acquire(job.mem_estimate)
+    start = time.perf_counter()
+    try:
+        logger.info(f"[{job.label}/{job.outtype}] converting {job.dir_model} -> {job.fname_out}")
+        convert_one(job, args)
+        write_stamp(job)
+        return JobResult(job, "converted", seconds=time.perf_counter() - start)
+    except Exception as e:
+        logger.exception(f"[{job.label}/{job.outtype}] conversion failed")
+        return JobResult(job, "failed", seconds=time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+    finally:
+        budget.release(reserved)
+
+
+def print_report(results: list[JobResult], elapsed: float):
+    print()
+    print(f"{'model':<24} {'outtype':<8} {'status':<10} {'time':>8} {'size':>10}  output")
+    print("-" * 100)
+    for r in results:
+        size = f"{r.job.fname_out.stat().st_size / 1e9:.2f} GB" if r.job.fname_out.is_file() else "-"
+        seconds = f"{r.seconds:.1f}s" if r.status == "converted" else "-"
+        print(f"{r.job.label:<24} {r.job.outtype:<8} {r.status:<10} {seconds:>8} {size:>10}  {r.job.fname_out}")
+        if r.error:
+            print(f"{'':<24} error: {r.error}")
+    counts = {s: sum(1 for r in results if r.status == s) for s in ("converted", "skipped", "failed")}
+    print("-" * 100)
+    print(f"{counts['converted']} converted, {counts['skipped']} up to date, {counts['failed']} failed in {elapsed:.1f}s")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Convert all models of a manifest (MODEL_ZOO keys or HF model directories) to GGUF in one process")
+    parser.add_argument(
+        "manifest", type=Path,
+        help="YAML or JSON manifest with 'models' (zoo keys or {dir, outtypes} entries), 'outtypes' and optional 'outdir'",
+    )
+    parser.add_argument(
+        "--outdir", type=Path, default=None,
+        help="directory for all outputs; default: manifest 'outdir', else next to each model",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None,
+        help="max conversions running at the same time (default: manifest 'jobs' or 2)",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=os.cpu_count() or 1,
+        help="total CPU threads shared by all running conversions",
+    )
+    parser.add_argument(
+        "--memory-budget", type=str, default=None,
+        help="max estimated peak RAM of all running conversions N(M|G) (default: manifest 'memory_budget' or unlimited)",
+    )
+    parser.add_argument(
+        "--hash", action="store_true",
+        help="compare sha256 of the source files instead of only size and mtime",
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="convert even if the output is up to date",
+    )
+    parser.add_argument(
+        "--bigendian", action="store_true",
+        help="model is executed on big endian machine",
+    )
+    parser.add_argument(
+        "--use-temp-file", action="store_true",
+        help="use the tempfile library while processing (helpful when running out of memory, process killed)",
+    )
+    parser.add_argument(
+        "--no-lazy", action="store_true",
+        help="use more RAM by computing all outputs before writing (use in case lazy evaluation is broken)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true",
+        help="increase output verbosity",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(threadName)s %(name)s: %(message)s")
+
+    manifest = load_manifest(args.manifest)
+    jobs = plan_jobs(manifest, args.outdir)
+    if not jobs:
+        logger.error("Manifest does not list any models")
+        sys.exit(1)
+
+    n_workers = max(1, args.jobs or int(manifest.get("jobs", 2)))
+    memory_budget = args.memory_budget or str(manifest.get("memory_budget", "0"))
+    budget_bytes = hf.split_str_to_n_bytes(memory_budget)
+    budget = MemoryBudget(budget_bytes if budget_bytes > 0 else sys.maxsize)
+
+    # torch intra-op threads are process-wide, so split the CPU budget between workers
+    torch.set_num_threads(max(1, args.threads // n_workers))
+
+    # two outtypes of the same model must not race on a shared output stamp
+    seen: set[Path] = set()
+    for job in jobs:
+        if job.fname_out in seen:
+            logger.error(f"Duplicate output {job.fname_out} in manifest")
+            sys.exit(1)
+        seen.add(job.fname_out)
+
+    logger.info(f"Planned {len(jobs)} conversions, {n_workers} workers, {args.threads} threads, "
+                f"memory budget {'unlimited' if budget_bytes == 0 else memory_budget}")
+
+    start = time.perf_counter()
+    results: list[JobResult] = []
+    with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="convert") as pool:
+        futures = [pool.submit(run_job, job, args, budget) for job in jobs]
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    order = {id(job): i for i, job in enumerate(jobs)}
+    results.sort(key=lambda r: order[id(r.job)])
+    print_report(results, time.perf_counter() - start)
+
+    if any(r.status == "failed" for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
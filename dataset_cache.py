@@ -0,0 +1,89 @@
+"""
+预分词数据集的磁盘缓存
+
+每次启动训练 (包括崩溃后重启) 都要从原始 JSON 重新套用对话模板并分词。
+这里把处理好的数据集用 save_to_disk 存成 Arrow 文件，下次用 load_from_disk
+直接内存映射读取，命中时只需几毫秒。
+
+缓存键由所有会影响结果的输入组成：数据文件内容、分词器 (词表 + 对话模板)、
+SYSTEM_PROMPT、提示模板、max_length 和打包方式。任何一项变化都会生成新的缓存目录。
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import yaml
+
+# 预处理逻辑本身改变时递增，让旧缓存失效
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "datasets")
+
+
+def file_hash(path, chunk_size=16 * 1024 * 1024):
+    """计算文件内容的 sha256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tokenizer_hash(tokenizer):
+    """分词器指纹：完整的词表/合并规则、特殊 token 以及对话模板"""
+    h = hashlib.sha256()
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode("utf-8"))
+    else:
+        # 慢速分词器没有序列化接口，退而使用词表
+        h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode("utf-8"))
+    h.update(str(getattr(tokenizer, "chat_template", None)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_key(**parts):
+    """把所有影响预处理结果的参数合成一个缓存键"""
+    parts["format_version"] = CACHE_FORMAT_VERSION
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+def preprocessing_workers(config_path):
+    """读取 YAML 中的 preprocessing_num_workers (不存在时为 1)，不超过 CPU 核数"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        config = {}
+    workers = int(config.get("preprocessing_num_workers", 1))
+    return max(1, min(workers, os.cpu_count() or 1))
+
+
+def load_or_build(key, build_fn, cache_dir=DEFAULT_CACHE_DIR):
+    """命中缓存时内存映射加载，否则调用 build_fn() 构建并写入缓存"""
+    from datasets import load_from_disk
+
+    path = os.path.join(cache_dir, key)
+    if os.path.isfile(os.path.join(path, "dataset_info.json")):
+        start = time.perf_counter()
+        dataset = load_from_disk(path)
+        print(f"⚡ 使用预分词缓存 {path} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        return dataset
+
+    start = time.perf_counter()
+    dataset = build_fn()
+    # 先写到临时目录再改名，中途崩溃不会留下损坏的缓存
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    dataset.save_to_disk(tmp_path)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # 另一个进程已经写好了同一个缓存
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    print(f"💾 预处理耗时 {time.perf_counter() - start:.1f}s，已缓存到 {path}")
+    # 返回内存映射的版本，与命中缓存时的行为一致
+    return load_from_disk(path)
@@ -0,0 +1,415 @@
+"""
+知识库的稠密向量检索 (本地 GGUF 嵌入模型 + 内存映射的向量矩阵)
+
+ObsidianLoader 的 BM25 只做字面匹配，问法和笔记用词不同时就找不到。DenseIndex 在它旁边再建一个向量索引：
+  - 笔记按 passages.split_passages 切成片段 (与倒排索引的段落一致)，
+    笔记标题 + 小节标题 + 片段文本用 llama.cpp 的嵌入模型 (Llama(embedding=True)) 分批编码；
+  - 向量归一化后以 float16 存成 vectors.npy (n_chunks × dim)，启动时内存映射；
+  - 查询时把矩阵分块转成 float32 与查询向量做矩阵-向量乘，argpartition 取 top-k；
+  - 片段数超过 IVF_MIN_CHUNKS 时再建一个 IVF 粗量化器 (球面 k-means 聚类中心 + 按簇排好的行号)，
+    查询只计算最近 IVF_NPROBE 个簇里的片段；
+  - 每个片段按 (标题 + 文本) 的哈希缓存向量：重新索引时内容没变的笔记直接沿用原来的行，
+    修改过的笔记里没变的片段也不重新编码，只有新片段才会调用嵌入模型。
+  - 查询向量按规范化后的查询文本缓存 (embedding_cache)，重复的问题不再调用嵌入模型。
+
+索引保存在 <vault>/.stylesphere_index/dense/ 下，和 BM25 一样写完新目录后原子替换 CURRENT。
+片段只保存 (笔记编号, 起止字符位置)，正文仍从笔记文件读取。
+
+命令行：python dense_index.py <vault> --model bge.gguf [--query 问题]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from passages import split_passages
+from query_cache import EMBEDDING_CACHE_SIZE, LRUCache, normalize_query
+
+# 片段切分方式改变时递增，已有的向量索引会重新建立
+CHUNK_VERSION = 2
+# 每次送进嵌入模型的片段数
+EMBED_BATCH = 32
+# float16 -> float32 的转换比矩阵-向量乘本身慢约 10 倍 (numpy 的 float16 乘法更慢)，
+# 转成 float32 后不超过这个大小的矩阵在第一次查询时常驻内存，更大的按块转换
+RESIDENT_FLOAT32_BYTES = 512 * 1024 ** 2
+# 按块转换时每块的行数
+SCORE_BLOCK_ROWS = 8192
+# 片段数达到这个值才建 IVF，更小的索引直接全量计算已经足够快
+IVF_MIN_CHUNKS = 20000
+IVF_NPROBE = 8
+IVF_KMEANS_ITERS = 10
+ARRAY_NAMES = ("vectors", "hashes", "chunk_note", "chunk_start", "chunk_end")
+IVF_ARRAY_NAMES = ("ivf_centroids", "ivf_rows", "ivf_offsets")
+
+def chunk_text(title, heading, text):
+    """送进嵌入模型的文本：笔记标题和小节标题能补充片段本身缺少的主题信息"""
+    return f"{title} > {heading}\n{text}" if heading else f"{title}\n{text}"
+
+
+def chunk_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class LlamaEmbedder:
+    """llama.cpp 嵌入模型 (例如 bge-small-zh 的 GGUF)，embed(texts) 返回归一化的 float32 矩阵"""
+
+    def __init__(self, model_path, n_ctx=512, n_threads=None, n_gpu_layers=0):
+        from llama_cpp import Llama
+
+        self.llm = Llama(model_path=model_path, embedding=True, n_ctx=n_ctx, n_batch=n_ctx,
+                         n_threads=n_threads, n_gpu_layers=n_gpu_layers, verbose=False)
+        self.dim = self.llm.n_embd()
+        # 换了模型 (或同名文件被替换) 时缓存的向量作废
+        self.model_id = f"{os.path.basename(model_path)}:{os.path.getsize(model_path)}:{self.dim}"
+
+    def embed(self, texts):
+        vectors = []
+        for i in range(0, len(texts), EMBED_BATCH):
+            vectors.extend(self.llm.embed(texts[i:i + EMBED_BATCH], normalize=True, truncate=True))
+        return normalize(vectors) if vectors else np.zeros((0, self.dim), dtype=np.float32)
+
+
+def load_embedder(model_path, **kwargs):
+    """模型文件不存在或加载失败时返回 None (知识库检索退回只用 BM25)"""
+    if not model_path or not os.path.exists(model_path):
+        print(f"⚠️ 未找到嵌入模型 {model_path}，知识库只使用关键词检索")
+        return None
+    try:
+        return LlamaEmbedder(model_path, **kwargs)
+    except Exception as e:
+        print(f"⚠️ 嵌入模型加载失败，知识库只使用关键词检索: {str(e)}")
+        return None
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path)
+
+
+def spherical_kmeans(vectors, n_clusters, iters=IVF_KMEANS_ITERS, init=None, seed=0):
+    """归一化向量上的 k-means (按内积分配)，返回归一化的聚类中心"""
+    rng = np.random.default_rng(seed)
+    if init is None:
+        init = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)]
+    centroids = normalize(init)
+    for _ in range(iters):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = np.flatnonzero(~sums.any(axis=1))
+        # 空簇重新随机取一个点
+        sums[empty] = vectors[rng.choice(len(vectors), size=len(empty))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def _blocks(matrix, rows=SCORE_BLOCK_ROWS):
+    for start in range(0, len(matrix), rows):
+        yield start, np.asarray(matrix[start:start + rows], dtype=np.float32)
+
+
+class DenseSnapshot:
+    """一个只读的向量索引目录"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "notes.json"), "r", encoding="utf-8") as f:
+            self.notes = json.load(f)  # [{'path', 'title', 'hash'}]
+        for name in ARRAY_NAMES:
+            setattr(self, name, _load_array(os.path.join(path, f"{name}.npy")))
+        self.ivf = os.path.exists(os.path.join(path, "ivf_centroids.npy"))
+        if self.ivf:
+            for name in IVF_ARRAY_NAMES:
+                setattr(self, name, _load_array(os.path.join(path, f"{name}.npy")))
+        self.n_chunks = len(self.hashes)
+        self.note_index = {note["path"]: i for i, note in enumerate(self.notes)}
+        self._resident = None
+
+    @staticmethod
+    def write(path, arrays, notes, meta):
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, "notes.json"), "w", encoding="utf-8") as f:
+            json.dump(notes, f, ensure_ascii=False)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(meta, created=time.time()), f, ensure_ascii=False, indent=2)
+
+    def chunk_rows(self, note_idx):
+        """笔记编号 -> 它的片段行号 (片段按笔记顺序连续存放)"""
+        lo = int(np.searchsorted(self.chunk_note, note_idx, side="left"))
+        hi = int(np.searchsorted(self.chunk_note, note_idx, side="right"))
+        return np.arange(lo, hi)
+
+    def _float32(self):
+        """常驻内存的 float32 矩阵，太大时返回 None"""
+        if self._resident is None and self.vectors.size * 4 <= RESIDENT_FLOAT32_BYTES:
+            self._resident = np.asarray(self.vectors, dtype=np.float32)
+        return self._resident
+
+    def score_rows(self, query, rows=None):
+        """query 与 rows (升序行号，None 表示全部) 片段的余弦相似度"""
+        matrix = self._float32()
+        if matrix is not None:
+            return matrix @ query if rows is None else matrix[rows] @ query
+        if rows is not None:
+            return np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        scores = np.empty(self.n_chunks, dtype=np.float32)
+        for start, block in _blocks(self.vectors):
+            scores[start:start + len(block)] = block @ query
+        return scores
+
+    def search(self, query, k, nprobe=IVF_NPROBE):
+        """返回 [(片段行号, 相似度)]，按相似度降序"""
+        if self.n_chunks == 0:
+            return []
+        rows = None
+        if self.ivf:
+            probe = np.argsort(self.ivf_centroids @ query)[::-1][:nprobe]
+            # 升序读取内存映射的行，尽量顺序访问
+            rows = np.sort(np.concatenate([self.ivf_rows[self.ivf_offsets[c]:self.ivf_offsets[c + 1]] for c in probe]))
+        scores = self.score_rows(query, rows)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        ids = top if rows is None else rows[top]
+        return [(int(i), float(scores[j])) for i, j in zip(ids, top)]
+
+    def chunk(self, row):
+        """片段行号 -> (笔记 {'path', 'title', 'hash'}, 起, 止)"""
+        return self.notes[int(self.chunk_note[row])], int(self.chunk_start[row]), int(self.chunk_end[row])
+
+
+def build_ivf(vectors, previous=None):
+    """IVF 粗量化：簇数取 4·sqrt(n)，旧索引有聚类中心时直接沿用 (只重新分配)"""
+    n = len(vectors)
+    n_clusters = max(1, int(4 * np.sqrt(n)))
+    if previous is not None and previous.ivf and len(previous.ivf_centroids) * 2 >= n_clusters:
+        centroids = np.asarray(previous.ivf_centroids, dtype=np.float32)
+    else:
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, size=min(n, 50 * n_clusters), replace=False))],
+                            dtype=np.float32)
+        centroids = spherical_kmeans(sample, n_clusters)
+    assign = np.empty(n, dtype=np.int64)
+    for start, block in _blocks(vectors):
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    rows = np.argsort(assign, kind="stable").astype(np.int32)
+    offsets = np.searchsorted(assign[rows], np.arange(len(centroids) + 1)).astype(np.int64)
+    return centroids, rows, offsets
+
+
+class DenseIndex:
+    """由 ObsidianLoader 驱动的向量索引；update(manifest) 之后 snapshot 才是最新的"""
+
+    def __init__(self, index_dir, embedder):
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.snapshot = None
+        # 规范化查询 -> 查询向量；与索引内容无关，索引更新后仍然有效
+        self.embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE)
+        os.makedirs(index_dir, exist_ok=True)
+        path = self._current_path()
+        if path is not None:
+            try:
+                snapshot = DenseSnapshot(path)
+                if snapshot.meta.get("chunk_version") != CHUNK_VERSION:
+                    print("⚠️ 片段切分方式已改变，向量索引将重建")
+                elif snapshot.meta.get("model_id") == embedder.model_id:
+                    self.snapshot = snapshot
+                else:
+                    print("⚠️ 嵌入模型已更换，向量索引将重新编码")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ 向量索引无法加载，将重建: {e}")
+
+    def _current_path(self):
+        try:
+            with open(os.path.join(self.index_dir, "CURRENT"), "r", encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return os.path.join(self.index_dir, name) if name else None
+
+    def _publish(self, name):
+        tmp = os.path.join(self.index_dir, f"CURRENT.tmp{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(self.index_dir, "CURRENT"))
+        self.snapshot = DenseSnapshot(os.path.join(self.index_dir, name))
+        for other in os.listdir(self.index_dir):
+            if other.startswith("dense-") and other != name:
+                shutil.rmtree(os.path.join(self.index_dir, other), ignore_errors=True)
+
+    def update(self, vault_path, manifest, read_note):
+        """按 BM25 索引的清单 ({路径: [mtime_ns, 大小, 内容哈希, ...]}) 同步向量索引，返回新编码的片段数
+
+        内容哈希没变的笔记沿用旧索引中的行；其余笔记重新分段，已缓存的片段不再编码。
+        """
+        old = self.snapshot
+        paths = sorted(manifest)
+        if old is not None and [n["path"] for n in old.notes] == paths and \
+                all(n["hash"] == manifest[n["path"]][2] for n in old.notes):
+            return 0
+
+        start_time = time.perf_counter()
+        cached = {}
+        if old is not None and old.n_chunks:
+            # 旧索引中每个片段哈希对应的行，供修改过的笔记复用
+            cached = dict(zip(np.asarray(old.hashes).tolist(), range(old.n_chunks)))
+        notes, hashes, chunk_note_ids, starts, ends = [], [], [], [], []
+        sources = []  # 每个片段的来源：旧行号，或待编码文本的下标 (取反 - 1)
+        texts = []
+        for rel in paths:
+            content = manifest[rel][2]
+            note_idx = len(notes)
+            old_idx = old.note_index.get(rel) if old is not None else None
+            if old_idx is not None and old.notes[old_idx]["hash"] == content:
+                notes.append(old.notes[old_idx])
+                rows = old.chunk_rows(old_idx)
+                hashes.extend(np.asarray(old.hashes[rows]).tolist())
+                starts.extend(np.asarray(old.chunk_start[rows]).tolist())
+                ends.extend(np.asarray(old.chunk_end[rows]).tolist())
+                chunk_note_ids.extend([note_idx] * len(rows))
+                sources.extend(rows.tolist())
+                continue
+            try:
+                title, body = read_note(os.path.join(vault_path, rel))
+            except OSError:
+                continue
+            notes.append({"path": rel, "title": title, "hash": content})
+            for lo, hi, heading in split_passages(body):
+                text = chunk_text(title, heading, body[lo:hi])
+                h = chunk_hash(text)
+                hashes.append(h)
+                starts.append(lo)
+                ends.append(hi)
+                chunk_note_ids.append(note_idx)
+                if h in cached:
+                    sources.append(cached[h])
+                else:
+                    cached[h] = -len(texts) - 1  # 同一次更新中重复的片段只编码一次
+                    sources.append(cached[h])
+                    texts.append(text)
+
+        new_vectors = self.embedder.embed(texts) if texts else None
+        dim = self.embedder.dim
+        vectors = np.empty((len(hashes), dim), dtype=np.float16)
+        sources = np.asarray(sources, dtype=np.int64)
+        from_old = sources >= 0
+        if from_old.any():
+            vectors[from_old] = old.vectors[sources[from_old]]
+        if new_vectors is not None:
+            vectors[~from_old] = new_vectors[-sources[~from_old] - 1].astype(np.float16)
+
+        arrays = {"vectors": vectors, "hashes": np.asarray(hashes, dtype=np.uint64),
+                  "chunk_note": np.asarray(chunk_note_ids, dtype=np.uint32),
+                  "chunk_start": np.asarray(starts, dtype=np.uint32), "chunk_end": np.asarray(ends, dtype=np.uint32)}
+        if len(vectors) >= IVF_MIN_CHUNKS:
+            arrays.update(zip(IVF_ARRAY_NAMES, build_ivf(vectors, old)))
+        name = f"dense-{time.time_ns()}"
+        DenseSnapshot.write(os.path.join(self.index_dir, name), arrays, notes,
+                            {"model_id": self.embedder.model_id, "chunk_version": CHUNK_VERSION,
+                             "dim": dim, "n_chunks": len(hashes)})
+        self._publish(name)
+        print(f"🧭 向量索引已更新：{len(hashes)} 个片段，新编码 {len(texts)} 个，"
+              f"用时 {time.perf_counter() - start_time:.1f}s")
+        return len(texts)
+
+    def embed_query(self, query):
+        # 编码规范化后的文本，缓存的向量与原始查询的写法无关
+        query = normalize_query(query) or query
+        vector = self.embedding_cache.get(query)
+        if vector is None:
+            vector = self.embedder.embed([query])[0]
+            vector.flags.writeable = False  # 缓存中的向量被多次查询共用
+            self.embedding_cache.put(query, vector)
+        return vector
+
+    def search(self, query, k=20):
+        """返回 [(笔记 {'path', 'title', 'hash'}, 起, 止, 相似度)]"""
+        snapshot = self.snapshot  # 只读取一次引用，后台更新不影响本次查询
+        if snapshot is None:
+            return []
+        return [snapshot.chunk(row) + (score,) for row, score in snapshot.search(self.embed_query(query), k)]
+
+
+def benchmark(n_chunks, dim=384, n_queries=50):
+    """随机向量上对比全量计算和 IVF 的查询耗时与召回率"""
+    rng = np.random.default_rng(0)
+    # 真实的嵌入向量按主题聚集，这里用 n/50 个主题中心加噪声模拟 (纯随机向量没有近邻结构，IVF 无从谈起)
+    topics = normalize(rng.standard_normal((max(1, n_chunks // 50), dim)))
+    vectors = normalize(topics[rng.integers(len(topics), size=n_chunks)]
+                        + rng.standard_normal((n_chunks, dim)) * 0.06).astype(np.float16)
+    queries = normalize(topics[rng.integers(len(topics), size=n_queries)] + rng.standard_normal((n_queries, dim)) * 0.06)
+    arrays = {"vectors": vectors, "hashes": np.arange(n_chunks, dtype=np.uint64),
+              "chunk_note": np.zeros(n_chunks, dtype=np.uint32),
+              "chunk_start": np.zeros(n_chunks, dtype=np.uint32), "chunk_end": np.zeros(n_chunks, dtype=np.uint32)}
+    with tempfile.TemporaryDirectory() as tmp:
+        DenseSnapshot.write(os.path.join(tmp, "flat"), arrays, [], {"dim": dim})
+        start = time.perf_counter()
+        arrays.update(zip(IVF_ARRAY_NAMES, build_ivf(vectors)))
+        print(f"{n_chunks} 个 {dim} 维向量，IVF {len(arrays['ivf_centroids'])} 个簇，"
+              f"建立耗时 {time.perf_counter() - start:.1f}s")
+        DenseSnapshot.write(os.path.join(tmp, "ivf"), arrays, [], {"dim": dim})
+        truth = None
+        for label in ("flat", "ivf"):
+            snapshot = DenseSnapshot(os.path.join(tmp, label))
+            snapshot.search(queries[0], 10)  # 第一次查询把 float32 矩阵读入内存
+            start = time.perf_counter()
+            results = [{row for row, _ in snapshot.search(q, 10)} for q in queries]
+            elapsed = (time.perf_counter() - start) / n_queries * 1000
+            if truth is None:
+                truth = results
+                print(f"  全量 {elapsed:7.2f} ms/查询")
+            else:
+                recall = np.mean([len(r & t) / 10 for r, t in zip(results, truth)])
+                print(f"  IVF  {elapsed:7.2f} ms/查询，top-10 召回率 {recall:.2f}")
+            del snapshot  # Windows 上关闭内存映射后才能删除临时目录
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库向量索引：建立 / 查询 / 基准测试")
+    parser.add_argument("vault", nargs="?", help="vault 路径")
+    parser.add_argument("--model", help="GGUF 嵌入模型路径")
+    parser.add_argument("--query", action="append", default=[], help="查询 (可重复)")
+    parser.add_argument("--benchmark", type=int, default=0, help="用这么多个随机向量测试全量与 IVF 查询")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+    if not args.vault or not args.model:
+        parser.error("需要 vault 路径和 --model")
+    from obsidian_loader import ObsidianLoader
+
+    embedder = load_embedder(args.model)
+    if embedder is None:
+        raise SystemExit(1)
+    loader = ObsidianLoader(args.vault, embedder=embedder)
+    for query in args.query or ["塞尔达传说的玩法"]:
+        start = time.perf_counter()
+        results = loader.dense.search(query, 5)
+        elapsed = (time.perf_counter() - start) * 1000
+        titles = "、".join(note["title"] for note, _, _, _ in results[:3]) or "无结果"
+        print(f"  [{elapsed:6.2f} ms] {query} -> {titles}")
+
+
+if __name__ == "__main__":
+    main()
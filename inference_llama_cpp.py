@@ -1,14 +1,23 @@
-from llama_cpp import Llama
+from llama_cpp import Llama, LogitsProcessorList
 import json
 import os
-from tqdm import tqdm
+import threading
 from obsidian_loader import ObsidianLoader
+from passages import llama_token_counter, pack_context
+from llama_prefix_cache import PrefixStateCache
+from batch_inference import plan_contexts, run_batch
+from cjk_logits import TokenMask
+import text_classify
 
 # 配置参数
 MODEL_PATH = "E:/R1/TheBloke/Llama-2-7B-Chat-GGUF"  # 稍后会在这里加上具体的文件名
 OUTPUT_DIR = "outputs"
 USE_CUDA = True  # 启用CUDA支持
 OBSIDIAN_VAULT = "E:/kubook"  # Obsidian vault 路径
+N_GPU_LAYERS = -1 if USE_CUDA else 0
+CONSTRAINED_DECODING = "hard"  # 中文约束解码：hard / soft / None (关闭)
+PARALLEL_CONTEXTS = None  # 并行的 llama.cpp 上下文数，None 表示按 CPU 核数和内存自动决定
+CONTEXT_TOKENS = 768  # 知识库参考资料最多占用的 token 数 (n_ctx=2048，max_tokens=512)
 
 def find_model_file(model_dir):
     """在指定目录中查找.gguf模型文件"""
@@ -24,17 +33,19 @@ def load_training_data(file_path="train.json"):
     with open(file_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def format_prompt(instruction, context="", input_text=""):
-    """格式化提示模板"""
-    system_prompt = """你是一个专业的中文AI助手。你只能用中文回答问题。注意以下要求：
+SYSTEM_PROMPT = """你是一个专业的中文AI助手。你只能用中文回答问题。注意以下要求：
 1. 保持逻辑清晰，语言连贯，避免前言不搭后语
 2. 如果提供了知识库内容，必须基于知识库内容作答
 3. 不要编造内容，如果不确定就说"抱歉，我对这方面不太确定"
 4. 每个回答都应该有清晰的重点和结构
 5. 如果遇到复杂问题，需要分点解释"""
-    
+# 所有提示共用的开头，其 KV 状态由 PrefixStateCache 缓存
+PROMPT_PREFIX = f"[INST] <<SYS>>\n{SYSTEM_PROMPT}\n<</SYS>>\n\n"
+
+def format_prompt(instruction, context="", input_text=""):
+    """格式化提示模板"""
     # 创建一个自然的对话格式
-    prompt = f"[INST] <<SYS>>\n{system_prompt}\n<</SYS>>\n\n"
+    prompt = PROMPT_PREFIX
     
     if context:
         prompt += f"根据以下参考资料回答：\n\n{context}\n\n"
@@ -57,7 +68,7 @@ def filter_response(text):
                .strip())
     
     # 确保回答是中文
-    chinese_char_count = sum(1 for char in text if '\u4e00' <= char <= '\u9fff')
+    chinese_char_count = text_classify.count(text, text_classify.HAN)
     if chinese_char_count < len(text) * 0.5:  # 如果中文字符少于50%
         return "抱歉，我将用中文重新组织答案。"
     
@@ -72,23 +83,18 @@ def filter_response(text):
     
     # 删除可能的英文回复
     lines = text.split('\n')
-    chinese_lines = [line for line in lines if any('\u4e00' <= char <= '\u9fff' for char in line)]
+    chinese_lines = [line for line in lines if text_classify.count(line, text_classify.HAN)]
     text = '\n'.join(chinese_lines)
     
     return text
 
-def search_knowledge_base(query, obsidian_loader):
-    """搜索知识库相关内容"""
-    results = obsidian_loader.search_documents(query)
-    if not results:
+def search_knowledge_base(query, obsidian_loader, llm, budget=CONTEXT_TOKENS):
+    """搜索知识库相关段落，按分数拼接成不超过 budget 个 token 的参考资料"""
+    passages = obsidian_loader.search_passages(query)
+    if not passages:
         return ""
     
-    # 合并相关文档内容
-    context = "\n\n".join([
-        f"文档：{doc['title']}\n{doc['content'][:500]}..."  # 只使用前500个字符
-        for doc in results[:3]  # 最多使用前3个相关文档
-    ])
-    
+    context, _, _ = pack_context(passages, budget, llama_token_counter(llm))
     return context
 
 def main():
@@ -103,65 +109,75 @@ def main():
     
     print(f"找到模型文件：{os.path.basename(model_file)}")
     
-    # 初始化模型
-    print(f"正在加载模型: {os.path.basename(model_file)}...")
-    llm = Llama(
-        model_path=model_file,
-        n_ctx=2048,
-        n_threads=6,
-        n_gpu_layers=-1,
-        verbose=True
-    )
-    
+    # 初始化模型：每个并行上下文在自己的线程中各创建一个 Llama
+    contexts, n_threads = plan_contexts(PARALLEL_CONTEXTS, N_GPU_LAYERS)
+    print(f"正在加载模型: {os.path.basename(model_file)} ({contexts} 个上下文，每个 {n_threads} 线程)...")
+    prefix_caches = []
+    mask_lock = threading.Lock()
+
+    def make_llm():
+        llm = Llama(
+            model_path=model_file,
+            n_ctx=2048,
+            n_threads=n_threads,
+            n_gpu_layers=N_GPU_LAYERS,
+            verbose=contexts == 1
+        )
+        prefix_cache = PrefixStateCache(llm)
+        prefix_caches.append(prefix_cache)
+        token_mask = None
+        if CONSTRAINED_DECODING:
+            # 第一个上下文分类词表并写入缓存，其余上下文直接读取
+            with mask_lock:
+                token_mask = TokenMask.from_llama(llm)
+        return prefix_cache, token_mask
+
+    def generate(worker, item):
+        prefix_cache, token_mask = worker
+        logits_processor = None
+        if token_mask is not None:
+            logits_processor = LogitsProcessorList([token_mask.llama_processor(CONSTRAINED_DECODING)])
+        # 准备输入
+        prompt = format_prompt(item["instruction"], item["input"])
+        # 生成回复 (系统提示部分直接恢复缓存的 KV 状态)
+        completion = prefix_cache.complete(
+            PROMPT_PREFIX,
+            prompt,
+            max_tokens=512,
+            temperature=0.3,  # 降低温度值以获得更稳定的输出
+            top_p=0.9,
+            top_k=40,
+            repeat_penalty=1.1,
+            stop=["[INST]", "[/INST]", "<<SYS>>", "<</SYS>>"],
+            echo=False,
+            logits_processor=logits_processor
+        )
+
+        # 获取生成的文本
+        response = completion['choices'][0]['text'] if completion.get('choices') else ""
+
+        # 过滤和格式化输出
+        generated_text = filter_response(response.strip())
+
+        result = {
+            "prompt": prompt,
+            "expected": item["output"],
+            "generated": generated_text
+        }
+        return result, completion.get("usage")
+
     # 加载训练数据
     print("正在加载训练数据...")
     training_data = load_training_data()
-    
-    # 对每个样本进行处理
+
+    # 并行处理样本，结果由单独的写入线程追加到 results.jsonl；重跑时跳过已完成的样本
     print("开始处理训练数据...")
-    for item in tqdm(training_data["data"]):
-        # 准备输入
-        prompt = format_prompt(item["instruction"], item["input"])
-        
-        try:
-            # 生成回复
-            completion = llm(
-                prompt,
-                max_tokens=512,
-                temperature=0.3,  # 降低温度值以获得更稳定的输出
-                top_p=0.9,
-                top_k=40,
-                repeat_penalty=1.1,
-                stop=["[INST]", "[/INST]", "<<SYS>>", "<</SYS>>"],
-                echo=False
-            )
-            
-            # 获取生成的文本
-            response = completion['choices'][0]['text'] if completion.get('choices') else ""
-            
-            # 过滤和格式化输出
-            generated_text = filter_response(response.strip())
-            
-            # 打印结果对比
-            print("\n===== 输出结果 =====")
-            print(f"问题: {item['instruction']}")
-            print(f"模型回答: {generated_text}")
-            print("==================\n")
-            
-            # 保存结果
-            result = {
-                "prompt": prompt,
-                "expected": item["output"],
-                "generated": generated_text
-            }
-            
-            # 写入结果
-            with open(os.path.join(OUTPUT_DIR, "results.jsonl"), "a", encoding="utf-8") as f:
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                
-        except Exception as e:
-            print(f"生成过程中出错: {e}")
-            continue
+    stats = run_batch(training_data["data"], make_llm, generate,
+                      os.path.join(OUTPUT_DIR, "results.jsonl"), contexts=contexts)
+
+    print(stats.summary())
+    for prefix_cache in prefix_caches:
+        print(prefix_cache.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,223 @@
+"""
+笔记之间的链接图 (Obsidian 的 [[双链]]、Markdown 链接和标签)，用于检索时扩展相邻笔记
+
+建索引时 parse_links 从每篇笔记中取出链接目标和标签，存进 docs.json；
+每次发布新的一代索引时，LinkGraph.build 按 Obsidian 的规则解析链接目标，建成 CSR 邻接结构：
+  - indptr (int64，笔记数 + 1)、indices (int32)、weights (float32)，每行按权重降序；
+  - 正向链接权重 LINK_WEIGHT，反向链接 BACKLINK_WEIGHT，同一标签的笔记之间 TAG_WEIGHT / log2(1 + 标签笔记数)
+    (超过 MAX_TAG_NOTES 篇笔记的标签太泛，不连边)；
+  - 数组保存为 graph-<代>/ 下的 .npy，启动时内存映射。
+expand(hits) 对命中的笔记各取权重最高的 EXPAND_PER_HIT 个邻居，分数 = 命中分数 × 边权重 × NEIGHBOR_DECAY，
+只做数组切片，不读文件，耗时在微秒级。
+
+命令行：python link_graph.py <vault> [--note 笔记路径]
+"""
+import argparse
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from urllib.parse import unquote
+
+import numpy as np
+
+LINK_WEIGHT = 1.0
+BACKLINK_WEIGHT = 0.6
+TAG_WEIGHT = 0.5
+# 标签下的笔记超过这个数就不再为它连边 (例如 #日记)
+MAX_TAG_NOTES = 50
+# 每个命中笔记最多扩展的邻居数
+EXPAND_PER_HIT = 5
+NEIGHBOR_DECAY = 0.5
+ARRAY_NAMES = ("indptr", "indices", "weights")
+
+# [[目标]]、[[目标|别名]]、[[目标#标题]]、![[嵌入]]
+_WIKILINK_RE = re.compile(r"!?\[\[([^\]|#^\n]*)(?:[#^][^\]|\n]*)?(?:\|[^\]\n]*)?\]\]")
+# [文字](相对路径.md)，不含外部链接
+_MDLINK_RE = re.compile(r"\[[^\]\n]*\]\((?!\w+://)([^)\s#]+\.md)(?:#[^)\s]*)?\)")
+# 正文中的 #标签 (前面不能是字母数字或 #，排除 Markdown 标题和网址锚点)
+_TAG_RE = re.compile(r"(?<![\w#/&])#([^\s!-,.:-@\[-^`{-~，。、；：？！…（）【】《》“”‘’]+)")
+_CODE_RE = re.compile(r"```.*?```|`[^`\n]*`", re.DOTALL)
+_FM_TAGS_RE = re.compile(r"^tags?:[ \t]*(.*)$((?:\n[ \t]*-[ \t]*.+)*)", re.MULTILINE)
+
+
+def parse_links(frontmatter, body):
+    """返回 (链接目标列表, 标签列表)；链接目标保留原样 (可能是笔记名，也可能是相对路径)"""
+    text = _CODE_RE.sub("", body)
+    links = [m.group(1).strip() for m in _WIKILINK_RE.finditer(text) if m.group(1).strip()]
+    links += [unquote(m.group(1)) for m in _MDLINK_RE.finditer(text)]
+    # 纯数字的不算标签 (例如 #1)
+    tags = [t.rstrip("/") for t in _TAG_RE.findall(text) if not t.isdigit()]
+    for inline, block in _FM_TAGS_RE.findall(frontmatter):
+        values = inline.strip().strip("[]").split(",") if inline.strip() else []
+        values += [line.split("-", 1)[1] for line in block.strip().splitlines()]
+        tags += [v.strip().strip("'\"").lstrip("#") for v in values if v.strip()]
+    return list(dict.fromkeys(links)), list(dict.fromkeys(t.lower() for t in tags if t))
+
+
+def _note_key(path):
+    """链接按不带 .md 的路径匹配，不区分大小写"""
+    return path[:-3].lower() if path.lower().endswith(".md") else path.lower()
+
+
+class LinkResolver:
+    """按 Obsidian 的规则把链接目标解析成笔记路径"""
+
+    def __init__(self, paths):
+        self.by_key = {_note_key(p): p for p in paths}
+        self.by_name = defaultdict(list)
+        for p in paths:
+            self.by_name[_note_key(p).rsplit("/", 1)[-1]].append(p)
+
+    def resolve(self, source, target):
+        target = target.replace("\\", "/").strip("/")
+        folder = source.rsplit("/", 1)[0] if "/" in source else ""
+        if target.endswith(".md") or target.startswith("."):
+            # Markdown 链接：相对当前笔记所在目录
+            path = os.path.normpath(os.path.join(folder, target)).replace(os.sep, "/")
+            return self.by_key.get(_note_key(path))
+        key = _note_key(target)
+        if "/" in key:
+            if key in self.by_key:
+                return self.by_key[key]
+            candidates = [p for p in self.by_name.get(key.rsplit("/", 1)[-1], ())
+                          if _note_key(p).endswith("/" + key)]
+        else:
+            candidates = self.by_name.get(key, [])
+        if not candidates:
+            return None
+        # 重名时优先同一目录，其次路径最短
+        return min(candidates, key=lambda p: (p.rsplit("/", 1)[0] != folder, len(p), p))
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path)
+
+
+class LinkGraph:
+    """笔记链接图：nodes 为排好序的笔记路径，边以 CSR 数组保存"""
+
+    def __init__(self, nodes, indptr, indices, weights):
+        self.nodes = nodes
+        self.index = {path: i for i, path in enumerate(nodes)}
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @classmethod
+    def build(cls, notes):
+        """notes: {路径: 索引中的文档 (含 'links'、'tags')}"""
+        nodes = sorted(notes)
+        index = {path: i for i, path in enumerate(nodes)}
+        resolver = LinkResolver(nodes)
+        src, dst, weight = [], [], []
+        tag_members = defaultdict(list)
+        for path in nodes:
+            doc = notes[path]
+            i = index[path]
+            for target in doc.get("links", ()):
+                resolved = resolver.resolve(path, target)
+                if resolved is None or resolved == path:
+                    continue
+                j = index[resolved]
+                src += [i, j]
+                dst += [j, i]
+                weight += [LINK_WEIGHT, BACKLINK_WEIGHT]
+            for tag in doc.get("tags", ()):
+                tag_members[tag].append(i)
+        for members in tag_members.values():
+            if not 2 <= len(members) <= MAX_TAG_NOTES:
+                continue
+            w = TAG_WEIGHT / np.log2(1 + len(members))
+            members = np.asarray(members)
+            a, b = np.meshgrid(members, members)
+            pairs = a != b
+            src.extend(a[pairs].tolist())
+            dst.extend(b[pairs].tolist())
+            weight.extend([w] * int(pairs.sum()))
+        return cls(nodes, *cls._csr(len(nodes), src, dst, weight))
+
+    @staticmethod
+    def _csr(n, src, dst, weight):
+        """合并重复的边 (权重相加)，每行按权重降序"""
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        weight = np.asarray(weight, dtype=np.float32)
+        if len(src):
+            key = src * n + dst
+            order = np.argsort(key, kind="stable")
+            key, weight = key[order], weight[order]
+            unique, starts = np.unique(key, return_index=True)
+            weight = np.add.reduceat(weight, starts)
+            src, dst = unique // n, unique % n
+            order = np.lexsort((-weight, src))
+            src, dst, weight = src[order], dst[order], weight[order]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return indptr, dst.astype(np.int32), weight.astype(np.float32)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        # nodes.json 最后写，作为图已写完整的标志
+        with open(os.path.join(path, "nodes.json"), "w", encoding="utf-8") as f:
+            json.dump(self.nodes, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "nodes.json"), "r", encoding="utf-8") as f:
+            nodes = json.load(f)
+        return cls(nodes, *(_load_array(os.path.join(path, f"{name}.npy")) for name in ARRAY_NAMES))
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def neighbors(self, path, limit=None):
+        """[(邻居路径, 权重)]，按权重降序"""
+        i = self.index.get(path)
+        if i is None:
+            return []
+        lo, hi = int(self.indptr[i]), int(self.indptr[i + 1])
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return [(self.nodes[j], float(w)) for j, w in zip(self.indices[lo:hi].tolist(), self.weights[lo:hi].tolist())]
+
+    def expand(self, hits, n_extra, per_hit=EXPAND_PER_HIT, decay=NEIGHBOR_DECAY):
+        """hits: [(路径, 分数)]；返回不在 hits 中、分数最高的 n_extra 个邻居 [(路径, 分数)]"""
+        hit_paths = {path for path, _ in hits}
+        scores = {}
+        for path, score in hits:
+            for neighbor, weight in self.neighbors(path, per_hit):
+                if neighbor not in hit_paths:
+                    scores[neighbor] = scores.get(neighbor, 0.0) + score * weight * decay
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_extra]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看知识库的链接图")
+    parser.add_argument("vault", help="vault 路径")
+    parser.add_argument("--note", action="append", default=[], help="显示这篇笔记的邻居 (相对路径，可重复)")
+    args = parser.parse_args()
+    from obsidian_loader import ObsidianLoader
+
+    loader = ObsidianLoader(args.vault)
+    graph = loader.view.graph
+    print(f"{len(graph.nodes)} 篇笔记，{graph.n_edges} 条边")
+    notes = args.note or [graph.nodes[int(np.argmax(np.diff(graph.indptr)))]] if graph.nodes else []
+    for path in notes:
+        start = time.perf_counter()
+        expanded = graph.expand([(path, 1.0)], 10)
+        elapsed = (time.perf_counter() - start) * 1e6
+        print(f"{path} ({elapsed:.0f} µs):")
+        for neighbor, score in expanded:
+            print(f"  {score:.3f}  {neighbor}")
+
+
+if __name__ == "__main__":
+    main()
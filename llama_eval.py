@@ -0,0 +1,86 @@
+"""
+llama.cpp 模型的对数似然评估
+
+原来的 evaluate_model 对每条验证样本生成 len(target) + 50 个 token，
+再和目标文本做字符串比较：逐 token 解码很慢，温度采样也让结果有噪声。
+这里改为对 prompt + target 做一次批量前向 (prefill)，
+只在 target 部分计算每个 token 的负对数似然 (NLL) 和困惑度 (perplexity)。
+
+要求：Llama 需要以 logits_all=True 创建 (保存每个位置的 logits)，并且不要开启 embedding 模式。
+注意 logits_all 会分配 n_ctx × 词表大小 的 float32 缓冲区 (Llama 3: 4096 × 128256 ≈ 2GB)。
+"""
+import math
+
+import numpy as np
+
+# 评估模式：nll 为对数似然，generate 为原来的生成 + 字符串比较
+EVAL_MODES = ("nll", "generate")
+# nll 模式下 prefill 的批大小，越大越快 (受显存/内存限制)
+EVAL_N_BATCH = 512
+
+
+def target_nll(llm, prompt, target, prefix_cache=None, prefix=""):
+    """计算 target 在 prompt 条件下的 NLL，返回 (NLL 总和, target token 数)
+
+    提供 prefix_cache (llama_prefix_cache.PrefixStateCache) 和 prompt 的公共前缀时，
+    前缀部分直接恢复缓存的 KV 状态，只对其余部分做前向。
+    """
+    prompt_tokens = llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+    tokens = llm.tokenize((prompt + target).encode("utf-8"), add_bos=True, special=True)
+    tokens = tokens[:llm.n_ctx()]
+
+    # 分词可能跨越 prompt 与 target 的边界合并，用公共前缀确定 target 的起点
+    start = 0
+    for a, b in zip(prompt_tokens, tokens):
+        if a != b:
+            break
+        start += 1
+    start = max(start, 1)  # 第一个 token 没有可以预测它的位置
+    if start >= len(tokens):
+        return 0.0, 0
+
+    if prefix_cache is not None and prefix:
+        prefix_cache.activate(prefix)
+        n_past = 0
+        for a, b in zip(llm.input_ids[:llm.n_tokens].tolist(), tokens):
+            if a != b:
+                break
+            n_past += 1
+        # 至少重新计算最后一个 prompt token，它的 logits 预测 target 的第一个 token
+        llm.n_tokens = min(n_past, start - 1)
+        llm.eval(tokens[llm.n_tokens:])
+    else:
+        llm.reset()
+        llm.eval(tokens)
+    # 第 i 个位置的 logits 预测第 i+1 个 token
+    logits = np.asarray(llm.scores[start - 1:len(tokens) - 1], dtype=np.float32)
+    targets = np.asarray(tokens[start:], dtype=np.int64)
+
+    # log_softmax，只在需要的行上计算
+    row_max = logits.max(axis=1, keepdims=True)
+    log_norm = row_max[:, 0] + np.log(np.exp(logits - row_max).sum(axis=1))
+    token_logprob = logits[np.arange(len(targets)), targets] - log_norm
+    return float(-token_logprob.sum()), len(targets)
+
+
+def evaluate_nll(llm, eval_data, format_prompt, prefix_cache=None, prefix=""):
+    """在验证集上计算 target 部分的平均 NLL 和困惑度
+
+    返回 (平均每 token NLL, 困惑度)。出错的样本会被跳过。
+    """
+    total_nll = 0.0
+    total_tokens = 0
+    for item in eval_data:
+        prompt = format_prompt(item["instruction"], item.get("input", ""))
+        try:
+            nll, n_tokens = target_nll(llm, prompt, item["output"], prefix_cache, prefix)
+        except Exception as e:
+            print(f"评估时出错: {str(e)}")
+            continue
+        total_nll += nll
+        total_tokens += n_tokens
+
+    if total_tokens == 0:
+        return float("inf"), float("inf")
+    mean_nll = total_nll / total_tokens
+    return mean_nll, math.exp(mean_nll)
@@ -0,0 +1,100 @@
+"""
+llama.cpp 公共前缀的 KV 状态缓存
+
+评估和测试时每条提示都以同样的系统提示 / [INST] <<SYS>>…<</SYS>> 开头，
+中文系统提示往往有几百个 token，llama.cpp 却每次都重新计算它。
+PrefixStateCache 在前缀求值完成后用 save_state() 保存 KV 状态，下次直接 load_state()；
+之后调用 llm(prompt) 时，llama-cpp-python 的前缀匹配只会对剩余部分做 prompt eval。
+多个前缀按 LRU 保存，总大小受内存上限约束。
+
+用法：
+    cache = PrefixStateCache(llm)
+    cache.activate(PROMPT_PREFIX)      # 每次调用 llm(prompt) 之前
+    completion = llm(prompt, ...)
+    print(cache.summary())
+"""
+import time
+from collections import OrderedDict
+
+# 默认最多占用 1GB 内存保存前缀状态
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+class PrefixStateCache:
+    """按前缀 token 序列缓存 Llama 的 KV 状态 (LRU，按字节数限制)"""
+
+    def __init__(self, llm, max_bytes=DEFAULT_MAX_BYTES):
+        self.llm = llm
+        self.max_bytes = max_bytes
+        self._states = OrderedDict()  # 前缀 tokens -> LlamaState
+        self._eval_seconds = {}  # 前缀 tokens -> 首次求值耗时
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def _tokenize(self, text):
+        # 与 create_completion 的分词方式一致，前缀匹配才能命中
+        return tuple(self.llm.tokenize(text.encode("utf-8"), add_bos=True, special=True))
+
+    def _holds_prefix(self, tokens):
+        n = len(tokens)
+        return self.llm.n_tokens >= n and tuple(self.llm.input_ids[:n].tolist()) == tokens
+
+    def activate(self, prefix):
+        """让模型的 KV 缓存处于 prefix 求值之后的状态，返回前缀的 token 数"""
+        tokens = self._tokenize(prefix)
+        if not tokens:
+            return 0
+
+        # 上一次调用留下的 KV 已经以这个前缀开头，什么都不用做
+        if self._holds_prefix(tokens) and tokens in self._eval_seconds:
+            self.hits += 1
+            self.saved_seconds += self._eval_seconds[tokens]
+            return len(tokens)
+
+        state = self._states.get(tokens)
+        if state is not None:
+            start = time.perf_counter()
+            self.llm.load_state(state)
+            load_seconds = time.perf_counter() - start
+            self._states.move_to_end(tokens)
+            self.hits += 1
+            self.saved_seconds += max(0.0, self._eval_seconds[tokens] - load_seconds)
+            return len(tokens)
+
+        self.misses += 1
+        self.llm.reset()
+        start = time.perf_counter()
+        self.llm.eval(list(tokens))
+        self._eval_seconds[tokens] = time.perf_counter() - start
+        self._store(tokens, self.llm.save_state())
+        return len(tokens)
+
+    @staticmethod
+    def _state_bytes(state):
+        # 除了 llama.cpp 的状态，LlamaState 还带着 scores (每个位置一行 logits) 和 input_ids 的副本
+        return state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+
+    def _store(self, tokens, state):
+        size = self._state_bytes(state)
+        if size > self.max_bytes:
+            return
+        self._states[tokens] = state
+        self.total_bytes += size
+        # 超出内存上限时淘汰最久未使用的前缀
+        while self.total_bytes > self.max_bytes:
+            _, old = self._states.popitem(last=False)
+            self.total_bytes -= self._state_bytes(old)
+
+    def complete(self, prefix, prompt, **kwargs):
+        """先恢复 prefix 的状态再调用 llm(prompt)，prompt 必须以 prefix 开头"""
+        self.activate(prefix)
+        return self.llm(prompt, **kwargs)
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        per_item = self.saved_seconds / self.hits * 1000 if self.hits else 0.0
+        return (f"前缀缓存: 命中 {self.hits}/{lookups}，共节省 prompt eval {self.saved_seconds:.2f}s "
+                f"(每条约 {per_item:.0f} ms)，缓存 {len(self._states)} 个前缀，"
+                f"{self.total_bytes / 1024 ** 2:.0f} MB")
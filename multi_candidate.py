@@ -0,0 +1,257 @@
+"""
+共享一次 prompt prefill 的多候选并行生成 (llama.cpp 多序列批量解码)
+
+enforce_chinese_response 需要多个候选 (温度 0.7/0.5/0.3) 时是依次生成的，
+每个候选都要重新处理整个提示，包括几百个 token 的知识库上下文。
+MultiCandidateGenerator 在同一个模型上另建一个支持多序列的 llama.cpp 上下文：
+  1. 提示只在序列 0 上 prefill 一次；
+  2. 用 KV 序列复制把前缀分给序列 1..N-1 (上下文使用统一 KV 缓存，复制只是给同一批单元加上序列号，不复制数据)；
+  3. 之后每一步把 N 个序列的新 token 放进同一个 batch 解码，各序列用自己的采样参数。
+解码一步的耗时主要在读取权重，N 个序列一起解码与一个序列相差不大，
+所以 N 个候选的总耗时接近只生成一个。
+
+llama-cpp-python 的高层 API 每个上下文只有一个序列，这里直接使用底层 C API；
+KV 序列操作的函数名在各版本之间改过 (llama_kv_cache_* / llama_kv_self_* / llama_memory_*)，都做了兼容。
+
+基准测试：python multi_candidate.py --model path/to/model.gguf
+"""
+import argparse
+import ctypes
+import time
+
+import numpy as np
+
+import llama_cpp
+
+# 与 llama.cpp 默认值一致的 repeat_penalty 窗口
+REPEAT_LAST_N = 64
+
+
+def _memory_api(ctx):
+    """返回 (seq_cp, clear, seq_rm) 三个函数，兼容不同版本的 llama.cpp"""
+    if hasattr(llama_cpp, "llama_get_memory") and hasattr(llama_cpp, "llama_memory_seq_cp"):
+        mem = llama_cpp.llama_get_memory(ctx)
+        return (lambda src, dst, p0, p1: llama_cpp.llama_memory_seq_cp(mem, src, dst, p0, p1),
+                lambda: llama_cpp.llama_memory_clear(mem, True),
+                lambda seq, p0, p1: llama_cpp.llama_memory_seq_rm(mem, seq, p0, p1))
+    if hasattr(llama_cpp, "llama_kv_self_seq_cp"):
+        return (lambda src, dst, p0, p1: llama_cpp.llama_kv_self_seq_cp(ctx, src, dst, p0, p1),
+                lambda: llama_cpp.llama_kv_self_clear(ctx),
+                lambda seq, p0, p1: llama_cpp.llama_kv_self_seq_rm(ctx, seq, p0, p1))
+    return (lambda src, dst, p0, p1: llama_cpp.llama_kv_cache_seq_cp(ctx, src, dst, p0, p1),
+            lambda: llama_cpp.llama_kv_cache_clear(ctx),
+            lambda seq, p0, p1: llama_cpp.llama_kv_cache_seq_rm(ctx, seq, p0, p1))
+
+
+def _new_context(model, params):
+    if hasattr(llama_cpp, "llama_init_from_model"):
+        return llama_cpp.llama_init_from_model(model, params)
+    return llama_cpp.llama_new_context_with_model(model, params)
+
+
+def sample_token(logits, params, history, rng, logits_processor=None):
+    """按 llama.cpp 的顺序采样：repeat_penalty -> top_k -> top_p -> temperature
+
+    logits 会被原地修改。history 为该序列的 prompt + 已生成 token (numpy intc 数组)。
+    """
+    if logits_processor is not None:
+        logits = logits_processor(history, logits)
+
+    penalty = params.get("repeat_penalty", 1.0)
+    if penalty != 1.0 and len(history):
+        recent = np.unique(history[-REPEAT_LAST_N:])
+        values = logits[recent]
+        logits[recent] = np.where(values > 0, values / penalty, values * penalty)
+
+    temperature = params.get("temperature", 0.8)
+    if temperature <= 0:
+        return int(np.argmax(logits))
+
+    top_k = params.get("top_k", 40)
+    if 0 < top_k < len(logits):
+        candidates = np.argpartition(logits, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(len(logits))
+    candidates = candidates[np.argsort(logits[candidates])[::-1]]
+    values = logits[candidates].astype(np.float64)
+    values -= values[0]
+    # -inf (被约束解码禁止的 token) 在 softmax 中概率为 0
+
+    top_p = params.get("top_p", 1.0)
+    if top_p < 1.0:
+        probs = np.exp(values)
+        keep = int(np.searchsorted(np.cumsum(probs / probs.sum()), top_p)) + 1
+        candidates, values = candidates[:keep], values[:keep]
+
+    probs = np.exp(values / temperature)
+    probs /= probs.sum()
+    return int(candidates[rng.choice(len(candidates), p=probs)])
+
+
+class MultiCandidateGenerator:
+    """在 llm 的模型权重上另建一个多序列上下文，批量生成多个候选
+
+    n_ctx 为所有序列共享的 KV 缓存大小：提示只占一份，每个候选的生成部分各占一份。
+    """
+
+    def __init__(self, llm, n_seq=3, n_ctx=None, n_batch=512, seed=None):
+        self.llm = llm
+        self.n_seq = n_seq
+        self.n_vocab = llm.n_vocab()
+        self.n_batch = n_batch
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_ctx or llm.n_ctx() * 2
+        params.n_batch = n_batch
+        params.n_seq_max = n_seq
+        params.n_threads = llm.n_threads
+        params.n_threads_batch = llm.n_threads_batch
+        # 较新的 llama.cpp 默认每个序列一块独立的 KV 缓存 (kv_unified=False)，序列间复制会触发 GGML_ASSERT；
+        # 统一缓存下所有序列共用一块，复制前缀只加序列号 (没有这个字段的旧版本总是统一缓存)
+        if hasattr(params, "kv_unified"):
+            params.kv_unified = True
+        self.ctx = _new_context(llm.model, params)
+        if self.ctx is None:
+            raise RuntimeError("无法创建多序列 llama.cpp 上下文")
+        self.n_ctx = llama_cpp.llama_n_ctx(self.ctx)
+        self.batch = llama_cpp.llama_batch_init(max(n_batch, n_seq), 0, n_seq)
+        self._seq_cp, self._clear, self._seq_rm = _memory_api(self.ctx)
+        self.rng = np.random.default_rng(seed)
+        self.eos = llm.token_eos()
+
+    def close(self):
+        if self.batch is not None:
+            llama_cpp.llama_batch_free(self.batch)
+            self.batch = None
+        if self.ctx is not None:
+            llama_cpp.llama_free(self.ctx)
+            self.ctx = None
+
+    def __del__(self):
+        self.close()
+
+    def _decode(self, entries):
+        """entries: [(token, pos, seq_id, need_logits)]"""
+        batch = self.batch
+        batch.n_tokens = len(entries)
+        for i, (token, pos, seq_id, need_logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = pos
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq_id
+            batch.logits[i] = need_logits
+        ret = llama_cpp.llama_decode(self.ctx, batch)
+        if ret != 0:
+            raise RuntimeError(f"llama_decode 失败 (返回值 {ret})，可能是 KV 缓存空间不足")
+
+    def _logits(self, i):
+        ptr = llama_cpp.llama_get_logits_ith(self.ctx, i)
+        # 复制一份，下一次 decode 会覆盖这块内存
+        return np.ctypeslib.as_array(ctypes.cast(ptr, ctypes.POINTER(ctypes.c_float)), shape=(self.n_vocab,)).copy()
+
+    def prefill(self, tokens):
+        """在序列 0 上处理提示，再把它复制给其余序列，返回最后一个位置的 logits"""
+        self._clear()
+        n = len(tokens)
+        for start in range(0, n, self.n_batch):
+            chunk = tokens[start:start + self.n_batch]
+            self._decode([(t, start + j, 0, start + j == n - 1) for j, t in enumerate(chunk)])
+        logits = self._logits((n - 1) % self.n_batch)
+        for seq in range(1, self.n_seq):
+            self._seq_cp(0, seq, 0, n)
+        return logits
+
+    def generate(self, prompt, params_list, max_tokens=512, stop=(), logits_processors=None):
+        """用 params_list 中的每组采样参数各生成一个候选
+
+        返回与 params_list 同序的列表，每项为 {"text", "n_tokens", "finish_reason", "params"}。
+        logits_processors: 每个候选各自的处理器 (例如 cjk_logits 的约束解码)，可为 None。
+        """
+        n = len(params_list)
+        if n > self.n_seq:
+            raise ValueError(f"候选数 {n} 超过上下文支持的序列数 {self.n_seq}")
+        prompt_tokens = self.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+        n_prompt = len(prompt_tokens)
+        # 每个序列的生成部分各占一份 KV 空间
+        max_tokens = max(0, min(max_tokens, (self.n_ctx - n_prompt) // n))
+        if max_tokens == 0:
+            raise ValueError(f"提示有 {n_prompt} 个 token，超出多序列上下文大小 {self.n_ctx}")
+        processors = logits_processors or [None] * n
+
+        first_logits = self.prefill(prompt_tokens)
+        histories = [list(prompt_tokens) for _ in range(n)]
+        pieces = [bytearray() for _ in range(n)]
+        results = [{"text": "", "n_tokens": 0, "finish_reason": "length", "params": p} for p in params_list]
+        active = list(range(n))
+        logits_rows = {seq: first_logits.copy() for seq in active}
+
+        for step in range(max_tokens):
+            entries = []
+            for seq in list(active):
+                history = np.asarray(histories[seq], dtype=np.intc)
+                token = sample_token(logits_rows[seq], params_list[seq], history, self.rng, processors[seq])
+                if token == self.eos:
+                    results[seq]["finish_reason"] = "stop"
+                    active.remove(seq)
+                    continue
+                histories[seq].append(token)
+                results[seq]["n_tokens"] += 1
+                pieces[seq] += self.llm.detokenize([token])
+                # 只检查结尾部分是否出现停止词
+                tail = bytes(pieces[seq][-64:]).decode("utf-8", errors="ignore")
+                if any(s in tail for s in stop):
+                    results[seq]["finish_reason"] = "stop"
+                    active.remove(seq)
+                    continue
+                entries.append((token, n_prompt + step, seq, True))
+            if not entries:
+                break
+            self._decode(entries)
+            logits_rows = {seq: self._logits(i) for i, (_, _, seq, _) in enumerate(entries)}
+
+        for seq, result in enumerate(results):
+            # 整段解码 (逐个 token 解码会丢掉 sentencepiece 的词首空格)
+            text = self.llm.detokenize(histories[seq][n_prompt:]).decode("utf-8", errors="ignore")
+            # 和 create_completion 一样，截掉停止词及其后的内容
+            cut = min((text.find(s) for s in stop if s in text), default=-1)
+            result["text"] = text[:cut] if cut >= 0 else text
+        return results
+
+
+def benchmark(model_path, n_seq=3, max_tokens=128):
+    """对比依次生成 n_seq 个候选和多序列并行生成的耗时"""
+    from llama_cpp import Llama
+
+    llm = Llama(model_path=model_path, n_ctx=2048, n_gpu_layers=-1, verbose=False)
+    prompt = "[INST] 请用中文介绍一下《塞尔达传说：王国之泪》的主要玩法。 [/INST]"
+    temperatures = [0.7, 0.5, 0.3][:n_seq] + [0.7] * max(0, n_seq - 3)
+    params_list = [{"temperature": t, "top_p": 0.95, "top_k": 50, "repeat_penalty": 1.2} for t in temperatures]
+
+    start = time.perf_counter()
+    for params in params_list:
+        llm.reset()  # 不让高层 API 复用上一次的前缀
+        llm(prompt, max_tokens=max_tokens, **params)
+    t_sequential = time.perf_counter() - start
+
+    generator = MultiCandidateGenerator(llm, n_seq=n_seq)
+    start = time.perf_counter()
+    results = generator.generate(prompt, params_list, max_tokens=max_tokens)
+    t_parallel = time.perf_counter() - start
+    generator.close()
+
+    tokens = sum(r["n_tokens"] for r in results)
+    print(f"{n_seq} 个候选，每个最多 {max_tokens} token")
+    print(f"  依次生成: {t_sequential:6.2f}s")
+    print(f"  并行生成: {t_parallel:6.2f}s ({tokens} token，{t_sequential / t_parallel:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多候选并行生成基准测试")
+    parser.add_argument("--model", required=True, help="gguf 模型路径")
+    parser.add_argument("--candidates", type=int, default=3, help="候选数")
+    parser.add_argument("--max-tokens", type=int, default=128, help="每个候选最多生成的 token 数")
+    args = parser.parse_args()
+    benchmark(args.model, args.candidates, args.max_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,980 @@
+"""
+Obsidian 知识库检索：持久化、可增量更新的 BM25 倒排索引
+
+chat.py 和 inference_llama_cpp.py 每个问题都会调用 ObsidianLoader(OBSIDIAN_VAULT).search_documents(query)。
+知识库有几千篇笔记，这里建立倒排索引：
+  - 分词：连续的汉字切成字符二元组 (bigram，单字保留为一元)，英文/数字按单词并转小写；
+  - 词项用 blake2b 哈希成 uint64，词典是排好序的 uint64 数组，查询时二分查找，不需要加载字符串词表；
+  - 倒排表按词项连续存放 (doc_ids: uint32，tfs: uint16)，offsets 指出每个词项的起止位置；
+  - 所有数组保存为 .npy，启动时 np.load(mmap_mode='r') 内存映射，只需几毫秒；
+  - 查询按 BM25 打分，只访问查询词项的倒排表，单次查询远小于 10 ms；
+  - 笔记的读取、解析和分词由 vault_crawler 分批交给进程池，首次建索引随 CPU 核数扩展。
+
+增量更新：
+  - 索引由若干只读的段 (segment) 组成，每个段是一个目录；
+  - 清单 (manifest) 记录每篇笔记的 mtime、大小、内容哈希以及它在哪个段的第几篇；
+  - update() 只 stat 整个 vault，mtime/大小变了才读文件比较内容哈希，
+    新增和修改的笔记写成一个新段，修改和删除的笔记在旧段中标记为已删除 (墓碑)；
+  - 段数超过 MAX_SEGMENTS 或已删除文档过多时，把所有段合并成一个 (直接合并倒排表，不重新分词)。
+
+索引保存在 <vault>/.stylesphere_index/ 下。每次更新写出一个 gen-*.json (段列表、墓碑、清单)，
+写完后再原子替换 CURRENT；内存中的 IndexView 创建后不再修改，后台更新完成后整体替换引用，
+查询不加锁，也不会看到更新了一半的索引。
+VaultWatcher 后台线程在 Linux 上用 inotify 监听笔记变化，其他平台定时轮询。
+传入嵌入模型时同时维护 dense_index.DenseIndex，检索结果按倒数排名融合 (RRF) 两路排序。
+建索引时笔记按 passages.split_passages 切成段落 (存在 docs.json 中)，search_passages 返回打好分的段落，
+供 passages.pack_context 按 token 预算拼接上下文。
+建索引时同时取出笔记的 [[链接]] 和标签，每一代索引附带一个 link_graph.LinkGraph (graph-*/)，
+检索时传入 expand=N 可以再补充 N 篇与命中笔记相链接的笔记。
+search_documents / search_passages 的结果按 (规范化查询, 参数, 索引代) 缓存 (query_cache.LRUCache)，
+发布新的一代时清空；cache_stats() 返回命中/未命中计数。
+
+命令行：python obsidian_loader.py <vault> [--rebuild] [--query 问题] [--modify N]
+"""
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import re
+import select
+import shutil
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from link_graph import LinkGraph, parse_links
+from passages import split_passages
+from query_cache import QUERY_CACHE_SIZE, LRUCache, normalize_query
+from vault_crawler import CrawlStats, crawl, iter_notes
+
+INDEX_DIRNAME = ".stylesphere_index"
+# 索引格式或分词方式改变时递增，旧索引会被重建
+INDEX_VERSION = 4
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 标题中的词项按出现这么多次计算
+TITLE_WEIGHT = 3
+# 不索引的目录 (Obsidian 配置、回收站和索引本身)
+SKIP_DIRS = {".obsidian", ".trash", ".git", INDEX_DIRNAME}
+# 段数超过这个值，或已删除文档占比超过 MAX_DELETED_RATIO 时合并所有段
+MAX_SEGMENTS = 8
+MAX_DELETED_RATIO = 0.3
+# 没有 inotify 时的轮询间隔 (秒)
+POLL_INTERVAL = 5.0
+# 收到文件事件后等这么久没有新事件再更新 (编辑器保存一次往往产生好几个事件)
+WATCH_DEBOUNCE = 0.5
+# 倒数排名融合的常数：融合分数 = Σ 1 / (RRF_K + 排名)
+RRF_K = 60
+# 每一路取 top_k_docs 的这么多倍参与融合
+FUSION_DEPTH = 4
+
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+")
+_FRONTMATTER_RE = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.DOTALL)
+
+ARRAY_NAMES = ("terms", "offsets", "doc_ids", "tfs", "doc_len")
+
+
+def tokenize(text):
+    """汉字按二元组、英文数字按单词切分"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        run = match.group()
+        if run[0].isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def term_hash(term):
+    """词项 -> uint64 (跨进程稳定，不能用内置 hash)"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def split_note(path, data):
+    """笔记内容 (bytes) -> (标题, YAML frontmatter, 正文)；标题为文件名，没有 frontmatter 时为空字符串"""
+    text = data.decode("utf-8", errors="replace").replace("\r\n", "\n")
+    title = os.path.splitext(os.path.basename(path))[0]
+    match = _FRONTMATTER_RE.match(text)
+    if match is None:
+        return title, "", text
+    return title, match.group(1), text[match.end():]
+
+
+def parse_note(path, data):
+    """笔记内容 (bytes) -> (标题, 正文)；正文去掉 YAML frontmatter"""
+    title, _, body = split_note(path, data)
+    return title, body
+
+
+def read_note(path):
+    """读取笔记，返回 (标题, 正文)"""
+    with open(path, "rb") as f:
+        return parse_note(path, f.read())
+
+
+def _skip_dir(name):
+    return name in SKIP_DIRS or name.startswith(".")
+
+
+def scan_vault(vault_path):
+    """vault 中所有 .md 笔记 -> {相对路径 (/ 分隔): (mtime_ns, 大小)}"""
+    return {rel: (mtime, size) for rel, mtime, size in iter_notes(vault_path, _skip_dir)}
+
+
+def list_notes(vault_path):
+    """vault 中所有 .md 笔记的相对路径 (使用 / 分隔，排序)"""
+    return sorted(scan_vault(vault_path))
+
+
+def note_terms(title, body, hash_cache):
+    """一篇笔记的 (词项哈希数组, 词频数组, 文档长度)"""
+    counts = Counter(tokenize(body))
+    for token in tokenize(title):
+        counts[token] += TITLE_WEIGHT
+    hashes = []
+    for token in counts:
+        h = hash_cache.get(token)
+        if h is None:
+            h = hash_cache[token] = term_hash(token)
+        hashes.append(h)
+    hashes = np.array(hashes, dtype=np.uint64)
+    tfs = np.minimum(np.fromiter(counts.values(), dtype=np.int64, count=len(counts)), 0xFFFF).astype(np.uint16)
+    return hashes, tfs, int(sum(counts.values()))
+
+
+def build_postings(all_terms, all_docs, all_tfs):
+    """(词项, 文档, 词频) 三元组 -> terms (排序的唯一哈希)、offsets、doc_ids、tfs 四个数组"""
+    if len(all_terms) == 0:
+        return (np.zeros(0, dtype=np.uint64), np.zeros(1, dtype=np.int64),
+                np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint16))
+    # 按 (词项, 文档) 排序，同一词项的倒排表连续且按文档编号递增
+    order = np.lexsort((all_docs, all_terms))
+    all_terms, all_docs, all_tfs = all_terms[order], all_docs[order], all_tfs[order]
+    terms, starts = np.unique(all_terms, return_index=True)
+    offsets = np.append(starts, len(all_terms)).astype(np.int64)
+    return terms, offsets, all_docs.astype(np.uint32), all_tfs.astype(np.uint16)
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # 空数组无法内存映射
+        return np.load(path)
+
+
+class Segment:
+    """一个只读的索引段 (一个目录：若干 .npy 数组 + docs.json + meta.json)，写出后不再修改"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"索引版本 {self.meta.get('version')} 与当前版本 {INDEX_VERSION} 不一致")
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            self.docs = json.load(f)
+        for name in ARRAY_NAMES:
+            setattr(self, name, _load_array(os.path.join(path, f"{name}.npy")))
+        self.n_docs = len(self.docs)
+
+    @staticmethod
+    def write(path, docs, per_doc, doc_len):
+        """per_doc: [(词项哈希数组, 词频数组)]，与 docs 同序"""
+        if per_doc:
+            all_terms = np.concatenate([h for h, _ in per_doc])
+            all_tfs = np.concatenate([t for _, t in per_doc])
+            all_docs = np.repeat(np.arange(len(per_doc), dtype=np.uint32), [len(h) for h, _ in per_doc])
+        else:
+            all_terms, all_docs, all_tfs = np.zeros(0, np.uint64), np.zeros(0, np.uint32), np.zeros(0, np.uint16)
+        Segment.write_arrays(path, docs, build_postings(all_terms, all_docs, all_tfs), doc_len)
+
+    @staticmethod
+    def write_arrays(path, docs, postings, doc_len):
+        os.makedirs(path, exist_ok=True)
+        terms, offsets, doc_ids, tfs = postings
+        arrays = {"terms": terms, "offsets": offsets, "doc_ids": doc_ids, "tfs": tfs,
+                  "doc_len": np.asarray(doc_len, dtype=np.uint32)}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        meta = {"version": INDEX_VERSION, "n_docs": len(docs), "n_terms": int(len(terms)),
+                "n_postings": int(len(doc_ids)), "created": time.time()}
+        with open(os.path.join(path, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump(docs, f, ensure_ascii=False)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    def postings(self, h):
+        """词项哈希 h 的 (doc_ids, tfs)，不存在时返回 None"""
+        i = int(np.searchsorted(self.terms, np.uint64(h)))
+        if i >= len(self.terms) or self.terms[i] != np.uint64(h):
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    def triples(self, remap):
+        """倒排表展开成 (词项, 新文档编号, 词频)；remap[旧编号] < 0 的文档被丢弃"""
+        terms = np.repeat(self.terms, np.diff(self.offsets))
+        docs = remap[self.doc_ids]
+        keep = docs >= 0
+        return terms[keep], docs[keep], np.asarray(self.tfs)[keep]
+
+
+def merge_segments(path, segments, live):
+    """把 segments 中未删除的文档合并成一个新段，直接合并倒排表，不重新分词
+
+    live: 与 segments 对应的布尔数组列表。返回每个旧段的编号映射 (旧编号 -> 新编号，已删除为 -1)。
+    """
+    docs, doc_len, parts, remaps = [], [], [], []
+    base = 0
+    for segment, alive in zip(segments, live):
+        remap = np.full(segment.n_docs, -1, dtype=np.int64)
+        kept = np.flatnonzero(alive)
+        remap[kept] = np.arange(base, base + len(kept))
+        parts.append(segment.triples(remap))
+        docs.extend(segment.docs[i] for i in kept.tolist())
+        doc_len.append(np.asarray(segment.doc_len)[kept])
+        remaps.append(remap)
+        base += len(kept)
+    postings = build_postings(*(np.concatenate([p[i] for p in parts]) for i in range(3)))
+    Segment.write_arrays(path, docs, postings, np.concatenate(doc_len))
+    return remaps
+
+
+class IndexView:
+    """某一代索引：段列表 + 墓碑 + 清单。创建后不再修改，更新时整体替换"""
+
+    def __init__(self, name, segments, deleted, manifest):
+        self.name = name
+        self.segments = segments
+        self.deleted = deleted  # {段名: [已删除的文档编号]}
+        self.manifest = manifest  # {相对路径: [mtime_ns, 大小, 内容哈希, 段名, 段内文档编号]}
+        self.segment_by_name = {s.name: s for s in segments}
+        self.bases = np.cumsum([0] + [s.n_docs for s in segments]).tolist()
+        self.n_total = self.bases[-1]
+        self.live = np.ones(self.n_total, dtype=bool)
+        for base, segment in zip(self.bases, segments):
+            dead = deleted.get(segment.name)
+            if dead:
+                self.live[base + np.asarray(dead, dtype=np.int64)] = False
+        self.n_docs = int(np.count_nonzero(self.live))
+        self.doc_len = (np.concatenate([np.asarray(s.doc_len, dtype=np.float32) for s in segments])
+                        if segments else np.zeros(0, dtype=np.float32))
+        self.avgdl = float(self.doc_len[self.live].mean()) if self.n_docs else 1.0
+        # 链接图在发布前由 attach_graph 建立，或随 load 一起加载
+        self.graph = None
+
+    @property
+    def graph_name(self):
+        return "graph-" + self.name.split("-", 1)[1]
+
+    @classmethod
+    def load(cls, index_dir, name):
+        with open(os.path.join(index_dir, name), "r", encoding="utf-8") as f:
+            gen = json.load(f)
+        if gen.get("version") != INDEX_VERSION:
+            raise ValueError(f"索引版本 {gen.get('version')} 与当前版本 {INDEX_VERSION} 不一致")
+        segments = [Segment(os.path.join(index_dir, s)) for s in gen["segments"]]
+        view = cls(name, segments, gen["deleted"], gen["manifest"])
+        try:
+            view.graph = LinkGraph.load(os.path.join(index_dir, view.graph_name))
+        except FileNotFoundError:
+            pass  # 写完这一代之前进程退出，由调用方重建
+        return view
+
+    def attach_graph(self, index_dir):
+        """由清单中所有笔记的链接和标签建立链接图，保存到 graph-*/"""
+        self.graph = LinkGraph.build({path: self.note(path) for path in self.manifest})
+        self.graph.save(os.path.join(index_dir, self.graph_name))
+
+    def write(self, index_dir):
+        gen = {"version": INDEX_VERSION, "segments": [s.name for s in self.segments],
+               "deleted": self.deleted, "manifest": self.manifest, "created": time.time()}
+        with open(os.path.join(index_dir, self.name), "w", encoding="utf-8") as f:
+            json.dump(gen, f, ensure_ascii=False)
+
+    def live_masks(self):
+        return [self.live[b:b + s.n_docs] for b, s in zip(self.bases, self.segments)]
+
+    def deleted_ratio(self):
+        return 1 - self.n_docs / self.n_total if self.n_total else 0.0
+
+    def doc(self, i):
+        """全局文档编号 -> {'path', 'title'}"""
+        seg = int(np.searchsorted(self.bases, i, side="right")) - 1
+        return self.segments[seg].docs[i - self.bases[seg]]
+
+    def note(self, path):
+        """相对路径 -> 索引中的 {'path', 'title', 'links', 'tags', 'headings', 'passages'}，不存在时返回 None"""
+        entry = self.manifest.get(path)
+        if entry is None:
+            return None
+        return self.segment_by_name[entry[3]].docs[entry[4]]
+
+    def _postings(self, h):
+        """词项 h 在各段中的 [(全局文档编号, 词频)] 和未删除文档中的文档频率"""
+        found = []
+        df = 0
+        for base, segment in zip(self.bases, self.segments):
+            hit = segment.postings(h)
+            if hit is None:
+                continue
+            doc_ids = base + hit[0].astype(np.int64)
+            # 文档频率只计未删除的文档，分数与全部重建后一致
+            df += int(np.count_nonzero(self.live[doc_ids]))
+            found.append((doc_ids, hit[1]))
+        return found, df
+
+    def idf(self, df):
+        return float(np.log1p((self.n_docs - df + 0.5) / (df + 0.5)))
+
+    def score(self, query_hashes):
+        """BM25 分数数组 (长度为包括已删除文档在内的总文档数)；query_hashes 为 {词项哈希: 查询中的次数}"""
+        scores = np.zeros(self.n_total, dtype=np.float32)
+        if self.n_docs == 0:
+            return scores
+        for h, qtf in query_hashes.items():
+            found, df = self._postings(h)
+            if df == 0:
+                continue
+            idf = self.idf(df)
+            for doc_ids, tfs in found:
+                tf = tfs.astype(np.float32)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[doc_ids] / self.avgdl)
+                # 同一词项的倒排表里文档编号不重复，可以直接按下标累加
+                scores[doc_ids] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        scores[~self.live] = 0
+        return scores
+
+    def query_idf(self, query_hashes):
+        """{词项哈希: idf}，只含索引中出现过的词项 (段落打分用)"""
+        idf = {}
+        for h in query_hashes:
+            df = self._postings(h)[1]
+            if df:
+                idf[h] = self.idf(df)
+        return idf
+
+
+def query_hashes(query):
+    return {term_hash(t): n for t, n in Counter(tokenize(query)).items()}
+
+
+def top_k(scores, k):
+    """分数最高的 k 个文档编号 (分数为 0 的不返回)"""
+    k = min(k, int(np.count_nonzero(scores)))
+    if k <= 0:
+        return []
+    idx = np.argpartition(scores, -k)[-k:]
+    return idx[np.argsort(scores[idx])[::-1]].tolist()
+
+
+def note_passages(body):
+    """段落切分结果：{'headings': [标题路径], 'passages': [[起, 止, 标题下标]]}，存进 docs.json"""
+    headings, passages = [], []
+    for start, end, heading in split_passages(body):
+        if heading not in headings:
+            headings.append(heading)
+        passages.append([start, end, headings.index(heading)])
+    return {"headings": headings, "passages": passages}
+
+
+# 词项 -> 哈希的缓存，每个进程 (包括 vault_crawler 的子进程) 各有一份
+_term_hash_cache = {}
+
+
+def _index_batch(vault_path, batch):
+    """读取并解析一批笔记 [(相对路径, (mtime_ns, 大小))]，在 vault_crawler 的子进程 (或当前进程) 中运行
+
+    返回 ([(doc, 词项哈希数组, 词频数组, 文档长度, 清单项 [mtime_ns, 大小, 内容哈希])], 读取的字节数)。
+    """
+    results, n_bytes = [], 0
+    for rel, (mtime, size) in batch:
+        path = os.path.join(vault_path, rel)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            print(f"⚠️ 无法读取笔记 {rel}: {e}")
+            continue
+        n_bytes += len(data)
+        title, frontmatter, body = split_note(path, data)
+        hashes, tfs, length = note_terms(title, body, _term_hash_cache)
+        links, tags = parse_links(frontmatter, body)
+        doc = dict(path=rel, title=title, links=links, tags=tags, **note_passages(body))
+        results.append((doc, hashes, tfs, length, [mtime, size, content_hash(data)]))
+    return results, n_bytes
+
+
+def index_notes(vault_path, notes, workers=None, stats=None):
+    """读取并分词 notes ({相对路径: (mtime_ns, 大小)})，同时切分段落、取出链接和标签
+
+    笔记多时由 vault_crawler.crawl 分批交给进程池，结果边到达边收集，原文不会在内存中堆积。
+    返回 (docs, per_doc, doc_len, 清单项 [mtime_ns, 大小, 内容哈希])，读取失败的笔记跳过。
+    """
+    docs, per_doc, doc_len, entries = [], [], [], []
+    for doc, hashes, tfs, length, entry in crawl(_index_batch, vault_path, list(notes.items()), workers, stats=stats):
+        docs.append(doc)
+        per_doc.append((hashes, tfs))
+        doc_len.append(length)
+        entries.append(entry)
+    return docs, per_doc, doc_len, entries
+
+
+class ObsidianLoader:
+    """Obsidian 知识库的检索入口
+
+    search_documents(query) 返回 [{'title', 'content', 'path', 'score'}]，按相关度降序。
+    启动时加载上次的索引并增量更新；watch=True 时再启动 VaultWatcher，笔记变化后在后台更新。
+    embedder (dense_index.LlamaEmbedder) 不为 None 时同时做向量检索。
+    """
+
+    def __init__(self, vault_path, index_dir=None, rebuild=False, watch=False, embedder=None, workers=None):
+        self.vault_path = vault_path
+        self.index_dir = index_dir or os.path.join(vault_path, INDEX_DIRNAME)
+        self.view = None
+        self.watcher = None
+        self.dense = None
+        # 解析笔记的进程数，None 为 CPU 核数
+        self.workers = workers
+        self.result_cache = LRUCache(QUERY_CACHE_SIZE)
+        # 只用来串行化更新；查询只读取 self.view 的引用，不加锁
+        self._update_lock = threading.Lock()
+        if not os.path.isdir(vault_path):
+            print(f"⚠️ 知识库目录不存在: {vault_path}，检索将返回空结果")
+            return
+        if embedder is not None:
+            from dense_index import DenseIndex
+
+            self.dense = DenseIndex(os.path.join(self.index_dir, "dense"), embedder)
+        if not rebuild:
+            self.view = self._load_current()
+        if self.view is None:
+            self.rebuild()
+        else:
+            self.update()
+        if watch:
+            self.watcher = VaultWatcher(self)
+            self.watcher.start()
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def _current_name(self):
+        try:
+            with open(os.path.join(self.index_dir, "CURRENT"), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load_current(self):
+        # 另一个进程可能刚发布了新的一代并删除了旧段，这时重读一次 CURRENT
+        for attempt in range(2):
+            name = self._current_name()
+            if name is None:
+                return None
+            try:
+                start = time.perf_counter()
+                view = IndexView.load(self.index_dir, name)
+            except FileNotFoundError:
+                if attempt == 0:
+                    continue
+                print("⚠️ 索引文件缺失，将重建")
+                return None
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ 索引无法加载，将重建: {e}")
+                return None
+            if view.graph is None:
+                view.attach_graph(self.index_dir)
+            print(f"📚 已加载知识库索引：{view.n_docs} 篇笔记，{len(view.segments)} 个段，"
+                  f"{view.graph.n_edges} 条链接 ({(time.perf_counter() - start) * 1000:.1f} ms)")
+            return view
+        return None
+
+    def _publish(self, view):
+        """写出新的一代 (连同链接图)，原子地把 CURRENT 指向它并替换 self.view，然后删除不再引用的旧文件"""
+        view.attach_graph(self.index_dir)
+        view.write(self.index_dir)
+        tmp = os.path.join(self.index_dir, f"CURRENT.tmp{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(view.name)
+        os.replace(tmp, os.path.join(self.index_dir, "CURRENT"))
+        self.view = view
+        # 缓存键里有索引代，旧结果不会再命中，这里只是释放内存
+        self.result_cache.clear()
+        self._collect_garbage(view)
+
+    def _collect_garbage(self, view):
+        # 仍在使用旧索引的查询持有内存映射：Linux 上删除不影响它们，Windows 上删除会失败，留到下次再删
+        keep = {view.name, view.graph_name} | {s.name for s in view.segments}
+        for name in os.listdir(self.index_dir):
+            if name in keep or not name.startswith(("gen-", "seg-", "graph-", "snapshot-")):
+                continue
+            path = os.path.join(self.index_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _new_name(prefix):
+        return f"{prefix}-{time.time_ns()}"
+
+    def _write_segment(self, docs, per_doc, doc_len):
+        name = self._new_name("seg")
+        Segment.write(os.path.join(self.index_dir, name), docs, per_doc, doc_len)
+        return Segment(os.path.join(self.index_dir, name))
+
+    def rebuild(self):
+        """重新扫描整个 vault，建立只有一个段的索引"""
+        with self._update_lock:
+            start = time.perf_counter()
+            os.makedirs(self.index_dir, exist_ok=True)
+            notes = dict(sorted(scan_vault(self.vault_path).items()))
+            stats = CrawlStats()
+            docs, per_doc, doc_len, entries = index_notes(self.vault_path, notes, self.workers, stats)
+            segment = self._write_segment(docs, per_doc, doc_len)
+            manifest = {doc["path"]: entry + [segment.name, i] for i, (doc, entry) in enumerate(zip(docs, entries))}
+            self._publish(IndexView(self._new_name("gen"), [segment], {}, manifest))
+            print(f"📚 知识库索引已重建：{len(docs)} 篇笔记，用时 {time.perf_counter() - start:.1f}s (读取和解析：{stats})")
+            self._sync_dense()
+
+    def _sync_dense(self):
+        """让向量索引跟上当前清单 (调用方持有 _update_lock)"""
+        if self.dense is not None:
+            snapshot = self.dense.snapshot
+            self.dense.update(self.vault_path, self.view.manifest, read_note)
+            if self.dense.snapshot is not snapshot:
+                self.result_cache.clear()
+
+    def diff(self, view):
+        """对比 vault 和 view 的清单
+
+        返回 (新增或修改的笔记 {路径: (mtime_ns, 大小)}, 删除的路径列表, 内容没变的清单项 {路径: 新清单项})。
+        mtime 和大小都没变的笔记不读取；大小没变但 mtime 变了的读取内容比较哈希，
+        内容相同 (例如只是被 touch 或同步工具重写) 的不重新索引。
+        """
+        manifest = view.manifest
+        current = scan_vault(self.vault_path)
+        changed, touched = {}, {}
+        for rel, (mtime, size) in current.items():
+            entry = manifest.get(rel)
+            if entry is not None and entry[0] == mtime and entry[1] == size:
+                continue
+            if entry is not None and entry[1] == size:
+                try:
+                    with open(os.path.join(self.vault_path, rel), "rb") as f:
+                        same = content_hash(f.read()) == entry[2]
+                except OSError:
+                    continue
+                if same:
+                    touched[rel] = [mtime] + entry[1:]
+                    continue
+            changed[rel] = (mtime, size)
+        deleted = [rel for rel in manifest if rel not in current]
+        return changed, deleted, touched
+
+    def update(self):
+        """增量更新索引，只重新分词新增和修改的笔记；返回是否有变化"""
+        with self._update_lock:
+            if self.view is None:
+                return False
+            changed = self._update_lexical()
+            # 向量索引第一次启用时，即使笔记没有变化也要补建
+            self._sync_dense()
+            return changed
+
+    def _update_lexical(self):
+        """更新倒排索引 (调用方持有 _update_lock)，返回是否有变化"""
+        view = self.view
+        start = time.perf_counter()
+        changed, deleted, touched = self.diff(view)
+        if not (changed or deleted or touched):
+            return False
+
+        manifest = dict(view.manifest)
+        manifest.update(touched)
+        dead = {name: list(ids) for name, ids in view.deleted.items()}
+        for rel in list(changed) + deleted:
+            entry = manifest.pop(rel, None)
+            if entry is not None:
+                dead.setdefault(entry[3], []).append(entry[4])
+        segments = list(view.segments)
+        docs, per_doc, doc_len, entries = index_notes(self.vault_path, changed, self.workers)
+        if docs:
+            segment = self._write_segment(docs, per_doc, doc_len)
+            segments.append(segment)
+            for i, (doc, entry) in enumerate(zip(docs, entries)):
+                manifest[doc["path"]] = entry + [segment.name, i]
+        new_view = IndexView(self._new_name("gen"), segments, dead, manifest)
+        if len(segments) > MAX_SEGMENTS or new_view.deleted_ratio() > MAX_DELETED_RATIO:
+            new_view = self._compact(new_view)
+        self._publish(new_view)
+        if changed or deleted:
+            print(f"📚 知识库索引已更新：{len(docs)} 篇新增/修改，{len(deleted)} 篇删除，"
+                  f"{len(new_view.segments)} 个段，用时 {(time.perf_counter() - start) * 1000:.0f} ms")
+        return True
+
+    def _compact(self, view):
+        """合并所有段并清除墓碑"""
+        name = self._new_name("seg")
+        remaps = merge_segments(os.path.join(self.index_dir, name), view.segments, view.live_masks())
+        remap_by_segment = {s.name: r for s, r in zip(view.segments, remaps)}
+        manifest = {rel: entry[:3] + [name, int(remap_by_segment[entry[3]][entry[4]])]
+                    for rel, entry in view.manifest.items()}
+        return IndexView(view.name, [Segment(os.path.join(self.index_dir, name))], {}, manifest)
+
+    def _rank(self, view, query, top_k_docs):
+        """返回 (笔记排序 [(索引中的文档, 分数)], 向量检索命中的片段 [(笔记, 起, 止, 相似度)])
+
+        有向量索引时，两路各取 top_k_docs * FUSION_DEPTH 篇，按倒数排名融合；同一篇笔记的多个片段只按最靠前的一个计。
+        """
+        depth = top_k_docs * FUSION_DEPTH if self.dense is not None else top_k_docs
+        scores = view.score(query_hashes(query))
+        lexical = [(view.doc(i), float(scores[i])) for i in top_k(scores, depth)]
+        if self.dense is None:
+            return lexical, []
+        try:
+            chunks = self.dense.search(query, depth * 2)
+        except Exception as e:
+            print(f"⚠️ 向量检索失败，只使用关键词检索: {str(e)}")
+            return lexical[:top_k_docs], []
+
+        fused, docs = {}, {}
+        for rank, (doc, _) in enumerate(lexical, 1):
+            fused[doc["path"]] = 1 / (RRF_K + rank)
+            docs[doc["path"]] = doc
+        dense_paths = list(dict.fromkeys(note["path"] for note, _, _, _ in chunks))
+        for rank, path in enumerate(dense_paths, 1):
+            doc = docs.get(path) or view.note(path)
+            if doc is None:
+                continue  # 向量索引里还有、倒排索引中已删除的笔记
+            docs[path] = doc
+            fused[path] = fused.get(path, 0.0) + 1 / (RRF_K + rank)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:top_k_docs]
+        return [(docs[path], fused[path]) for path in ranked], chunks
+
+    @staticmethod
+    def _expand(view, notes, expand):
+        """在 notes 之后追加最多 expand 篇与它们相链接的笔记，分数 = 命中分数 × 链接权重 × 衰减"""
+        if not expand or view.graph is None or not notes:
+            return notes
+        neighbors = view.graph.expand([(doc["path"], score) for doc, score in notes], expand)
+        extra = [(view.note(path), score) for path, score in neighbors]
+        return notes + [(doc, score) for doc, score in extra if doc is not None]
+
+    def search(self, query, top_k_docs=5, expand=0):
+        """返回 [(索引中的文档 {'path', 'title', ...}, 分数)]；有向量索引时分数为倒数排名融合分数
+
+        expand > 0 时在结果后面再追加最多 expand 篇与命中笔记直接相链接 (或有共同标签) 的笔记。
+        """
+        view = self.view  # 只读取一次，后台更新替换 self.view 不影响本次查询
+        if view is None:
+            return []
+        return self._expand(view, self._rank(view, query, top_k_docs)[0], expand)
+
+    def _cached(self, view, kind, query, params, compute):
+        """按 (类型, 规范化查询, 参数, 索引代) 缓存 compute(规范化查询) 的结果 (字典列表)，返回各项的浅拷贝
+
+        检索用的是规范化后的查询，同一个键的结果与原始查询的写法无关。
+        """
+        query = normalize_query(query) or query
+        dense = self.dense.snapshot if self.dense is not None else None
+        key = (kind, query, params, view.name, dense.path if dense is not None else None)
+        results = self.result_cache.get(key)
+        if results is None:
+            results = compute(query)
+            self.result_cache.put(key, results)
+        return [dict(r) for r in results]
+
+    def cache_stats(self):
+        """检索结果缓存和查询向量缓存的命中统计"""
+        stats = {"results": self.result_cache.stats()}
+        if self.dense is not None:
+            stats["embeddings"] = self.dense.embedding_cache.stats()
+        return stats
+
+    def search_passages(self, query, top_k_docs=5, expand=0):
+        """在最相关的 top_k_docs 篇笔记 (以及 expand 篇相链接的笔记) 中给段落打分，返回按分数降序的段落
+
+        每项为 {'title', 'path', 'heading', 'start', 'end', 'text', 'body', 'score'}，可直接交给 passages.pack_context。
+        段落分数融合三个排名：段落内的 BM25 (idf 取自整个索引)、向量检索的片段排名和所在笔记的排名。
+        """
+        view = self.view
+        if view is None:
+            return []
+        return self._cached(view, "passages", query, (top_k_docs, expand),
+                            lambda q: self._search_passages(view, q, top_k_docs, expand))
+
+    def _search_passages(self, view, query, top_k_docs, expand):
+        notes, chunks = self._rank(view, query, top_k_docs)
+        notes = self._expand(view, notes, expand)
+        q_hashes = query_hashes(query)
+        idf = view.query_idf(q_hashes)
+        candidates = []
+        for note_rank, (doc, _) in enumerate(notes, 1):
+            try:
+                title, body = read_note(os.path.join(self.vault_path, doc["path"]))
+            except OSError:
+                continue
+            for start, end, heading_idx in doc["passages"]:
+                if start >= len(body):
+                    break  # 笔记刚被修改，索引还没更新
+                heading = doc["headings"][heading_idx]
+                text = body[start:end]
+                counts = Counter(term_hash(t) for t in tokenize(f"{heading} {text}"))
+                candidates.append({"title": title, "path": doc["path"], "heading": heading, "start": start,
+                                   "end": min(end, len(body)), "text": text, "body": body,
+                                   "note_rank": note_rank, "counts": counts,
+                                   "length": sum(counts.values()) or 1})
+        if not candidates:
+            return []
+
+        avg_len = sum(c["length"] for c in candidates) / len(candidates)
+        for c in candidates:
+            score = 0.0
+            for h, qtf in q_hashes.items():
+                tf = c["counts"].get(h, 0)
+                if tf and h in idf:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * c["length"] / avg_len)
+                    score += qtf * idf[h] * tf * (BM25_K1 + 1) / (tf + norm)
+            c["lexical"] = score
+        dense_rank = {}
+        for rank, (note, start, _, _) in enumerate(chunks, 1):
+            dense_rank.setdefault((note["path"], start), rank)
+        by_lexical = sorted(candidates, key=lambda c: c["lexical"], reverse=True)
+        for rank, c in enumerate(by_lexical, 1):
+            c["score"] = 1 / (RRF_K + c["note_rank"])
+            if c["lexical"] > 0:
+                c["score"] += 1 / (RRF_K + rank)
+            if (c["path"], c["start"]) in dense_rank:
+                c["score"] += 1 / (RRF_K + dense_rank[(c["path"], c["start"])])
+        candidates.sort(key=lambda c: c["score"], reverse=True)
+        for c in candidates:
+            for key in ("note_rank", "counts", "length", "lexical"):
+                del c[key]
+        return candidates
+
+    def search_documents(self, query, top_k_docs=5, expand=0):
+        """检索与 query 相关的笔记，返回 [{'title', 'content', 'path', 'score'}]"""
+        view = self.view
+        if view is None:
+            return []
+        return self._cached(view, "documents", query, (top_k_docs, expand),
+                            lambda q: self._search_documents(view, q, top_k_docs, expand))
+
+    def _search_documents(self, view, query, top_k_docs, expand):
+        results = []
+        for doc, score in self._expand(view, self._rank(view, query, top_k_docs)[0], expand):
+            try:
+                _, content = read_note(os.path.join(self.vault_path, doc["path"]))
+            except OSError:
+                continue  # 笔记已被删除，索引还没来得及更新
+            results.append({"title": doc["title"], "content": content, "path": doc["path"], "score": score})
+        return results
+
+
+# inotify 事件 (linux/inotify.h)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len，后接 name
+
+
+class _Inotify:
+    """通过 ctypes 调用 Linux inotify，递归监听 vault 的所有目录 (不依赖第三方库)"""
+
+    def __init__(self, root):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.watches = {}
+        try:
+            self.add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, root):
+        for dirpath, dirs, _ in os.walk(root):
+            dirs[:] = [d for d in dirs if not _skip_dir(d)]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dirpath), _WATCH_MASK)
+            if wd < 0:
+                # 通常是超过了 fs.inotify.max_user_watches
+                raise OSError(ctypes.get_errno(), f"无法监听目录 {dirpath}")
+            self.watches[wd] = dirpath
+
+    def read(self, timeout):
+        """等待最多 timeout 秒，返回是否有与笔记有关的事件"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        relevant = False
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            start = offset + _EVENT.size
+            name = data[start:start + length].rstrip(b"\0").decode("utf-8", errors="replace")
+            offset = start + length
+            if mask & IN_Q_OVERFLOW:
+                relevant = True  # 事件队列溢出，不知道丢了什么，按有变化处理
+            elif mask & IN_ISDIR:
+                if _skip_dir(name):
+                    continue
+                relevant = True
+                if mask & (IN_CREATE | IN_MOVED_TO) and wd in self.watches:
+                    self.add_tree(os.path.join(self.watches[wd], name))
+            elif name.endswith(".md") or mask & IN_DELETE_SELF:
+                relevant = True
+        return relevant
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class VaultWatcher(threading.Thread):
+    """后台线程：笔记变化后调用 loader.update()
+
+    Linux 上用 inotify 等待事件；inotify 不可用 (其他平台、监听数超过上限) 时每 interval 秒轮询一次，
+    没有变化时 update() 只 stat 一遍笔记，开销很小。
+    """
+
+    def __init__(self, loader, interval=POLL_INTERVAL, debounce=WATCH_DEBOUNCE):
+        super().__init__(name="vault-watcher", daemon=True)
+        self.loader = loader
+        self.interval = interval
+        self.debounce = debounce
+        self.mode = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=2)
+
+    def _update(self):
+        try:
+            self.loader.update()
+        except Exception as e:
+            # 更新失败时继续使用旧索引
+            print(f"⚠️ 知识库索引更新失败: {str(e)}")
+
+    def run(self):
+        inotify = None
+        if sys.platform.startswith("linux"):
+            try:
+                inotify = _Inotify(self.loader.vault_path)
+            except (OSError, AttributeError) as e:
+                print(f"⚠️ inotify 不可用，改为每 {self.interval:g}s 轮询: {e}")
+        if inotify is None:
+            self.mode = "poll"
+            while not self._stop_event.wait(self.interval):
+                self._update()
+            return
+
+        self.mode = "inotify"
+        try:
+            while not self._stop_event.is_set():
+                if not inotify.read(1.0):
+                    continue
+                # 去抖：等事件停下来再更新
+                while not self._stop_event.is_set() and inotify.read(self.debounce):
+                    pass
+                self._update()
+        finally:
+            inotify.close()
+
+
+def _make_synthetic_vault(path, n_notes, seed=0):
+    """生成测试用的 vault (随机中文段落 + 少量英文术语 + 一个指向随机笔记的链接)"""
+    rng = np.random.default_rng(seed)
+    chars = [chr(c) for c in range(0x4E00, 0x4E00 + 2000)]
+    words = ["llama", "gguf", "lora", "obsidian", "python", "cuda", "zelda", "switch"]
+    os.makedirs(path, exist_ok=True)
+    for i in range(n_notes):
+        folder = os.path.join(path, f"folder{i % 20}")
+        os.makedirs(folder, exist_ok=True)
+        paragraphs = []
+        for _ in range(int(rng.integers(3, 12))):
+            text = "".join(rng.choice(chars, size=int(rng.integers(40, 200))))
+            paragraphs.append(f"{text} {rng.choice(words)}。")
+        paragraphs.append(f"相关：[[笔记{int(rng.integers(n_notes))}]]")
+        with open(os.path.join(folder, f"笔记{i}.md"), "w", encoding="utf-8") as f:
+            f.write("---\ntags: [test]\n---\n" + "\n\n".join(paragraphs))
+
+
+def _modify_notes(loader, n, seed=1):
+    """随机修改 n 篇笔记并计时增量更新"""
+    rng = np.random.default_rng(seed)
+    notes = list_notes(loader.vault_path)
+    for i in rng.choice(len(notes), size=min(n, len(notes)), replace=False).tolist():
+        with open(os.path.join(loader.vault_path, notes[i]), "a", encoding="utf-8") as f:
+            f.write(f"\n\n增量更新测试 {time.time_ns()} zelda。")
+    start = time.perf_counter()
+    loader.update()
+    print(f"修改 {n} 篇笔记后增量更新耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Obsidian 知识库索引：建立 / 加载 / 增量更新 / 查询")
+    parser.add_argument("vault", help="vault 路径")
+    parser.add_argument("--rebuild", action="store_true", help="强制重建索引")
+    parser.add_argument("--query", action="append", default=[], help="查询 (可重复)")
+    parser.add_argument("--synthetic", type=int, default=0, help="先在 vault 路径生成这么多篇测试笔记")
+    parser.add_argument("--modify", type=int, default=0, help="随机修改这么多篇笔记，测试增量更新")
+    parser.add_argument("--workers", type=int, help="解析笔记的进程数 (默认 CPU 核数)")
+    parser.add_argument("--expand", type=int, default=0, help="每个查询再补充这么多篇相链接的笔记")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        _make_synthetic_vault(args.vault, args.synthetic)
+    start = time.perf_counter()
+    loader = ObsidianLoader(args.vault, rebuild=args.rebuild, workers=args.workers)
+    print(f"初始化耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    if args.modify:
+        _modify_notes(loader, args.modify)
+    view = loader.view
+    if view is not None:
+        n_postings = sum(s.meta["n_postings"] for s in view.segments)
+        print(f"  {view.n_docs} 篇笔记，{len(view.segments)} 个段，{n_postings} 条倒排记录，{view.graph.n_edges} 条链接")
+
+    queries = args.query or ["塞尔达传说的玩法", "如何用 llama 加载 gguf 模型", "LoRA 微调"]
+    for query in queries:
+        start = time.perf_counter()
+        results = loader.search_documents(query, expand=args.expand)
+        elapsed = (time.perf_counter() - start) * 1000
+        titles = "、".join(r["title"] for r in results[:3]) or "无结果"
+        print(f"  [{elapsed:6.2f} ms] {query} -> {titles}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+序列打包 (Sequence Packing)
+
+原来的训练脚本用 padding="max_length" 把每条样本补齐到 512/2048，
+而我们的对话样本平均不到 200 个 token，大部分算力和显存都花在 pad 上。
+这里把分词后的样本拼接成定长的块：
+  - 每条样本的 position_ids 从 0 重新开始，样本之间的边界由它标出；
+  - labels 在每条样本的第一个 token 处为 -100，不让模型从上一条样本预测下一条；
+  - 默认生成块对角 4D 注意力掩码，让每条样本只能看到自己 (eager/sdpa 注意力下也能严格隔离)；
+    packing_mask="position_ids" 只在 flash_attention_2 下有效 (transformers 根据重置的 position_ids 隔离样本)，
+    其他注意力实现会让样本互相可见，check_attention 会直接报错。
+"""
+import bisect
+
+import torch
+import yaml
+
+IGNORE_INDEX = -100
+
+# YAML 中的可选配置项及默认值
+PACKING_DEFAULTS = {
+    "packing": False,
+    # block_diagonal: 生成块对角注意力掩码；position_ids: 只重置位置编号 (必须用 flash_attention_2)
+    "packing_mask": "block_diagonal",
+}
+
+
+def load_packing_config(config_path):
+    """从 YAML 配置读取打包相关的选项，文件或选项不存在时使用默认值"""
+    config = dict(PACKING_DEFAULTS)
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            loaded = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return config
+    for key in PACKING_DEFAULTS:
+        if key in loaded:
+            config[key] = loaded[key]
+    if config["packing_mask"] not in ("position_ids", "block_diagonal"):
+        raise ValueError(f"未知的 packing_mask: {config['packing_mask']}")
+    return config
+
+
+def check_attention(model, packing):
+    """packing_mask="position_ids" 要求模型使用 flash_attention_2，否则样本之间的注意力不隔离"""
+    if not packing["packing"] or packing["packing_mask"] != "position_ids":
+        return
+    attn = getattr(model.config, "_attn_implementation", None)
+    if attn != "flash_attention_2":
+        raise ValueError(f"packing_mask: position_ids 需要 attn_implementation=\"flash_attention_2\"，"
+                         f"当前为 {attn}，打包的样本会互相看到；请改用 packing_mask: block_diagonal")
+
+
+def pack_examples(sequences, block_size):
+    """把若干 token 序列装进长度不超过 block_size 的块 (best-fit decreasing)
+
+    返回每个块包含的样本下标列表。超过 block_size 的样本会被截断后单独成块。
+    """
+    order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]), reverse=True)
+    blocks = []
+    # 按剩余空间排序的 (剩余空间, 块编号)，用二分查找最合适的块
+    free = []
+    for i in order:
+        length = min(len(sequences[i]), block_size)
+        pos = bisect.bisect_left(free, (length, -1))
+        if pos < len(free):
+            remaining, b = free.pop(pos)
+        else:
+            remaining, b = block_size, len(blocks)
+            blocks.append([])
+        blocks[b].append(i)
+        remaining -= length
+        if remaining > 0:
+            bisect.insort(free, (remaining, b))
+    return blocks
+
+
+def pack_dataset(tokenized_dataset, block_size):
+    """把分词后 (未 padding) 的数据集打包成定长块
+
+    返回新的 datasets.Dataset，包含 input_ids / labels / position_ids 三列。
+    """
+    from datasets import Dataset
+
+    sequences = tokenized_dataset["input_ids"]
+    if "labels" in tokenized_dataset.column_names:
+        labels_list = tokenized_dataset["labels"]
+    else:
+        labels_list = sequences
+
+    packed = {"input_ids": [], "labels": [], "position_ids": []}
+    for block in pack_examples(sequences, block_size):
+        input_ids, labels, position_ids = [], [], []
+        for i in block:
+            ids = list(sequences[i][:block_size])
+            lab = list(labels_list[i][:block_size])
+            # 每条样本的第一个 token 不能由上一条样本的最后一个 token 预测
+            lab[0] = IGNORE_INDEX
+            input_ids.extend(ids)
+            labels.extend(lab)
+            position_ids.extend(range(len(ids)))
+        packed["input_ids"].append(input_ids)
+        packed["labels"].append(labels)
+        packed["position_ids"].append(position_ids)
+    return Dataset.from_dict(packed)
+
+
+def padding_report(lengths, max_length, packed_lengths, block_size):
+    """打印打包前后的 padding 比例"""
+    real_tokens = sum(min(n, max_length) for n in lengths)
+    before = 1 - real_tokens / max(1, len(lengths) * max_length)
+    after = 1 - sum(packed_lengths) / max(1, len(packed_lengths) * block_size)
+    print(f"📦 序列打包: {len(lengths)} 条样本 -> {len(packed_lengths)} 个长度 {block_size} 的块")
+    print(f"   padding 比例: 打包前 {before:.1%} -> 打包后 {after:.1%}")
+    return before, after
+
+
+class PackedDataCollator:
+    """打包数据的 collator：补齐到本批次最长的块，并生成注意力掩码
+
+    mask_mode="position_ids" 时输出普通的 2D attention_mask (只遮住 padding)；
+    mask_mode="block_diagonal" 时输出 (batch, 1, L, L) 的 4D 掩码 (已取反：0 为可见，最小值为屏蔽)。
+    """
+
+    def __init__(self, pad_token_id, mask_mode="position_ids", mask_dtype=torch.float16):
+        # padding 既被 labels 忽略也被掩码遮住，没有 pad token 的分词器用 0 即可
+        self.pad_token_id = pad_token_id if pad_token_id is not None else 0
+        self.mask_mode = mask_mode
+        self.mask_dtype = mask_dtype
+
+    def __call__(self, features):
+        max_len = max(len(f["input_ids"]) for f in features)
+        batch_size = len(features)
+        input_ids = torch.full((batch_size, max_len), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, max_len), IGNORE_INDEX, dtype=torch.long)
+        # padding 部分的位置编号继续递增，避免被当作新样本的开头
+        position_ids = torch.arange(max_len, dtype=torch.long).repeat(batch_size, 1)
+        lengths = []
+        for row, f in enumerate(features):
+            n = len(f["input_ids"])
+            lengths.append(n)
+            input_ids[row, :n] = torch.tensor(f["input_ids"], dtype=torch.long)
+            labels[row, :n] = torch.tensor(f["labels"], dtype=torch.long)
+            position_ids[row, :n] = torch.tensor(f["position_ids"], dtype=torch.long)
+
+        batch = {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+        if self.mask_mode == "block_diagonal":
+            batch["attention_mask"] = self._block_diagonal_mask(position_ids, lengths, max_len)
+        else:
+            attention_mask = torch.zeros((batch_size, max_len), dtype=torch.long)
+            for row, n in enumerate(lengths):
+                attention_mask[row, :n] = 1
+            batch["attention_mask"] = attention_mask
+        return batch
+
+    def _block_diagonal_mask(self, position_ids, lengths, max_len):
+        # 位置编号为 0 的地方开始一条新样本，累加得到每个 token 所属的样本编号
+        segment = torch.cumsum((position_ids == 0).long(), dim=1)
+        for row, n in enumerate(lengths):
+            segment[row, n:] = 0  # padding 不属于任何样本
+        same_segment = (segment[:, :, None] == segment[:, None, :]) & (segment[:, :, None] > 0)
+        causal = torch.ones((max_len, max_len), dtype=torch.bool).tril()
+        allowed = same_segment & causal
+        # padding 行至少能看到自己，避免 softmax 全为 -inf 产生 NaN
+        allowed |= torch.eye(max_len, dtype=torch.bool)
+        mask = torch.zeros(allowed.shape, dtype=self.mask_dtype)
+        mask.masked_fill_(~allowed, torch.finfo(self.mask_dtype).min)
+        return mask[:, None, :, :]
+
+
+def build_packed_dataset(tokenized_dataset, block_size):
+    """打包并打印 padding 报告，tokenized_dataset 应该是没有 padding 的分词结果"""
+    lengths = [len(ids) for ids in tokenized_dataset["input_ids"]]
+    packed = pack_dataset(tokenized_dataset, block_size)
+    padding_report(lengths, block_size, [len(ids) for ids in packed["input_ids"]], block_size)
+    return packed
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Multi-threaded block quantizer for convert_hf_to_gguf.py
+#
+# gguf.quants.quantize() runs on the whole tensor in one thread. Q8_0, TQ1_0 and
+# TQ2_0 blocks are independent of each other, so large tensors are split into row
+# ranges that are quantized concurrently into one preallocated uint8 buffer. The
+# heavy NumPy operations release the GIL, so plain threads scale without copying
+# the tensor into worker processes.
+#
+# Small tensors, other types and tensors that can't be quantized (the caller's
+# F16 fallback relies on gguf.QuantError) go through gguf.quants.quantize()
+# unchanged, so the output is byte-identical either way.
+#
+#   python parallel_quants.py --rows 4096 --cols 4096 --threads 8
+
+from __future__ import annotations
+
+import argparse
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import gguf
+
+PARALLEL_QTYPES: dict[gguf.GGMLQuantizationType, type] = {
+    gguf.GGMLQuantizationType.Q8_0: gguf.quants.Q8_0,
+    gguf.GGMLQuantizationType.TQ1_0: gguf.quants.TQ1_0,
+    gguf.GGMLQuantizationType.TQ2_0: gguf.quants.TQ2_0,
+}
+
+# below this many input bytes the thread hand-off costs more than it saves
+PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+# input bytes quantized per task; small enough to keep every thread busy until the end
+CHUNK_BYTES = 4 * 1024 * 1024
+
+_pools: dict[int, ThreadPoolExecutor] = {}
+_pool_lock = threading.Lock()
+
+
+def default_threads() -> int:
+    return os.cpu_count() or 1
+
+
+def _get_pool(threads: int) -> ThreadPoolExecutor:
+    # one pool per process instead of one per tensor; conversions running side by side
+    # (convert_zoo_to_gguf.py) share it, so together they never use more than `threads`
+    with _pool_lock:
+        pool = _pools.get(threads)
+        if pool is None:
+            pool = _pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="quantize")
+        return pool
+
+
+def _quantize_parallel(data: np.ndarray, qtype: gguf.GGMLQuantizationType, threads: int) -> np.ndarray:
+    quant = PARALLEL_QTYPES[qtype]
+    rows = data.reshape(-1, data.shape[-1])
+    out = np.empty(gguf.quant_shape_to_byte_shape(data.shape, qtype), dtype=np.uint8)
+    out_rows = out.reshape(rows.shape[0], -1)
+
+    row_bytes = rows.shape[1] * rows.dtype.itemsize
+    step = max(1, CHUNK_BYTES // row_bytes)
+
+    def work(lo: int, hi: int):
+        out_rows[lo:hi] = quant.quantize_rows(rows[lo:hi])
+
+    pool = _get_pool(threads)
+    futures = [pool.submit(work, lo, min(lo + step, rows.shape[0])) for lo in range(0, rows.shape[0], step)]
+    for future in futures:
+        future.result()
+    return out
+
+
+def quantize(data: np.ndarray, qtype: gguf.GGMLQuantizationType, threads: int | None = None) -> np.ndarray:
+    """Drop-in replacement for gguf.quants.quantize() that uses threads for large tensors."""
+    threads = threads or default_threads()
+    quant = PARALLEL_QTYPES.get(qtype)
+    if quant is None or threads < 2 or data.nbytes < PARALLEL_MIN_BYTES or not quant.can_quantize(data):
+        return gguf.quants.quantize(data, qtype)
+    if isinstance(data, gguf.LazyNumpyTensor):
+        return gguf.LazyNumpyTensor._wrap_fn(
+            functools.partial(_quantize_parallel, qtype=qtype, threads=threads),
+            meta_noop=(np.uint8, functools.partial(gguf.quant_shape_to_byte_shape, quant_type=qtype)),
+        )(data)
+    return _quantize_parallel(data, qtype, threads)
+
+
+def benchmark(rows: int, cols: int, threads: int, repeat: int):
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((rows, cols), dtype=np.float32)
+    print(f"tensor {rows}x{cols} f32 ({data.nbytes / 1024 ** 2:.0f} MiB), {threads} threads")
+    print(f"{'type':<8}{'gguf.quants':>14}{'parallel':>12}{'speedup':>10}  identical")
+    for qtype in PARALLEL_QTYPES:
+        timings = []
+        for fn in (lambda: gguf.quants.quantize(data, qtype), lambda: quantize(data, qtype, threads=threads)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = fn()
+                best = min(best, time.perf_counter() - start)
+            timings.append((best, result))
+        (t_ref, ref), (t_par, par) = timings
+        print(f"{qtype.name:<8}{t_ref:>13.3f}s{t_par:>11.3f}s{t_ref / t_par:>9.2f}x  {np.array_equal(ref, par)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the threaded quantizer against gguf.quants.quantize")
+    parser.add_argument("--rows", type=int, default=4096)
+    parser.add_argument("--cols", type=int, default=4096)
+    parser.add_argument("--threads", type=int, default=default_threads())
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.rows, args.cols, args.threads, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+笔记的段落切分与按 token 预算拼接 RAG 上下文
+
+chat.py 原来取最相关的 2 篇笔记、各截前 300 个字符，inference_llama_cpp.search_knowledge_base 取前 3 篇各 500 个字符：
+相关内容常在笔记中间被截掉，提示里却花了不少 token 在不相关的开头上。这里：
+  - split_passages：建索引时按 Markdown 标题分节，节内按段落合并到 PASSAGE_CHARS 左右，
+    过长的段落按句末标点切开；相邻段落之间保留约 PASSAGE_OVERLAP 个字符 (整句) 的重叠；
+  - pack_context：按分数从高到低挑选段落，用模型自己的分词器计算 token 数，
+    恰好填满给定的预算 (最后一段放不下时按句子截断)；同一篇笔记的段落合并输出，重叠部分只出现一次。
+
+基准测试：python passages.py <vault> --query 问题 [--budget 600]
+"""
+import argparse
+import re
+import time
+
+import text_classify
+
+# 段落的目标长度 (字符)；中文大约一个字一个 token
+PASSAGE_CHARS = 400
+# 相邻段落的重叠 (字符)，按整句取
+PASSAGE_OVERLAP = 80
+# 剩余预算少于这么多 token 时不再截断段落去填充
+MIN_PARTIAL_TOKENS = 32
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+# 句子边界：中英文句末标点和换行之后
+_SENTENCE_END_RE = re.compile(r"[。！？；!?;…]+[”」』）)]*|\n")
+
+
+def _sections(body):
+    """按标题切分，返回 [(起, 止, 标题路径)]；标题行本身不计入正文"""
+    sections = []
+    stack = []  # [(级别, 标题)]
+    pos = 0
+    heading = ""
+    for match in _HEADING_RE.finditer(body):
+        if match.start() > pos:
+            sections.append((pos, match.start(), heading))
+        level = len(match.group(1))
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, match.group(2).strip()))
+        heading = " > ".join(title for _, title in stack)
+        pos = match.end()
+    if pos < len(body):
+        sections.append((pos, len(body), heading))
+    return sections
+
+
+def sentence_ends(text, start=0, end=None):
+    """text[start:end] 中每个句子的结束位置 (绝对位置)"""
+    end = len(text) if end is None else end
+    return [m.end() for m in _SENTENCE_END_RE.finditer(text, start, end)]
+
+
+def _units(body, start, end, max_chars):
+    """节内的段落，过长的段落按句子 (必要时按字符) 切到不超过 max_chars"""
+    units = []
+    pos = start
+    for match in list(_PARAGRAPH_RE.finditer(body, start, end)) + [None]:
+        p_start, p_end = pos, match.start() if match else end
+        pos = match.end() if match else end
+        # 去掉首尾空白
+        while p_start < p_end and body[p_start].isspace():
+            p_start += 1
+        while p_end > p_start and body[p_end - 1].isspace():
+            p_end -= 1
+        while p_end - p_start > max_chars:
+            cuts = [c for c in sentence_ends(body, p_start, p_start + max_chars) if c > p_start]
+            cut = cuts[-1] if cuts else p_start + max_chars
+            units.append((p_start, cut))
+            p_start = cut
+        if p_end > p_start:
+            units.append((p_start, p_end))
+    return units
+
+
+def _overlap_start(body, start, end, overlap):
+    """passage [start, end) 末尾不超过 overlap 个字符的整句的起点，没有时返回 end"""
+    for cut in sentence_ends(body, max(start, end - overlap), end):
+        if cut < end:
+            return cut
+    return end
+
+
+def split_passages(body, max_chars=PASSAGE_CHARS, overlap=PASSAGE_OVERLAP):
+    """把笔记正文切成段落，返回 [(起, 止, 标题路径)]
+
+    不跨越标题；同一节内相邻段落合并到不超过 max_chars，后一段以前一段末尾不超过 overlap 个字符的整句开头。
+    """
+    passages = []
+    for sec_start, sec_end, heading in _sections(body):
+        start = end = None
+        for u_start, u_end in _units(body, sec_start, sec_end, max_chars):
+            if start is not None and u_end - start > max_chars:
+                passages.append((start, end, heading))
+                # 重叠部分可以让段落超出 max_chars，最多 overlap 个字符
+                start = _overlap_start(body, start, end, overlap)
+                if u_end - start > max_chars + overlap:
+                    start = u_start
+            if start is None:
+                start = u_start
+            end = u_end
+        if start is not None:
+            passages.append((start, end, heading))
+    return passages
+
+
+def llama_token_counter(llm):
+    """用 llama.cpp 模型的分词器计数 (不含 BOS)"""
+    return lambda text: len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+
+def _merge_spans(spans):
+    """合并同一篇笔记中重叠或相接的段落 [(起, 止, 标题)]"""
+    merged = []
+    for start, end, heading in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]), merged[-1][2])
+        else:
+            merged.append((start, end, heading))
+    return merged
+
+
+def render_context(selected, bodies, separator="\n\n"):
+    """selected: 已选中的段落 (按选中顺序)；同一篇笔记的段落按原文顺序合并成一块"""
+    notes = {}
+    for p in selected:
+        notes.setdefault(p["path"], {"title": p["title"], "spans": []})["spans"].append(
+            (p["start"], p["end"], p["heading"]))
+    blocks = []
+    for path, note in notes.items():
+        body = bodies[path]
+        parts = []
+        last_heading = None
+        for start, end, heading in _merge_spans(note["spans"]):
+            text = body[start:end].strip()
+            if heading and heading != last_heading:
+                text = f"【{heading}】\n{text}"
+            last_heading = heading
+            parts.append(text)
+        blocks.append(f"文档：{note['title']}\n" + "\n……\n".join(parts))
+    return separator.join(blocks)
+
+
+def pack_context(passages, budget, count_tokens, separator="\n\n", min_partial=MIN_PARTIAL_TOKENS):
+    """按分数挑选段落，拼成不超过 budget 个 token 的上下文
+
+    passages: [{'title', 'path', 'heading', 'start', 'end', 'text', 'body', 'score'}]，按分数降序
+    (body 为整篇正文，用来合并同一笔记中重叠的段落)。
+    返回 (上下文, token 数, 选中的段落)。每次加入段落后都用 count_tokens 重新计数整个上下文，
+    因为分词在拼接处并不严格可加。
+    """
+    bodies = {p["path"]: p["body"] for p in passages}
+    selected = []
+    context, used = "", 0
+    overflow = None
+    for p in passages:
+        trial = render_context(selected + [p], bodies, separator)
+        n = count_tokens(trial)
+        if n <= budget:
+            selected.append(p)
+            context, used = trial, n
+        elif overflow is None:
+            overflow = p
+    if overflow is None or budget - used < min_partial:
+        return context, used, selected
+
+    # 剩余预算装不下完整的段落：按句子截断，二分查找能放下的最长前缀
+    start, end = overflow["start"], overflow["end"]
+    cuts = [c for c in sentence_ends(overflow["body"], start, end) if c < end] or \
+        list(range(start + 1, end))
+    lo, hi, best = 0, len(cuts) - 1, None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        partial = dict(overflow, end=cuts[mid])
+        trial = render_context(selected + [partial], bodies, separator)
+        n = count_tokens(trial)
+        if n <= budget:
+            best, lo = (partial, trial, n), mid + 1
+        else:
+            hi = mid - 1
+    if best is not None:
+        selected.append(best[0])
+        context, used = best[1], best[2]
+    return context, used, selected
+
+
+def _char_counter(text):
+    # 没有模型时的近似：一个汉字约一个 token，其余约 4 个字符一个 token
+    n_han = text_classify.count(text, text_classify.HAN)
+    return n_han + (len(text) - n_han + 3) // 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description="段落检索与上下文拼接演示")
+    parser.add_argument("vault", help="vault 路径")
+    parser.add_argument("--query", action="append", default=[], help="查询 (可重复)")
+    parser.add_argument("--budget", type=int, default=600, help="上下文 token 预算")
+    parser.add_argument("--model", help="用这个 gguf 模型的分词器计数 (默认按字符近似)")
+    args = parser.parse_args()
+    from obsidian_loader import ObsidianLoader
+
+    count_tokens = _char_counter
+    if args.model:
+        from llama_cpp import Llama
+
+        count_tokens = llama_token_counter(Llama(model_path=args.model, vocab_only=True, verbose=False))
+    loader = ObsidianLoader(args.vault)
+    for query in args.query or ["塞尔达传说的玩法"]:
+        start = time.perf_counter()
+        passages = loader.search_passages(query)
+        t_search = time.perf_counter() - start
+        context, used, selected = pack_context(passages, args.budget, count_tokens)
+        t_pack = time.perf_counter() - start - t_search
+        print(f"{query}: {len(passages)} 个候选段落，选中 {len(selected)} 个，{used}/{args.budget} token "
+              f"(检索 {t_search * 1000:.1f} ms，拼接 {t_pack * 1000:.1f} ms)")
+        print(context[:300] + ("..." if len(context) > 300 else ""))
+
+
+if __name__ == "__main__":
+    main()
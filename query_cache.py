@@ -0,0 +1,90 @@
+"""
+知识库检索结果和查询向量的 LRU 缓存
+
+chat.py 的用户经常反复问同一个问题 (或只差标点、空格、全半角的问题)，
+每次都要重新做 BM25 检索、读取笔记，有向量索引时还要用嵌入模型编码一次查询。
+  - normalize_query：NFKC 规范化、转小写、标点和表情换成空白、合并空白 (汉字之间的空白去掉)，
+    "塞尔达王国之泪有什么新玩法？" 和 "塞尔达 王国之泪有什么新玩法" 得到同一个键；
+    规范化会改变分词 ("塞尔达，王国" 和 "塞尔达王国" 的汉字二元组不同)，所以检索和编码都用规范化后的文本，
+    保证同一个键对应的结果相同；
+  - LRUCache：OrderedDict 实现的 LRU，带命中/未命中计数，多线程访问时加锁。
+ObsidianLoader 的检索结果缓存以 (规范化查询, 参数, 索引代) 为键，索引更新发布新的一代时整体清空；
+DenseIndex 的查询向量缓存以规范化查询为键，嵌入模型不变时一直有效。
+"""
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import text_classify
+from text_classify import EMOJI, PUNCT
+
+# 缓存的检索结果数 (每项是几篇笔记的正文或若干段落，几十 KB)
+QUERY_CACHE_SIZE = 128
+# 缓存的查询向量数 (每个几 KB)
+EMBEDDING_CACHE_SIZE = 512
+
+
+def normalize_query(query):
+    """规范化查询文本，只差标点、空白、大小写或全半角的查询得到相同的结果"""
+    text = unicodedata.normalize("NFKC", query).lower()
+    # 标点换成空白而不是删掉，"llama,gguf" 不会变成一个词 "llamagguf"
+    codes = text_classify.codepoints(text).copy()
+    codes[(text_classify.classify(text) & (PUNCT | EMOJI)) != 0] = ord(" ")
+    words = codes.tobytes().decode("utf-32-le").split()
+    if not words:
+        return ""
+    # 只在两个英文/数字单词之间保留一个空格 (去掉会改变分词)，汉字之间的空白不影响检索
+    out = [words[0]]
+    for word in words[1:]:
+        if out[-1][-1].isascii() and out[-1][-1].isalnum() and word[0].isascii() and word[0].isalnum():
+            out.append(" ")
+        out.append(word)
+    return "".join(out)
+
+
+class LRUCache:
+    """容量为 maxsize 的 LRU 缓存，hits / misses 统计命中情况"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"size": len(self._items), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate}
+
+    def summary(self):
+        return f"命中 {self.hits} 次，未命中 {self.misses} 次 (命中率 {self.hit_rate:.0%})，缓存 {len(self._items)} 项"
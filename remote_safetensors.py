@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Concurrent HTTP range reader for remote safetensors files (convert_hf_to_gguf.py --remote)
+#
+# gguf.utility.RemoteTensor.data() downloads one whole tensor per request, with a
+# fresh connection and no retry. RangeFetcher instead splits every read into fixed,
+# file-aligned chunks that are fetched in parallel over a pool of keep-alive
+# connections, retried with backoff, and optionally stored in an on-disk chunk
+# cache so an interrupted conversion resumes without downloading anything twice.
+# Chunks that a read used only partly (shared with the neighbouring tensor) stay in
+# a small in-memory LRU, and tensors smaller than a chunk whose chunks are not
+# already at hand are read with an exact range instead of pulling a whole chunk.
+#
+# The module also contains a small threaded HTTP server with Range support that
+# serves a local directory with the Hugging Face "resolve" URL layout, so the whole
+# remote path can be exercised offline:
+#
+#   python remote_safetensors.py serve path/to/model --port 8080
+#   HF_ENDPOINT=http://127.0.0.1:8080 python convert_hf_to_gguf.py --remote local/model
+#
+#   python remote_safetensors.py selftest
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import http.client
+import json
+import logging
+import os
+import random
+import shutil
+import ssl
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger("remote-safetensors")
+
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+
+class RangeFetchError(Exception): ...
+
+
+class PermanentFetchError(RangeFetchError): ...
+
+
+@dataclass
+class FetchStats:
+    requests: int = 0
+    retries: int = 0
+    bytes_network: int = 0
+    bytes_cache: int = 0
+    latencies: list[float] = field(default_factory=list)  # time to first byte, seconds
+    busy_seconds: float = 0.0  # summed over all requests
+    started: float = field(default_factory=time.perf_counter)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add_request(self, nbytes: int, latency: float, seconds: float):
+        with self._lock:
+            self.requests += 1
+            self.bytes_network += nbytes
+            self.latencies.append(latency)
+            self.busy_seconds += seconds
+
+    def add_cache_hit(self, nbytes: int):
+        with self._lock:
+            self.bytes_cache += nbytes
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def summary(self) -> str:
+        with self._lock:
+            wall = max(time.perf_counter() - self.started, 1e-9)
+            lat = sorted(self.latencies)
+            p50 = lat[len(lat) // 2] * 1000 if lat else 0.0
+            p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000 if lat else 0.0
+            return (f"{self.requests} range requests, {self.retries} retries, "
+                    f"{self.bytes_network / 1e6:.1f} MB downloaded, {self.bytes_cache / 1e6:.1f} MB from cache, "
+                    f"{self.bytes_network / wall / 1e6:.1f} MB/s overall, "
+                    f"{self.bytes_network / max(self.busy_seconds, 1e-9) / 1e6:.1f} MB/s per connection, "
+                    f"latency p50 {p50:.0f} ms / p95 {p95:.0f} ms")
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, reused per (scheme, host, port)."""
+
+    def __init__(self, max_per_host: int, timeout: float):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self._idle: dict[tuple[str, str, int], deque[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    def _key(self, url: str) -> tuple[str, str, int]:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return parts.scheme, parts.hostname or "", port
+
+    @contextmanager
+    def connection(self, url: str) -> Iterator[http.client.HTTPConnection]:
+        key = self._key(url)
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            conn = idle.pop() if idle else None
+        if conn is None:
+            scheme, host, port = key
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context)
+            else:
+                conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        try:
+            yield conn
+        except BaseException:
+            # the connection state is unknown, never hand it out again
+            conn.close()
+            raise
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.max_per_host:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+@dataclass
+class _Resolved:
+    url: str
+    cache_key: str
+
+
+class RangeFetcher:
+    """Parallel, retrying, cached byte-range reads over HTTP."""
+
+    def __init__(self, connections: int = 8, chunk_size: int = 16 * 1024 * 1024, cache_dir: Path | None = None,
+                 retries: int = 5, timeout: float = 60.0, readahead: int = 256 * 1024 * 1024,
+                 headers: dict[str, str] | None = None, recent_chunks: int = 4):
+        self.connections = max(1, connections)
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir
+        self.retries = retries
+        self.readahead = readahead
+        self.recent_chunks = recent_chunks
+        self.headers = headers if headers is not None else self.default_headers()
+        self.stats = FetchStats()
+        self._pool = ConnectionPool(self.connections, timeout)
+        self._executor = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="range-fetch")
+        self._resolved: dict[str, _Resolved] = {}
+        self._resolve_lock = threading.Lock()
+        # chunk downloads in flight or prefetched but not consumed yet
+        self._pending: dict[tuple[str, int], Future[bytes]] = {}
+        # exact-range downloads of small tensors, keyed by (url, start, size)
+        self._pending_ranges: dict[tuple[str, int, int], Future[bytes]] = {}
+        # chunks a read used only partly, most recently used last
+        self._recent: OrderedDict[tuple[str, int], bytes] = OrderedDict()
+        self._pending_lock = threading.Lock()
+
+    @staticmethod
+    def default_headers() -> dict[str, str]:
+        headers = {"User-Agent": "convert_hf_to_gguf"}
+        if os.environ.get("HF_TOKEN"):
+            headers["Authorization"] = f"Bearer {os.environ['HF_TOKEN']}"
+        return headers
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pool.close()
+
+    # --- HTTP ---
+
+    def _request(self, url: str, method: str, extra_headers: dict[str, str],
+                 origin: str | None = None) -> tuple[int, dict[str, str], bytes, float]:
+        # the token only goes to the host of the Hub URL, even when `url` is an already resolved redirect target
+        origin = origin or urlsplit(url).hostname
+        for _ in range(10):  # redirect hops
+            parts = urlsplit(url)
+            path = parts.path + (f"?{parts.query}" if parts.query else "")
+            headers = dict(extra_headers)
+            for k, v in self.headers.items():
+                # don't leak the token to CDN hosts behind redirects
+                if k == "Authorization" and parts.hostname != origin:
+                    continue
+                headers[k] = v
+            with self._pool.connection(url) as conn:
+                start = time.perf_counter()
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+                latency = time.perf_counter() - start
+                body = response.read()
+                resp_headers = {k.lower(): v for k, v in response.getheaders()}
+                if response.will_close:
+                    conn.close()
+            if response.status in REDIRECT_STATUS and "location" in resp_headers:
+                url = urljoin(url, resp_headers["location"])
+                continue
+            resp_headers["x-final-url"] = url
+            return response.status, resp_headers, body, latency
+        raise RangeFetchError(f"Too many redirects for {url}")
+
+    def _with_retries(self, what: str, fn):
+        delay = 0.5
+        for attempt in range(self.retries + 1):
+            try:
+                return fn()
+            except PermanentFetchError:
+                raise
+            except (OSError, http.client.HTTPException, RangeFetchError) as e:
+                if attempt == self.retries:
+                    raise RangeFetchError(f"{what}: giving up after {attempt + 1} attempts: {e}") from e
+                self.stats.add_retry()
+                logger.warning(f"{what}: {e}, retrying in {delay:.1f}s")
+                time.sleep(delay * (1 + random.random()))
+                delay = min(delay * 2, 30.0)
+
+    def _resolve(self, url: str) -> _Resolved:
+        with self._resolve_lock:
+            if (resolved := self._resolved.get(url)) is not None:
+                return resolved
+
+        def head() -> _Resolved:
+            status, headers, _, _ = self._request(url, "HEAD", {"Range": "bytes=0-0"})
+            if status in RETRY_STATUS:
+                raise RangeFetchError(f"HTTP {status}")
+            if status >= 400:
+                raise PermanentFetchError(f"HTTP {status} for {url}")
+            # LFS files on the Hub report the content hash as (linked) ETag
+            etag = headers.get("x-linked-etag") or headers.get("etag") or ""
+            cache_key = hashlib.sha256(f"{url}\n{etag}".encode()).hexdigest()[:32]
+            return _Resolved(url=headers["x-final-url"], cache_key=cache_key)
+
+        resolved = self._with_retries(f"HEAD {url}", head)
+        with self._resolve_lock:
+            self._resolved[url] = resolved
+        return resolved
+
+    def _forget(self, url: str):
+        # signed CDN URLs expire, resolve again on the next attempt
+        with self._resolve_lock:
+            self._resolved.pop(url, None)
+
+    # --- chunks ---
+
+    def _chunk_path(self, cache_key: str, index: int) -> Path | None:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / cache_key / f"{index:08d}.bin"
+
+    def _download_chunk(self, url: str, index: int) -> bytes:
+        resolved = self._resolve(url)
+        path = self._chunk_path(resolved.cache_key, index)
+        if path is not None and path.is_file():
+            data = path.read_bytes()
+            self.stats.add_cache_hit(len(data))
+            return data
+
+        data = self._download_range(url, index * self.chunk_size, self.chunk_size)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".tmp{threading.get_ident()}")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return data
+
+    def _download_range(self, url: str, start: int, size: int) -> bytes:
+        first = start
+        last = start + size - 1
+
+        def get() -> bytes:
+            target = self._resolve(url).url
+            start = time.perf_counter()
+            status, headers, body, latency = self._request(target, "GET", {"Range": f"bytes={first}-{last}"},
+                                                           origin=urlsplit(url).hostname)
+            if status == 200:
+                # server ignored the range header
+                body = body[first:last + 1]
+            elif status == 416:
+                body = b""
+            elif status in (401, 403, 404) and target != url:
+                self._forget(url)
+                raise RangeFetchError(f"HTTP {status} from redirect target")
+            elif status in RETRY_STATUS:
+                raise RangeFetchError(f"HTTP {status}")
+            elif status != 206:
+                raise PermanentFetchError(f"HTTP {status} for {target}")
+            self.stats.add_request(len(body), latency, time.perf_counter() - start)
+            return body
+
+        return self._with_retries(f"GET {url} [{first}-{last}]", get)
+
+    def _chunk_future(self, url: str, index: int) -> Future[bytes]:
+        key = (url, index)
+        with self._pending_lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._download_chunk, url, index)
+                self._pending[key] = future
+        return future
+
+    def _chunk_range(self, start: int, size: int) -> range:
+        if size <= 0:
+            return range(0)
+        return range(start // self.chunk_size, (start + size - 1) // self.chunk_size + 1)
+
+    def _has_chunk(self, url: str, index: int) -> bool:
+        key = (url, index)
+        with self._pending_lock:
+            if key in self._pending or key in self._recent:
+                return True
+        path = self._chunk_path(self._resolve(url).cache_key, index)
+        return path is not None and path.is_file()
+
+    def _exact_range(self, url: str, start: int, size: int) -> bool:
+        # a whole chunk for a small tensor is only worth it if that chunk is needed anyway
+        return 0 < size < self.chunk_size and not any(self._has_chunk(url, index) for index in self._chunk_range(start, size))
+
+    def _remember(self, url: str, index: int, chunk: bytes):
+        with self._pending_lock:
+            self._recent[(url, index)] = chunk
+            self._recent.move_to_end((url, index))
+            while len(self._recent) > self.recent_chunks:
+                self._recent.popitem(last=False)
+
+    def prefetch(self, url: str, start: int, size: int):
+        """Start downloading a range in the background, up to the readahead budget."""
+        with self._pending_lock:
+            budget = self.readahead - len(self._pending) * self.chunk_size - sum(k[2] for k in self._pending_ranges)
+        if budget <= 0:
+            return
+        if self._exact_range(url, start, size):
+            with self._pending_lock:
+                if (url, start, size) not in self._pending_ranges:
+                    self._pending_ranges[(url, start, size)] = self._executor.submit(self._download_range, url, start, size)
+            return
+        for index in self._chunk_range(start, size):
+            if budget <= 0:
+                break
+            with self._pending_lock:
+                if (url, index) in self._recent:
+                    continue
+            self._chunk_future(url, index)
+            budget -= self.chunk_size
+
+    def fetch(self, url: str, start: int, size: int) -> bytearray:
+        """Read `size` bytes at `start`. Returns a bytearray, since PyTorch wants a writable buffer."""
+        with self._pending_lock:
+            range_future = self._pending_ranges.pop((url, start, size), None)
+        if range_future is not None or self._exact_range(url, start, size):
+            data = range_future.result() if range_future is not None else self._download_range(url, start, size)
+            if len(data) != size:
+                raise RangeFetchError(f"Short read from {url} at offset {start}")
+            return bytearray(data)
+
+        out = bytearray(size)
+        view = memoryview(out)
+        sources: list[tuple[int, bytes | Future[bytes]]] = []
+        with self._pending_lock:
+            for index in self._chunk_range(start, size):
+                recent = self._recent.get((url, index))
+                if recent is not None:
+                    self._recent.move_to_end((url, index))
+                sources.append((index, recent))
+        sources = [(index, recent if recent is not None else self._chunk_future(url, index)) for index, recent in sources]
+        try:
+            for index, source in sources:
+                chunk = source if isinstance(source, bytes) else source.result()
+                chunk_start = index * self.chunk_size
+                lo = max(start, chunk_start)
+                hi = min(start + size, chunk_start + len(chunk))
+                if hi - lo < min(start + size, chunk_start + self.chunk_size) - lo:
+                    raise RangeFetchError(f"Short read from {url} at offset {chunk_start}")
+                view[lo - start:hi - start] = chunk[lo - chunk_start:hi - chunk_start]
+                # the neighbouring tensor needs the rest of this chunk
+                if lo > chunk_start or hi < chunk_start + len(chunk):
+                    self._remember(url, index, chunk)
+        finally:
+            with self._pending_lock:
+                for index, source in sources:
+                    if isinstance(source, Future) and self._pending.get((url, index)) is source:
+                        del self._pending[(url, index)]
+        return out
+
+
+# --- local stand-in for the Hugging Face file server ---
+
+
+class _RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    root: Path
+    latency: float = 0.0
+    fail_every: int = 0
+    redirect: str = ""
+    auth_log: list[str | None] | None = None
+    counter = [0]
+    counter_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _local_path(self) -> Path | None:
+        # /<org>/<repo>/resolve/<rev>/<file> or a plain /<file>
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if "resolve" in parts:
+            parts = parts[parts.index("resolve") + 2:]
+        path = (self.root / "/".join(parts)).resolve()
+        if self.root.resolve() not in path.parents and path != self.root.resolve():
+            return None
+        return path if path.is_file() else None
+
+    def _should_fail(self) -> bool:
+        if self.fail_every <= 0:
+            return False
+        with self.counter_lock:
+            self.counter[0] += 1
+            return self.counter[0] % self.fail_every == 0
+
+    def _serve(self, with_body: bool):
+        if self.auth_log is not None:
+            self.auth_log.append(self.headers.get("Authorization"))
+        if self.latency:
+            time.sleep(self.latency)
+        if self._should_fail():
+            self.send_error(503, "injected failure")
+            return
+        if self.redirect:
+            # like the Hub sending LFS files to its CDN
+            self.send_response(302)
+            self.send_header("Location", self.redirect + self.path)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        path = self._local_path()
+        if path is None:
+            self.send_error(404)
+            return
+        file_size = path.stat().st_size
+        first, last = 0, file_size - 1
+        status = 200
+        if (rng := self.headers.get("Range")) and rng.startswith("bytes="):
+            a, _, b = rng[len("bytes="):].partition("-")
+            first = int(a) if a else 0
+            last = min(int(b), file_size - 1) if b else file_size - 1
+            if first >= file_size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{file_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Length", str(last - first + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{path.stat().st_mtime_ns:x}-{file_size:x}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{file_size}")
+        self.end_headers()
+        if with_body:
+            with open(path, "rb") as f:
+                f.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    buf = f.read(min(remaining, 1 << 20))
+                    self.wfile.write(buf)
+                    remaining -= len(buf)
+
+    def do_GET(self):
+        self._serve(with_body=True)
+
+    def do_HEAD(self):
+        self._serve(with_body=False)
+
+
+@contextmanager
+def serve_directory(root: Path, port: int = 0, latency: float = 0.0, fail_every: int = 0, redirect: str = "",
+                    auth_log: list[str | None] | None = None) -> Iterator[str]:
+    """Serve `root` over HTTP with Range support; yields the base URL.
+
+    `latency` delays every response and `fail_every` answers every N-th request
+    with a 503, to exercise concurrency and retries. With `redirect`, every request
+    is answered with a 302 to the same path under that base URL instead; `auth_log`
+    collects the Authorization header (or None) of every request.
+    """
+    handler = type("RangeRequestHandler", (_RangeRequestHandler,), {
+        "root": Path(root), "latency": latency, "fail_every": fail_every, "counter": [0],
+        "redirect": redirect, "auth_log": auth_log,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def write_synthetic_safetensors(path: Path, tensors: dict[str, tuple[str, tuple[int, ...]]], seed: int = 0) -> dict[str, bytes]:
+    """Write a safetensors file with random contents. Returns the raw bytes of each tensor."""
+    itemsize = {"F32": 4, "F16": 2, "BF16": 2, "I32": 4, "U8": 1}
+    rng = random.Random(seed)
+    header: dict[str, object] = {}
+    blobs: dict[str, bytes] = {}
+    offset = 0
+    for name, (dtype, shape) in sorted(tensors.items()):
+        n = itemsize[dtype]
+        for dim in shape:
+            n *= dim
+        blobs[name] = rng.randbytes(n)
+        header[name] = {"dtype": dtype, "shape": list(shape), "data_offsets": [offset, offset + n]}
+        offset += n
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name in sorted(blobs):
+            f.write(blobs[name])
+    return blobs
+
+
+def selftest():
+    tmp = Path(tempfile.mkdtemp(prefix="remote-safetensors-"))
+    try:
+        model_dir = tmp / "model"
+        model_dir.mkdir()
+        blobs = write_synthetic_safetensors(model_dir / "model.safetensors", {
+            "model.embed_tokens.weight": ("BF16", (512, 1024)),
+            "model.layers.0.input_layernorm.weight": ("F32", (1024,)),
+            "model.layers.0.mlp.down_proj.weight": ("F16", (1024, 1536)),
+            "model.norm.weight": ("F32", (1024,)),
+        })
+        header_len = int.from_bytes((model_dir / "model.safetensors").read_bytes()[:8], "little")
+        with open(model_dir / "model.safetensors", "rb") as f:
+            f.seek(8)
+            header = json.loads(f.read(header_len))
+
+        with serve_directory(model_dir, latency=0.005, fail_every=7) as base_url:
+            url = f"{base_url}/local/model/resolve/main/model.safetensors"
+            for run in ("cold", "warm"):
+                fetcher = RangeFetcher(connections=4, chunk_size=256 * 1024, cache_dir=tmp / "cache", retries=3)
+                names = sorted(blobs)
+                for i, name in enumerate(names):
+                    # like convert_hf_to_gguf.py: start on the next tensor while reading this one
+                    if i + 1 < len(names):
+                        next_begin, next_end = header[names[i + 1]]["data_offsets"]
+                        fetcher.prefetch(url, 8 + header_len + next_begin, next_end - next_begin)
+                    begin, end = header[name]["data_offsets"]
+                    data = fetcher.fetch(url, 8 + header_len + begin, end - begin)
+                    assert bytes(data) == blobs[name], f"{run}: mismatch for {name}"
+                print(f"{run}: {fetcher.stats.summary()}")
+                # every chunk at most once; small tensors read with an exact range may be downloaded again with their chunk
+                limit = (model_dir / "model.safetensors").stat().st_size
+                limit += sum(len(b) for b in blobs.values() if len(b) < fetcher.chunk_size)
+                assert fetcher.stats.bytes_network <= limit, \
+                    f"{run}: {fetcher.stats.bytes_network} bytes downloaded, expected at most {limit}"
+                if run == "warm":
+                    assert fetcher.stats.bytes_network == 0, "warm run should be served from the chunk cache"
+                fetcher.close()
+
+        # the token goes to the Hub only, never to the CDN it redirects to (a different host name)
+        hub_auth: list[str | None] = []
+        cdn_auth: list[str | None] = []
+        with serve_directory(model_dir, auth_log=cdn_auth) as cdn_url, \
+                serve_directory(model_dir, redirect=cdn_url.replace("127.0.0.1", "localhost"), auth_log=hub_auth) as hub_url:
+            fetcher = RangeFetcher(connections=2, chunk_size=256 * 1024,
+                                   headers={"User-Agent": "selftest", "Authorization": "Bearer secret"})
+            url = f"{hub_url}/local/model/resolve/main/model.safetensors"
+            name = "model.layers.0.mlp.down_proj.weight"
+            begin, end = header[name]["data_offsets"]
+            assert bytes(fetcher.fetch(url, 8 + header_len + begin, end - begin)) == blobs[name], "redirect: mismatch"
+            fetcher.close()
+        assert hub_auth and all(h == "Bearer secret" for h in hub_auth), f"redirect: Hub requests without the token: {hub_auth}"
+        assert cdn_auth and not any(cdn_auth), f"redirect: token sent to the CDN in {sum(map(bool, cdn_auth))} of {len(cdn_auth)} requests"
+        print(f"redirect: {len(hub_auth)} Hub requests with the token, {len(cdn_auth)} CDN requests without it")
+        print("selftest OK")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Range fetcher for remote safetensors, with an offline test server")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="serve a local model directory with the Hugging Face URL layout")
+    serve.add_argument("root", type=Path)
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    serve.add_argument("--fail-every", type=int, default=0, help="answer every N-th request with HTTP 503")
+    sub.add_parser("selftest", help="round-trip a synthetic safetensors file through the local server")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        with serve_directory(args.root, args.port, args.latency, args.fail_every) as base_url:
+            print(f"Serving {args.root} at {base_url} (e.g. HF_ENDPOINT={base_url}), Ctrl+C to stop")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+    else:
+        selftest()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 import gradio as gr
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, TextIteratorStreamer
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, TextIteratorStreamer, LogitsProcessorList
 from peft import PeftModel
 import os
 import threading
 from model_config import get_current_config
+from cjk_logits import TokenMask
 
 # ==========================================
 # ⚙️ Configuration
@@ -12,6 +13,9 @@ from model_config import get_current_config
 # 1. First choice: The fully merged independent model
 MERGED_MODEL_PATH = "outputs/llama3_qlora_test_merged_full"
 
+# Chinese-only constrained decoding: "hard", "soft" or None to disable
+CONSTRAINED_DECODING = "hard"
+
 # 2. Second choice: Check model_config.py (Adapter mode)
 config = get_current_config()
 ADAPTER_PATH = config["output_dir"]
@@ -33,6 +37,8 @@ else:
 print("⏳ Loading model... (This takes a minute)")
 tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
 tokenizer.pad_token = tokenizer.eos_token
+# Vocab classification is computed once per tokenizer and cached under cache/token_masks
+token_mask = TokenMask.from_tokenizer(tokenizer) if CONSTRAINED_DECODING else None
 
 bnb_config = BitsAndBytesConfig(
     load_in_4bit=True,
@@ -86,6 +92,9 @@ def generate_response(message, history):
         top_p=0.9,
         eos_token_id=tokenizer.eos_token_id
     )
+    if token_mask is not None:
+        # A fresh processor per request: it tracks the English run of this generation
+        generation_kwargs["logits_processor"] = LogitsProcessorList([token_mask.hf_processor(CONSTRAINED_DECODING)])
 
     thread = threading.Thread(target=model.generate, kwargs=generation_kwargs)
     thread.start()
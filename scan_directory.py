@@ -1,26 +1,42 @@
 import os
-from pathlib import Path
+import time
 
 def scan_directory(root_path):
-    """扫描目录结构"""
-    root_path = Path(root_path)
+    """扫描目录结构 (os.scandir 遍历，每一项的类型和大小来自目录项本身，不再逐个 stat)"""
     print(f"\n开始扫描目录: {root_path}")
     print("="*50)
-    
+    totals = {"dirs": 0, "files": 0, "notes": 0, "bytes": 0}
+    start = time.perf_counter()
+
     def print_directory(path, level=0):
         indent = "  " * level
         try:
-            # 打印当前目录下的所有文件和文件夹
-            for item in sorted(path.iterdir()):
-                if item.is_dir():
-                    print(f"{indent}📁 {item.name}/")
-                    print_directory(item, level + 1)
-                else:
-                    print(f"{indent}📄 {item.name}")
-        except Exception as e:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
             print(f"{indent}❌ 访问错误: {e}")
-    
+            return
+        # 打印当前目录下的所有文件和文件夹
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    totals["dirs"] += 1
+                    print(f"{indent}📁 {entry.name}/")
+                    print_directory(entry.path, level + 1)
+                else:
+                    totals["files"] += 1
+                    totals["notes"] += entry.name.endswith(".md")
+                    totals["bytes"] += entry.stat(follow_symlinks=False).st_size
+                    print(f"{indent}📄 {entry.name}")
+            except OSError as e:
+                print(f"{indent}❌ 访问错误: {entry.name}: {e}")
+
     print_directory(root_path)
+    elapsed = time.perf_counter() - start
+    print("="*50)
+    print(f"共 {totals['dirs']} 个目录，{totals['files']} 个文件 (其中 {totals['notes']} 篇笔记)，"
+          f"{totals['bytes'] / 2**20:.1f} MB，用时 {elapsed:.2f}s")
+    print("读取和解析笔记的速度可用 python vault_crawler.py <vault> 测试")
 
 if __name__ == "__main__":
     VAULT_PATH = r'E:\kubook'
@@ -0,0 +1,150 @@
+"""
+流式生成的增量校验
+
+chat.enforce_chinese_response 原来每次都完整生成最多 1024 个 token，生成完才用 filter_response 检查，
+不合格就从头重新生成，最坏情况下一个问题要完整生成三次。
+StreamValidator 在 token 到达时增量统计中文比例、表情符号和句子状态，
+在检查窗口之后一旦不合格就立刻中止本次生成；通过窗口检查的文本再流式输出到终端。
+
+所有统计都是 O(新增字符数) 的累加，不会在每个 token 上重新扫描全文。
+"""
+import text_classify
+from text_classify import EMOJI, HAN, PUNCT, SPACE
+
+# 至少生成这么多个有效字符 (非空白、非标点) 之后才开始判断，避免开头几个字的偶然性
+DEFAULT_WINDOW = 48
+# 中文字符占有效字符的最低比例，与 filter_response 的阈值一致
+DEFAULT_MIN_CHINESE_RATIO = 0.4
+# 允许出现的表情符号数量，超过后中止 (None 表示不限制，只在输出时去掉)
+DEFAULT_MAX_EMOJI = 3
+# 这么多个字符内一直没有句末标点，视为跑题或复读
+DEFAULT_MAX_SENTENCE_CHARS = 300
+
+SENTENCE_END = "。！？"
+
+
+class StreamValidator:
+    """逐段接收生成文本，维护中文比例、表情符号和句子状态
+
+    feed(delta) 返回可以安全输出的文本 (去掉表情符号)，不合格时 failed 为 True，reason 说明原因。
+    在通过检查窗口之前，输出的文本会先缓存起来，通过后一次性放出。
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, min_chinese_ratio=DEFAULT_MIN_CHINESE_RATIO,
+                 max_emoji=DEFAULT_MAX_EMOJI, max_sentence_chars=DEFAULT_MAX_SENTENCE_CHARS):
+        self.window = window
+        self.min_chinese_ratio = min_chinese_ratio
+        self.max_emoji = max_emoji
+        self.max_sentence_chars = max_sentence_chars
+        self.text = []
+        self.chinese_chars = 0
+        self.content_chars = 0  # 非空白、非标点的字符数
+        self.emoji = 0
+        self.sentences = 0  # 已完成的句子数 (至少 5 个字符)
+        self.sentence_chars = 0  # 当前句子已有的字符数
+        self.failed = False
+        self.reason = None
+        self._pending = []  # 通过窗口检查之前暂存的输出
+        self._released = False
+
+    @property
+    def chinese_ratio(self):
+        if self.content_chars == 0:
+            return 1.0
+        return self.chinese_chars / self.content_chars
+
+    def _fail(self, reason):
+        self.failed = True
+        self.reason = reason
+
+    def feed(self, delta):
+        """接收一段新生成的文本，返回可以输出的部分"""
+        if self.failed or not delta:
+            return ""
+        out = []
+        # 整段查表分类，不再逐字符调用 unicodedata
+        for char, flags in zip(delta, text_classify.classify(delta).tolist()):
+            if flags & EMOJI:
+                self.emoji += 1
+                continue
+            out.append(char)
+            if char in SENTENCE_END:
+                if self.sentence_chars >= 5:
+                    self.sentences += 1
+                self.sentence_chars = 0
+                continue
+            if flags & SPACE:
+                continue
+            self.sentence_chars += 1
+            if flags & PUNCT:
+                continue
+            self.content_chars += 1
+            if flags & HAN:
+                self.chinese_chars += 1
+        clean = "".join(out)
+        self.text.append(clean)
+        self._check()
+        if self.failed:
+            return ""
+
+        if self._released:
+            return clean
+        self._pending.append(clean)
+        if self.content_chars >= self.window:
+            self._released = True
+            released = "".join(self._pending)
+            self._pending = []
+            return released
+        return ""
+
+    def _check(self):
+        if self.max_emoji is not None and self.emoji > self.max_emoji:
+            self._fail(f"表情符号过多 ({self.emoji} 个)")
+        elif self.content_chars >= self.window and self.chinese_ratio < self.min_chinese_ratio:
+            self._fail(f"中文比例过低 ({self.chinese_ratio:.0%})")
+        elif self.sentence_chars > self.max_sentence_chars:
+            self._fail(f"超过 {self.max_sentence_chars} 字没有句末标点")
+
+    def finish(self):
+        """生成结束，返回尚未输出的文本 (短回答可能一直没有通过窗口)"""
+        if self.failed:
+            return ""
+        # 超过窗口的文本已经在 _check 中检查过，这里只需要检查没达到窗口长度的短回答
+        if self.chinese_ratio >= self.min_chinese_ratio:
+            released = "".join(self._pending)
+            self._pending = []
+            self._released = True
+            return released
+        self._fail(f"中文比例过低 ({self.chinese_ratio:.0%})")
+        return ""
+
+    def get_text(self):
+        return "".join(self.text)
+
+
+def stream_completion(llm, prompt, validator, on_text=None, **params):
+    """流式调用 llm(prompt)，边生成边校验，不合格时立即中止
+
+    on_text(text) 在有可以输出的文本时被调用。
+    返回 (完整文本, 生成的 token 数)；中止时 validator.failed 为 True。
+    """
+    params = dict(params, stream=True)
+    stream = llm(prompt, **params)
+    n_tokens = 0
+    try:
+        for chunk in stream:
+            n_tokens += 1
+            text = validator.feed(chunk["choices"][0]["text"])
+            if validator.failed:
+                break
+            if text and on_text:
+                on_text(text)
+    finally:
+        # 关闭生成器，llama.cpp 不再继续解码
+        if hasattr(stream, "close"):
+            stream.close()
+    if not validator.failed:
+        text = validator.finish()
+        if text and on_text:
+            on_text(text)
+    return validator.get_text(), n_tokens
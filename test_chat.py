@@ -1,8 +1,9 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, LogitsProcessorList
 from peft import PeftModel
 import os
 import sys
+from cjk_logits import TokenMask
 
 try:
     from model_config import get_current_config
@@ -20,6 +21,8 @@ except ImportError:
 config = get_current_config()
 BASE_MODEL_ID = config["model_id"]
 ADAPTER_PATH  = config["output_dir"]
+# Chinese-only constrained decoding: "hard", "soft" or None to disable
+CONSTRAINED_DECODING = "hard"
 
 def main():
     print(f"🦁 Test Chat - Loading Config: {config.get('name')}")
@@ -39,6 +42,8 @@ def main():
     # 1. Load Tokenizer
     print("Loading tokenizer...")
     tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_ID)
+    # Vocab classification is computed once per tokenizer and cached under cache/token_masks
+    token_mask = TokenMask.from_tokenizer(tokenizer) if CONSTRAINED_DECODING else None
     
     # 2. Config 4-bit loading (Must match training config)
     print("Configuring 4-bit quantization...")
@@ -97,6 +102,10 @@ def main():
                 tokenizer.convert_tokens_to_ids("<|eot_id|>")
             ]
 
+            logits_processor = None
+            if token_mask is not None:
+                logits_processor = LogitsProcessorList([token_mask.hf_processor(CONSTRAINED_DECODING)])
+
             # Generate
             with torch.no_grad():
                 outputs = model.generate(
@@ -106,7 +115,8 @@ def main():
                     do_sample=True,
                     temperature=0.6, # Low temperature for more focused answers based on training
                     top_p=0.9,
-                    pad_token_id=tokenizer.eos_token_id
+                    pad_token_id=tokenizer.eos_token_id,
+                    logits_processor=logits_processor
                 )
             
             # Decode only the new tokens
@@ -1,5 +1,6 @@
 from llama_cpp import Llama
 import os
+from llama_prefix_cache import PrefixStateCache
 
 def find_model_file(model_dir):
     """在指定目录中查找.gguf模型文件"""
@@ -11,9 +12,7 @@ def find_model_file(model_dir):
             return os.path.join(model_dir, file)
     return None
 
-def format_prompt(instruction):
-    """格式化提示模板"""
-    system_prompt = """你是一位专业的AI技术专家，尤其专注于Llama和LoRA等大模型技术领域。请严格遵守以下原则：
+SYSTEM_PROMPT = """你是一位专业的AI技术专家，尤其专注于Llama和LoRA等大模型技术领域。请严格遵守以下原则：
 
 1. 专业性要求：
    - 必须准确区分LoRA(低秩适配技术)和LoRa(无线技术)
@@ -38,8 +37,12 @@ def format_prompt(instruction):
    - 解释要深入浅出
    - 适当举例说明
    - 突出技术重点"""
-    
-    prompt = f"[INST] <<SYS>>\n{system_prompt}\n<</SYS>>\n\n请用中文回答以下问题：\n{instruction} [/INST]"
+# 所有提示共用的开头，其 KV 状态由 PrefixStateCache 缓存
+PROMPT_PREFIX = f"[INST] <<SYS>>\n{SYSTEM_PROMPT}\n<</SYS>>\n\n请用中文回答以下问题：\n"
+
+def format_prompt(instruction):
+    """格式化提示模板"""
+    prompt = f"{PROMPT_PREFIX}{instruction} [/INST]"
     return prompt
 
 def main():
@@ -60,6 +63,7 @@ def main():
         n_threads=8,  # 使用8个线程
         verbose=True
     )
+    prefix_cache = PrefixStateCache(llm)
     
     # 测试问题
     test_questions = [
@@ -74,6 +78,7 @@ def main():
         prompt = format_prompt(question)
         
         try:
+            prefix_cache.activate(PROMPT_PREFIX)
             response = llm(
                 prompt,
                 max_tokens=512,
@@ -89,5 +94,7 @@ def main():
         except Exception as e:
             print(f"生成出错：{str(e)}")
 
+    print(prefix_cache.summary())
+
 if __name__ == "__main__":
     main()
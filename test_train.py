@@ -9,6 +9,10 @@ from datasets import load_dataset
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 import torch
 import yaml
+from packing import load_packing_config, build_packed_dataset, check_attention, PackedDataCollator
+from dataset_cache import cache_key, file_hash, tokenizer_hash, load_or_build, preprocessing_workers
+
+PROMPT_TEMPLATE = "### 指令：{instruction}\n### 输入：{input}\n### 响应：{output}"
 
 def create_and_prepare_model(config):
     # 加载基础模型和分词器
@@ -37,14 +41,14 @@ def create_and_prepare_model(config):
     
     return model, tokenizer
 
-def prepare_dataset(tokenizer, config, data_path):
+def build_dataset(tokenizer, config, data_path, packing, num_proc):
     # 加载数据集
     dataset = load_dataset("json", data_files=data_path)
     
     def preprocess_function(examples):
         # 将指令和输出组合成完整的提示
         prompts = [
-            f"### 指令：{instruction}\n### 输入：{input_text}\n### 响应：{output}"
+            PROMPT_TEMPLATE.format(instruction=instruction, input=input_text, output=output)
             for instruction, input_text, output in zip(
                 examples["instruction"],
                 examples["input"],
@@ -52,36 +56,54 @@ def prepare_dataset(tokenizer, config, data_path):
             )
         ]
         
-        # 对文本进行编码
+        # 对文本进行编码 (打包时不做 padding)
         tokenized = tokenizer(
             prompts,
             truncation=True,
             max_length=config['max_source_length'],
-            padding="max_length"
+            padding=False if packing["packing"] else "max_length"
         )
         return tokenized
 
-    # 处理数据集
+    # 处理数据集 (多进程分词)
     tokenized_dataset = dataset["train"].map(
         preprocess_function,
         batched=True,
+        num_proc=num_proc if num_proc > 1 else None,
         remove_columns=dataset["train"].column_names
     )
+
+    if packing["packing"]:
+        tokenized_dataset = build_packed_dataset(tokenized_dataset, config['max_source_length'])
     
     return tokenized_dataset
 
+def prepare_dataset(tokenizer, config, data_path, packing, num_proc):
+    # 数据、分词器或预处理参数不变时直接读取磁盘缓存
+    key = cache_key(
+        data=file_hash(data_path),
+        tokenizer=tokenizer_hash(tokenizer),
+        template=PROMPT_TEMPLATE,
+        max_length=config['max_source_length'],
+        packing=packing,
+    )
+    return load_or_build(key, lambda: build_dataset(tokenizer, config, data_path, packing, num_proc))
+
 def train(config_path="e:/AI/llama2-train/test_config.yaml", data_path="e:/AI/llama2-train/data/test_train.json"):
     # 加载配置
     with open(config_path, 'r', encoding='utf-8') as f:
         config = yaml.safe_load(f)
+    packing = load_packing_config(config_path)
+    num_proc = preprocessing_workers(config_path)
     
     # 创建并准备模型
     print("正在加载模型...")
     model, tokenizer = create_and_prepare_model(config)
+    check_attention(model, packing)
     
     # 准备数据集
     print("正在准备数据集...")
-    train_dataset = prepare_dataset(tokenizer, config, data_path)
+    train_dataset = prepare_dataset(tokenizer, config, data_path, packing, num_proc)
     
     # 设置训练参数
     training_args = TrainingArguments(
@@ -99,10 +121,14 @@ def train(config_path="e:/AI/llama2-train/test_config.yaml", data_path="e:/AI/ll
     )
     
     # 创建数据收集器
-    data_collator = DataCollatorForLanguageModeling(
-        tokenizer=tokenizer,
-        mlm=False
-    )
+    if packing["packing"]:
+        # 掩码要和注意力分数同一精度 (模型以 float16 加载)
+        data_collator = PackedDataCollator(tokenizer.pad_token_id, packing["packing_mask"], mask_dtype=model.dtype)
+    else:
+        data_collator = DataCollatorForLanguageModeling(
+            tokenizer=tokenizer,
+            mlm=False
+        )
     
     # 创建训练器
     trainer = Trainer(
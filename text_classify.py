@@ -0,0 +1,304 @@
+"""
+表驱动的文本字符分类 (中文、标点、空白、表情、允许保留的字符)
+
+chat.is_chinese_character、contains_emoji 和 filter_response 里的表情过滤原来对每个字符调用
+unicodedata.name() 再做子串查找，有时同一个字符要查两次；最后的 allowed_chars 过滤又逐字符检查一遍。
+这里在第一次使用时为整个基本多文种平面 (BMP，U+0000–U+FFFF) 建一张 65536 项的 uint8 类别表
+(约 30 ms)，之后：
+  - 单个字符：查表；
+  - 删除表情：预编译的正则字符类 (C 实现)；
+  - 删除不允许的字符：短文本用预编译的正则字符类，长文本用 numpy；
+  - 统计/比例：np.frombuffer(text.encode('utf-32-le')) 得到码位数组，一次查表完成分类。
+BMP 以外的字符 (扩展区汉字、大部分表情) 按区间判断并缓存。
+
+基准测试：python text_classify.py --length 2000
+"""
+import argparse
+import functools
+import re
+import time
+import unicodedata
+
+import numpy as np
+
+# 字符类别位
+HAN = 1        # U+4E00–U+9FFF，即原代码中按码位范围判断的"中文字符"
+IDEOGRAPH = 2  # 所有 CJK 统一汉字 (含扩展区)，对应 unicodedata.name 中的 'CJK UNIFIED IDEOGRAPH'
+PUNCT = 4      # unicodedata.category 以 'P' 开头
+SPACE = 8      # str.isspace()
+EMOJI = 16     # 表情符号及其组合字符
+ALLOWED = 32   # filter_response 最终保留的非汉字字符
+LATIN = 64     # ASCII 字母
+
+# filter_response 保留的字符 (汉字之外)
+ALLOWED_CHARS = ('\n "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                 '¨·ˉ—‖…∶、。〃々〈〉《》「」『』〔〕！＂＇（），．：；？｀｜～')
+
+# 表情符号所在的码位区间
+EMOJI_RANGES = (
+    (0x1F000, 0x1FAFF),  # 麻将/扑克、各类符号与象形文字、表情、交通、补充符号
+    (0x2600, 0x27BF),    # 杂项符号、装饰符号
+    (0x2B00, 0x2BFF),    # 箭头与星形等
+    (0xFE0F, 0xFE0F),    # 表情变体选择符
+    (0x200D, 0x200D),    # 零宽连接符 (组合表情)
+)
+
+# CJK 统一汉字的区间 (基本区 + 扩展 A–H)
+IDEOGRAPH_RANGES = (
+    (0x3400, 0x4DBF),
+    (0x4E00, 0x9FFF),
+    (0x20000, 0x2A6DF),
+    (0x2A700, 0x2EE5D),
+    (0x30000, 0x323AF),
+)
+
+# 字符过滤在超过这个长度时用 numpy，更短的文本用正则
+NUMPY_MIN_LENGTH = 256
+
+
+def _in_ranges(code, ranges):
+    return any(lo <= code <= hi for lo, hi in ranges)
+
+
+def _compute_flags(code):
+    """单个码位的类别位 (BMP 以外的字符使用)"""
+    char = chr(code)
+    flags = 0
+    if 0x4E00 <= code <= 0x9FFF:
+        flags |= HAN
+    if _in_ranges(code, IDEOGRAPH_RANGES):
+        flags |= IDEOGRAPH
+    if unicodedata.category(char).startswith('P'):
+        flags |= PUNCT
+    if char.isspace():
+        flags |= SPACE
+    if _in_ranges(code, EMOJI_RANGES):
+        flags |= EMOJI
+    if char in ALLOWED_CHARS:
+        flags |= ALLOWED
+    if char.isascii() and char.isalpha():
+        flags |= LATIN
+    return flags
+
+
+@functools.lru_cache(maxsize=1)
+def bmp_table():
+    """BMP 全部码位的类别表 (只在第一次调用时构建)
+
+    原来按 unicodedata.name 中的 'EMOJI' / 'EMOTICON' 判断表情，但 BMP 里没有这样命名的字符，
+    表情改为按 EMOJI_RANGES 判断。
+    """
+    table = np.zeros(0x10000, dtype=np.uint8)
+    table[0x4E00:0xA000] |= HAN
+    for lo, hi in IDEOGRAPH_RANGES:
+        if lo < 0x10000:
+            table[lo:hi + 1] |= IDEOGRAPH
+    for lo, hi in EMOJI_RANGES:
+        if lo < 0x10000:
+            table[lo:hi + 1] |= EMOJI
+    table[[ord(c) for c in ALLOWED_CHARS]] |= ALLOWED
+    table[ord('A'):ord('Z') + 1] |= LATIN
+    table[ord('a'):ord('z') + 1] |= LATIN
+    # 标点和空白只能逐个码位查询 unicodedata，但只做一次
+    punct = [code for code in range(0x10000) if unicodedata.category(chr(code)).startswith('P')]
+    space = [code for code in range(0x10000) if chr(code).isspace()]
+    table[punct] |= PUNCT
+    table[space] |= SPACE
+    return table
+
+
+@functools.lru_cache(maxsize=1)
+def _bmp_bytes():
+    # bytes 按下标取值得到 Python int，比 numpy 标量快，供单个字符查表
+    return bmp_table().tobytes()
+
+
+@functools.lru_cache(maxsize=65536)
+def _astral_flags(code):
+    return _compute_flags(code)
+
+
+def char_flags(char):
+    code = ord(char)
+    if code < 0x10000:
+        return _bmp_bytes()[code]
+    return _astral_flags(code)
+
+
+def is_han(char):
+    return '\u4e00' <= char <= '\u9fff'
+
+
+def is_ideograph(char):
+    return bool(char_flags(char) & IDEOGRAPH)
+
+
+def is_emoji(char):
+    return bool(char_flags(char) & EMOJI)
+
+
+def codepoints(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+
+
+def classify(text):
+    """返回 text 中每个字符的类别位 (uint8 数组)"""
+    codes = codepoints(text)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    table = bmp_table()
+    if codes.max() < 0x10000:
+        return table[codes]
+    flags = np.empty(len(codes), dtype=np.uint8)
+    bmp = codes < 0x10000
+    flags[bmp] = table[codes[bmp]]
+    # BMP 以外的字符通常很少，按不同码位逐个查
+    astral, inverse = np.unique(codes[~bmp], return_inverse=True)
+    flags[~bmp] = np.array([_astral_flags(int(c)) for c in astral], dtype=np.uint8)[inverse]
+    return flags
+
+
+def _char_class_pattern(chars, ranges=()):
+    parts = [re.escape(c) for c in chars]
+    parts += [f"{re.escape(chr(lo))}-{re.escape(chr(hi))}" if lo != hi else re.escape(chr(lo)) for lo, hi in ranges]
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=1)
+def _emoji_pattern():
+    return re.compile(f"[{_char_class_pattern((), EMOJI_RANGES)}]+")
+
+
+@functools.lru_cache(maxsize=1)
+def _disallowed_pattern():
+    return re.compile(f"[^{_char_class_pattern(ALLOWED_CHARS, ((0x4E00, 0x9FFF),))}]+")
+
+
+def contains_emoji(text):
+    return _emoji_pattern().search(text) is not None
+
+
+def strip_emoji(text):
+    # 以中文为主的文本上，正则字符类比 str.translate 逐字符查字典快约 10 倍
+    return _emoji_pattern().sub("", text)
+
+
+def keep_only(text, mask):
+    """只保留类别位与 mask 有交集的字符 (numpy 实现)"""
+    codes = codepoints(text)
+    keep = (classify(text) & mask) != 0
+    return codes[keep].tobytes().decode("utf-32-le")
+
+
+def drop(text, mask):
+    """删除类别位与 mask 有交集的字符 (numpy 实现)"""
+    codes = codepoints(text)
+    keep = (classify(text) & mask) == 0
+    return codes[keep].tobytes().decode("utf-32-le")
+
+
+def strip_disallowed(text):
+    """只保留汉字 (U+4E00–U+9FFF) 和 ALLOWED_CHARS 中的字符"""
+    if len(text) >= NUMPY_MIN_LENGTH:
+        return keep_only(text, HAN | ALLOWED)
+    return _disallowed_pattern().sub("", text)
+
+
+def content_counts(text, chinese=HAN):
+    """返回 (中文字符数, 有效字符数)；有效字符不含标点和空白，中文字符由 chinese 类别位决定"""
+    flags = classify(text)
+    content = (flags & (PUNCT | SPACE)) == 0
+    return int(np.count_nonzero(content & ((flags & chinese) != 0))), int(np.count_nonzero(content))
+
+
+def chinese_ratio(text, chinese=HAN):
+    """中文字符占有效字符 (非标点、非空白) 的比例，没有有效字符时返回 None"""
+    n_chinese, n_content = content_counts(text, chinese)
+    if n_content == 0:
+        return None
+    return n_chinese / n_content
+
+
+def count(text, mask):
+    """类别位与 mask 有交集的字符数"""
+    return int(np.count_nonzero(classify(text) & mask))
+
+
+# ---- 基准测试：与原来逐字符调用 unicodedata 的实现对比 ----
+
+def _legacy_contains_emoji(text):
+    for char in text:
+        if 'EMOJI' in unicodedata.name(char, '') or 'EMOTICON' in unicodedata.name(char, ''):
+            return True
+    return False
+
+
+def _legacy_strip_emoji(text):
+    return ''.join(char for char in text if not ('EMOJI' in unicodedata.name(char, '') or 'EMOTICON' in unicodedata.name(char, '')))
+
+
+def _legacy_ratio(text):
+    pure_text = ''.join(char for char in text if not unicodedata.category(char).startswith('P') and not char.isspace())
+    chinese_chars = sum(1 for char in pure_text if '\u4e00' <= char <= '\u9fff')
+    return chinese_chars / len(pure_text) if pure_text else None
+
+
+_LEGACY_ALLOWED = set(ALLOWED_CHARS)
+
+
+def _legacy_strip_disallowed(text):
+    return ''.join(char for char in text if char in _LEGACY_ALLOWED or '\u4e00' <= char <= '\u9fff')
+
+
+def _sample_text(length, seed=0):
+    rng = np.random.default_rng(seed)
+    pool = ([chr(c) for c in range(0x4E00, 0x4E00 + 500)] * 6 + list("，。！？、：；（）") * 4
+            + list("abcdefghijklmnopqrstuvwxyz LLaMA GPU 2024\n") + ["😀", "✨", "👗", "é", "ж"])
+    return "".join(rng.choice(pool, size=length))
+
+
+def _time(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark(length, repeat=20):
+    text = _sample_text(length)
+    start = time.perf_counter()
+    bmp_table()
+    _emoji_pattern()
+    _disallowed_pattern()
+    print(f"建表耗时 {(time.perf_counter() - start) * 1000:.1f} ms (只在第一次调用时)")
+    print(f"文本长度 {length} 字符，各函数平均耗时：")
+    cases = [
+        ("包含表情", _legacy_contains_emoji, contains_emoji),
+        ("删除表情", _legacy_strip_emoji, strip_emoji),
+        ("中文比例", _legacy_ratio, chinese_ratio),
+        ("允许字符过滤", _legacy_strip_disallowed, strip_disallowed),
+    ]
+    for name, legacy, fast in cases:
+        t_legacy = _time(legacy, text, repeat)
+        t_fast = _time(fast, text, repeat)
+        print(f"  {name:<8} 原实现 {t_legacy * 1e6:9.1f} µs   新实现 {t_fast * 1e6:8.1f} µs   ({t_legacy / t_fast:.0f}x)")
+
+    # 与原实现的结果对比 (表情的范围比原来的按名字判断更完整，只对比其余几项)
+    same = (_legacy_ratio(text) == chinese_ratio(text)
+            and _legacy_strip_disallowed(text) == strip_disallowed(text)
+            and _legacy_strip_disallowed(text) == keep_only(text, HAN | ALLOWED))
+    print(f"  中文比例与字符过滤结果一致: {same}")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本分类基准测试：查表 / 正则 / numpy 对比逐字符 unicodedata")
+    parser.add_argument("--length", type=int, default=2000, help="测试文本的字符数")
+    parser.add_argument("--repeat", type=int, default=20, help="每个函数重复次数")
+    args = parser.parse_args()
+    if not benchmark(args.length, args.repeat):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+文本相似度指标 (训练脚本共用的 calculate_loss)
+
+原来的 calculate_loss 用 (m+1)×(n+1) 的 Python 二维列表求最长公共子序列 (LCS)，
+2000 字的中文回答就要 400 万次 Python 运算和几十 MB 的整数对象。
+这里改用位并行 LCS (Allison–Dix / Hyyrö)：把较短字符串每个字符出现的位置
+编码成一个整数的二进制位，对较长字符串的每个字符只做几次整数位运算。
+Python 的大整数在 C 层按 30 位一段运算，复杂度为 O(m·n/w)。
+
+loss 公式与原实现完全一致：
+    loss = 1 - (0.4 * 逐字符匹配率 + 0.4 * LCS 比例 - 0.2 * 长度惩罚)，并截断到 [0, 1]
+
+基准测试：python text_metrics.py --length 2000 --pairs 10
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+
+def _match_masks(text):
+    """每个字符 -> 它在 text 中出现位置的位掩码"""
+    masks = {}
+    for i, ch in enumerate(text):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    return masks
+
+
+def lcs_length(text1, text2):
+    """位并行计算最长公共子序列长度"""
+    if len(text1) < len(text2):
+        text1, text2 = text2, text1
+    m = len(text2)
+    if m == 0:
+        return 0
+    masks = _match_masks(text2)
+    full = (1 << m) - 1
+    v = full
+    for ch in text1:
+        u = v & masks.get(ch, 0)
+        # u 是 v 的子集，所以 v - u 等于 v & ~u，不会借位
+        v = ((v + u) | (v - u)) & full
+    return m - bin(v).count("1")
+
+
+def lcs_length_dp(text1, text2):
+    """原来的 O(m·n) 动态规划实现，只用于基准测试和结果校验"""
+    m, n = len(text1), len(text2)
+    dp = [[0] * (n + 1) for _ in range(m + 1)]
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            if text1[i-1] == text2[j-1]:
+                dp[i][j] = dp[i-1][j-1] + 1
+            else:
+                dp[i][j] = max(dp[i-1][j], dp[i][j-1])
+    return dp[m][n]
+
+
+def _codepoints(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def char_match_count(text1, text2):
+    """相同位置上相同字符的个数"""
+    n = min(len(text1), len(text2))
+    if n == 0:
+        return 0
+    return int(np.count_nonzero(_codepoints(text1[:n]) == _codepoints(text2[:n])))
+
+
+def _combine(char_match, lcs, len_out, len_target):
+    total_length = max(len_out, len_target)
+    # 综合考虑多个指标
+    char_match_ratio = char_match / total_length if total_length > 0 else 0
+    lcs_ratio = lcs / total_length if total_length > 0 else 0
+    length_penalty = abs(len_out - len_target) / total_length
+    # 计算加权loss
+    loss = 1.0 - (0.4 * char_match_ratio + 0.4 * lcs_ratio - 0.2 * length_penalty)
+    return min(max(loss, 0.0), 1.0)  # 确保loss在[0,1]范围内
+
+
+def calculate_loss(output_text, target_text):
+    """计算生成文本与目标文本之间的损失"""
+    if not output_text:
+        return 1.0
+    return _combine(char_match_count(output_text, target_text), lcs_length(output_text, target_text),
+                    len(output_text), len(target_text))
+
+
+def calculate_losses(outputs, targets):
+    """批量计算多对文本的 loss，返回 numpy 数组
+
+    逐字符匹配一次性在补齐后的码点矩阵上比较，长度项向量化计算；
+    LCS 对每一对仍用位并行整数运算 (比按 64 位字在 numpy 中模拟进位更快)。
+    """
+    count = len(outputs)
+    losses = np.ones(count, dtype=np.float64)
+    if count == 0:
+        return losses
+    len_out = np.array([len(t) for t in outputs], dtype=np.int64)
+    len_target = np.array([len(t) for t in targets], dtype=np.int64)
+
+    # 逐字符匹配：把每对文本的公共前缀长度部分放进同一个矩阵，0 表示补齐
+    overlap = np.minimum(len_out, len_target)
+    width = int(overlap.max()) if count else 0
+    a = np.zeros((count, width), dtype=np.uint32)
+    b = np.zeros((count, width), dtype=np.uint32)
+    for i, (out, target) in enumerate(zip(outputs, targets)):
+        n = overlap[i]
+        if n:
+            a[i, :n] = _codepoints(out[:n])
+            b[i, :n] = _codepoints(target[:n])
+    valid = np.arange(width)[None, :] < overlap[:, None]
+    char_match = np.count_nonzero((a == b) & valid, axis=1)
+
+    lcs = np.array([lcs_length(out, target) if out else 0 for out, target in zip(outputs, targets)], dtype=np.int64)
+
+    total = np.maximum(np.maximum(len_out, len_target), 1)
+    score = 0.4 * char_match / total + 0.4 * lcs / total - 0.2 * np.abs(len_out - len_target) / total
+    losses = np.clip(1.0 - score, 0.0, 1.0)
+    # 空输出的 loss 固定为 1
+    losses[len_out == 0] = 1.0
+    return losses
+
+
+def _legacy_loss(output_text, target_text):
+    if not output_text:
+        return 1.0
+    char_match = sum(1 for a, b in zip(output_text, target_text) if a == b)
+    return _combine(char_match, lcs_length_dp(output_text, target_text), len(output_text), len(target_text))
+
+
+def _random_text(rng, length):
+    # 常用汉字加标点，字符重复率接近真实回答
+    alphabet = [chr(c) for c in range(0x4E00, 0x4E00 + 400)] + list("，。！？、")
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def benchmark(length, pairs, seed=0):
+    rng = random.Random(seed)
+    targets = [_random_text(rng, length) for _ in range(pairs)]
+    # 输出在目标基础上做一些删改，和真实生成结果类似
+    outputs = []
+    for t in targets:
+        chars = [c for c in t if rng.random() > 0.2]
+        for _ in range(length // 10):
+            chars.insert(rng.randrange(len(chars) + 1), rng.choice(t))
+        outputs.append("".join(chars))
+
+    start = time.perf_counter()
+    legacy = [_legacy_loss(o, t) for o, t in zip(outputs, targets)]
+    t_legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [calculate_loss(o, t) for o, t in zip(outputs, targets)]
+    t_fast = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = calculate_losses(outputs, targets)
+    t_batch = time.perf_counter() - start
+
+    same = np.allclose(legacy, fast) and np.allclose(legacy, batch)
+    print(f"{pairs} 对文本，每条约 {length} 字")
+    print(f"  原实现 (动态规划):   {t_legacy:8.3f}s  ({t_legacy / pairs * 1000:.1f} ms/对)")
+    print(f"  位并行:              {t_fast:8.3f}s  ({t_fast / pairs * 1000:.1f} ms/对, {t_legacy / t_fast:.0f}x)")
+    print(f"  批量 (numpy):        {t_batch:8.3f}s  ({t_batch / pairs * 1000:.1f} ms/对, {t_legacy / t_batch:.0f}x)")
+    print(f"  结果一致: {same}")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calculate_loss 基准测试：位并行 LCS 对比原来的动态规划")
+    parser.add_argument("--length", type=int, default=2000, help="每条文本的字符数")
+    parser.add_argument("--pairs", type=int, default=10, help="文本对数")
+    args = parser.parse_args()
+    if not benchmark(args.length, args.pairs):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@ from transformers import (
 from datasets import load_dataset
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 import torch
+import os
+from packing import load_packing_config, build_packed_dataset, check_attention, PackedDataCollator
+from dataset_cache import cache_key, file_hash, tokenizer_hash, load_or_build, preprocessing_workers
 
 # 配置参数
 MODEL_PATH = "E:/R1/TheBloke/Llama-2-7B-Chat-GGUF"
@@ -18,6 +21,13 @@ GRADIENT_ACCUMULATION_STEPS = 4
 LEARNING_RATE = 2e-4
 TRAIN_STEPS = 1000
 OUTPUT_DIR = "outputs"
+MAX_LENGTH = 512
+DATA_PATH = "data/train.json"
+PROMPT_TEMPLATE = "### 指令：{instruction}\n### 输入：{input}\n### 响应：{output}"
+# 序列打包开关和预处理进程数 (train_config.yaml 中的 packing / packing_mask / preprocessing_num_workers)
+TRAIN_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_config.yaml")
+PACKING = load_packing_config(TRAIN_CONFIG_PATH)
+NUM_PROC = preprocessing_workers(TRAIN_CONFIG_PATH)
 
 def create_and_prepare_model():
     # 加载基础模型和分词器
@@ -46,14 +56,14 @@ def create_and_prepare_model():
     
     return model, tokenizer
 
-def prepare_dataset(tokenizer):
+def build_dataset(tokenizer):
     # 加载数据集
-    dataset = load_dataset("json", data_files="data/train.json")
+    dataset = load_dataset("json", data_files=DATA_PATH)
     
     def preprocess_function(examples):
         # 将指令和输出组合成完整的提示
         prompts = [
-            f"### 指令：{instruction}\n### 输入：{input_text}\n### 响应：{output}"
+            PROMPT_TEMPLATE.format(instruction=instruction, input=input_text, output=output)
             for instruction, input_text, output in zip(
                 examples["instruction"],
                 examples["input"],
@@ -61,27 +71,43 @@ def prepare_dataset(tokenizer):
             )
         ]
         
-        # 对文本进行编码
+        # 对文本进行编码 (打包时不做 padding)
         tokenized = tokenizer(
             prompts,
             truncation=True,
-            max_length=512,
-            padding="max_length"
+            max_length=MAX_LENGTH,
+            padding=False if PACKING["packing"] else "max_length"
         )
         return tokenized
 
-    # 处理数据集
+    # 处理数据集 (多进程分词)
     tokenized_dataset = dataset["train"].map(
         preprocess_function,
         batched=True,
+        num_proc=NUM_PROC if NUM_PROC > 1 else None,
         remove_columns=dataset["train"].column_names
     )
+
+    if PACKING["packing"]:
+        tokenized_dataset = build_packed_dataset(tokenized_dataset, MAX_LENGTH)
     
     return tokenized_dataset
 
+def prepare_dataset(tokenizer):
+    # 数据、分词器或预处理参数不变时直接读取磁盘缓存
+    key = cache_key(
+        data=file_hash(DATA_PATH),
+        tokenizer=tokenizer_hash(tokenizer),
+        template=PROMPT_TEMPLATE,
+        max_length=MAX_LENGTH,
+        packing=PACKING,
+    )
+    return load_or_build(key, lambda: build_dataset(tokenizer))
+
 def train():
     # 创建并准备模型
     model, tokenizer = create_and_prepare_model()
+    check_attention(model, PACKING)
     
     # 准备数据集
     train_dataset = prepare_dataset(tokenizer)
@@ -101,10 +127,14 @@ def train():
     )
     
     # 创建数据收集器
-    data_collator = DataCollatorForLanguageModeling(
-        tokenizer=tokenizer,
-        mlm=False
-    )
+    if PACKING["packing"]:
+        # 掩码要和注意力分数同一精度 (模型以 float16 加载)
+        data_collator = PackedDataCollator(tokenizer.pad_token_id, PACKING["packing_mask"], mask_dtype=model.dtype)
+    else:
+        data_collator = DataCollatorForLanguageModeling(
+            tokenizer=tokenizer,
+            mlm=False
+        )
     
     # 创建训练器
     trainer = Trainer(
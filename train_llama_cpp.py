@@ -7,6 +7,7 @@ from tqdm import tqdm
 import torch
 import numpy as np
 from typing import List, Dict, Any
+from text_metrics import calculate_loss
 
 # 配置参数
 MODEL_PATH = "e:/AI/models/Llama-3-8B-Instruct-Q4_K_M.gguf"
@@ -47,37 +48,6 @@ def get_learning_rate(current_step, total_steps):
         progress = (current_step - warmup_steps) / (total_steps - warmup_steps)
         return MIN_LR + 0.5 * (INITIAL_LR - MIN_LR) * (1 + math.cos(math.pi * progress))
 
-def calculate_loss(output_text, target_text):
-    """改进的loss计算方法"""
-    if not output_text:
-        return 1.0
-    
-    # 计算最长公共子序列
-    def lcs_length(text1, text2):
-        m, n = len(text1), len(text2)
-        dp = [[0] * (n + 1) for _ in range(m + 1)]
-        for i in range(1, m + 1):
-            for j in range(1, n + 1):
-                if text1[i-1] == text2[j-1]:
-                    dp[i][j] = dp[i-1][j-1] + 1
-                else:
-                    dp[i][j] = max(dp[i-1][j], dp[i][j-1])
-        return dp[m][n]
-    
-    # 结合字符匹配度和最长公共子序列
-    char_match = sum(1 for a, b in zip(output_text, target_text) if a == b)
-    lcs = lcs_length(output_text, target_text)
-    total_length = max(len(output_text), len(target_text))
-    
-    # 综合考虑多个指标
-    char_match_ratio = char_match / total_length if total_length > 0 else 0
-    lcs_ratio = lcs / total_length if total_length > 0 else 0
-    length_penalty = abs(len(output_text) - len(target_text)) / total_length
-    
-    # 计算加权loss
-    loss = 1.0 - (0.4 * char_match_ratio + 0.4 * lcs_ratio - 0.2 * length_penalty)
-    return min(max(loss, 0.0), 1.0)  # 确保loss在[0,1]范围内
-
 def apply_data_augmentation(text):
     """简单的数据增强方法"""
     # 随机删除一些空格
@@ -7,6 +7,9 @@ from tqdm import tqdm
 import torch
 import numpy as np
 from typing import List, Dict, Any
+from text_metrics import calculate_loss
+from llama_eval import EVAL_N_BATCH, evaluate_nll
+from llama_prefix_cache import PrefixStateCache
 
 # 配置参数
 MODEL_PATH = "e:/AI/models/Llama-3-8B-Instruct-Q4_K_M.gguf"
@@ -19,20 +22,26 @@ WARMUP_RATIO = 0.1  # 预热阶段比例
 ACCUMULATION_STEPS = 4  # 梯度累积步数
 EVAL_STEPS = 20  # 每训练多少步进行一次评估
 OUTPUT_DIR = "outputs/lora-test-optimized"
+EVAL_MODE = "nll"  # nll: 一次前向计算目标文本的对数似然；generate: 生成后比较字符串
 
 def load_training_data(file_path="data/train.json"):
     with open(file_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     return data
 
+SYSTEM_PROMPT = "You are a helpful assistant."
+# 所有提示共用的开头，其 KV 状态由 PrefixStateCache 缓存
+PROMPT_PREFIX = (
+    f"<|start_header_id|>system<|end_header_id|>\n\n{SYSTEM_PROMPT}<|eot_id|>"
+    f"<|start_header_id|>user<|end_header_id|>\n\n"
+)
+
 def format_prompt(instruction, input_text=""):
     """格式化提示模板 - Llama 3"""
-    system_prompt = "You are a helpful assistant."
     user_content = f"{instruction}\n{input_text}" if input_text else instruction
     
     return (
-        f"<|start_header_id|>system<|end_header_id|>\n\n{system_prompt}<|eot_id|>"
-        f"<|start_header_id|>user<|end_header_id|>\n\n{user_content}<|eot_id|>"
+        f"{PROMPT_PREFIX}{user_content}<|eot_id|>"
         f"<|start_header_id|>assistant<|end_header_id|>\n\n"
     )
 
@@ -47,37 +56,6 @@ def get_learning_rate(current_step, total_steps):
         progress = (current_step - warmup_steps) / (total_steps - warmup_steps)
         return MIN_LR + 0.5 * (INITIAL_LR - MIN_LR) * (1 + math.cos(math.pi * progress))
 
-def calculate_loss(output_text, target_text):
-    """改进的loss计算方法"""
-    if not output_text:
-        return 1.0
-    
-    # 计算最长公共子序列
-    def lcs_length(text1, text2):
-        m, n = len(text1), len(text2)
-        dp = [[0] * (n + 1) for _ in range(m + 1)]
-        for i in range(1, m + 1):
-            for j in range(1, n + 1):
-                if text1[i-1] == text2[j-1]:
-                    dp[i][j] = dp[i-1][j-1] + 1
-                else:
-                    dp[i][j] = max(dp[i-1][j], dp[i][j-1])
-        return dp[m][n]
-    
-    # 结合字符匹配度和最长公共子序列
-    char_match = sum(1 for a, b in zip(output_text, target_text) if a == b)
-    lcs = lcs_length(output_text, target_text)
-    total_length = max(len(output_text), len(target_text))
-    
-    # 综合考虑多个指标
-    char_match_ratio = char_match / total_length if total_length > 0 else 0
-    lcs_ratio = lcs / total_length if total_length > 0 else 0
-    length_penalty = abs(len(output_text) - len(target_text)) / total_length
-    
-    # 计算加权loss
-    loss = 1.0 - (0.4 * char_match_ratio + 0.4 * lcs_ratio - 0.2 * length_penalty)
-    return min(max(loss, 0.0), 1.0)  # 确保loss在[0,1]范围内
-
 def apply_data_augmentation(text):
     """简单的数据增强方法"""
     # 随机删除一些空格
@@ -96,25 +74,34 @@ def apply_data_augmentation(text):
 
 def initialize_model():
     """初始化模型"""
+    use_nll = EVAL_MODE == "nll"
     return Llama(
         model_path=MODEL_PATH,
         n_ctx=4096,  # 增加到最大上下文窗口
-        n_batch=BATCH_SIZE,  # 批处理大小
+        n_batch=max(BATCH_SIZE, EVAL_N_BATCH) if use_nll else BATCH_SIZE,  # 批处理大小 (nll 评估一次 prefill 整条样本)
         n_threads=6,  # 保持原始线程数
         n_gpu_layers=-1,  # 使用所有可用的GPU层
         verbose=True,  # 启用详细日志
-        embedding=True,  # 使用嵌入模式
+        logits_all=use_nll,  # nll 评估需要每个位置的 logits
+        embedding=not use_nll,  # 嵌入模式下不输出 logits
         seed=42  # 保持原始随机种子
     )
 
-def evaluate_model(llm, eval_data):
-    """评估模型性能"""
+def evaluate_model(llm, eval_data, eval_mode=EVAL_MODE, prefix_cache=None):
+    """评估模型性能 (nll 模式返回目标文本每个 token 的平均负对数似然)"""
+    if eval_mode == "nll":
+        mean_nll, perplexity = evaluate_nll(llm, eval_data, format_prompt, prefix_cache, PROMPT_PREFIX)
+        print(f"验证集 NLL: {mean_nll:.4f}，困惑度: {perplexity:.2f}")
+        return mean_nll
+
     total_loss = 0
     for item in eval_data:
         prompt = format_prompt(item["instruction"], item["input"])
         target = item["output"]
         
         try:
+            if prefix_cache is not None:
+                prefix_cache.activate(PROMPT_PREFIX)
             completion = llm(
                 prompt,
                 max_tokens=len(target) + 50,  # 给一些余量
@@ -142,6 +129,7 @@ def fine_tune():
     # 初始化模型
     print("正在加载模型...")
     llm = initialize_model()
+    prefix_cache = PrefixStateCache(llm)
     
     # 加载训练数据
     print("正在加载训练数据...")
@@ -208,8 +196,9 @@ def fine_tune():
                 
                 # 定期评估和保存
                 if current_step % EVAL_STEPS == 0:
-                    eval_loss = evaluate_model(llm, validation_data)
+                    eval_loss = evaluate_model(llm, validation_data, prefix_cache=prefix_cache)
                     print(f"\n步骤 {current_step} 评估损失: {eval_loss:.4f}")
+                    print(prefix_cache.summary())
                     
                     # 如果是最佳模型，保存检查点
                     if eval_loss < best_eval_loss:
@@ -221,6 +210,7 @@ def fine_tune():
                     # 测试生成效果
                     test_prompt = "请解释一下LoRA技术的优点"
                     print("\n测试生成：")
+                    prefix_cache.activate(PROMPT_PREFIX)
                     test_result = llm(
                         format_prompt(test_prompt),
                         max_tokens=100,
@@ -242,7 +232,7 @@ def fine_tune():
         print(f"\nEpoch {epoch+1} 平均损失: {avg_loss:.4f}")
         
         # epoch结束时的评估
-        epoch_eval_loss = evaluate_model(llm, validation_data)
+        epoch_eval_loss = evaluate_model(llm, validation_data, prefix_cache=prefix_cache)
         print(f"Epoch {epoch+1} 验证集损失: {epoch_eval_loss:.4f}")
     
     print(f"\n训练完成！最佳验证集损失: {best_eval_loss:.4f}")
@@ -13,6 +13,8 @@ from transformers import (
     BitsAndBytesConfig
 )
 from peft import LoraConfig, get_peft_model, TaskType, prepare_model_for_kbit_training
+from packing import load_packing_config, build_packed_dataset, check_attention, PackedDataCollator
+from dataset_cache import cache_key, file_hash, tokenizer_hash, load_or_build, preprocessing_workers
 
 # Set HF Mirror for connection issues
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
@@ -44,11 +46,13 @@ CYCLES = 5          # 循环次数 (总共跑几轮)
 START_CYCLE = 2     # 从第几轮开始 (如果之前中断了，可以修改这个数字续借)
 EPOCHS_PER_CYCLE = 3 # 每次跑 3 个 Epoch
 WAIT_SECONDS = 30    # 每次休息 30 秒 (增加休息时间以缓解过热/显存碎片)
+MAX_LENGTH = 512     # 512 is safe for 8GB VRAM. 1024 might push it.
+# 序列打包开关和预处理进程数在 train_config.yaml 中 (packing / packing_mask / preprocessing_num_workers)
+TRAIN_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_config.yaml")
+PACKING = load_packing_config(TRAIN_CONFIG_PATH)
+NUM_PROC = preprocessing_workers(TRAIN_CONFIG_PATH)
 
-def main():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data_path = os.path.join(base_dir, "data", "train.json")
-    
+def load_chat_dataset(data_path):
     print(f"Loading data from {data_path}...")
     with open(data_path, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -71,7 +75,34 @@ def main():
         ]
         formatted_data.append({"messages": messages})
         
-    dataset = Dataset.from_list(formatted_data)
+    return Dataset.from_list(formatted_data)
+
+def build_tokenized_dataset(data_path, tokenizer):
+    # Apply the chat template and tokenize in one batched pass over NUM_PROC processes
+    def format_and_tokenize(batch):
+        texts = [tokenizer.apply_chat_template(messages, tokenize=False) for messages in batch["messages"]]
+        # packing concatenates examples afterwards, so no padding here
+        return tokenizer(
+            texts,
+            truncation=True,
+            max_length=MAX_LENGTH,
+            padding=False if PACKING["packing"] else "max_length"
+        )
+
+    dataset = load_chat_dataset(data_path)
+    tokenized_dataset = dataset.map(
+        format_and_tokenize,
+        batched=True,
+        num_proc=NUM_PROC if NUM_PROC > 1 else None,
+        remove_columns=dataset.column_names
+    )
+    if PACKING["packing"]:
+        tokenized_dataset = build_packed_dataset(tokenized_dataset, MAX_LENGTH)
+    return tokenized_dataset
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    data_path = os.path.join(base_dir, "data", "train.json")
     
     print(f"Loading model: {MODEL_ID}...")
     
@@ -114,24 +145,23 @@ def main():
     
     model = get_peft_model(model, peft_config)
     model.print_trainable_parameters()
-    
-    # Formatting function
-    def format_chat(example):
-        text = tokenizer.apply_chat_template(example["messages"], tokenize=False)
-        return {"text": text}
-    
-    dataset = dataset.map(format_chat)
-    
-    # Tokenize
-    def tokenize(example):
-        return tokenizer(
-            example["text"],
-            truncation=True,
-            max_length=512, # 512 is safe for 8GB VRAM. 1024 might push it.
-            padding="max_length"
-        )
-        
-    tokenized_dataset = dataset.map(tokenize, batched=True)
+    check_attention(model, PACKING)
+    
+    # Pretokenized dataset, cached on disk until the data, tokenizer or preprocessing settings change
+    key = cache_key(
+        data=file_hash(data_path),
+        tokenizer=tokenizer_hash(tokenizer),
+        system_prompt=SYSTEM_PROMPT,
+        template="apply_chat_template",
+        max_length=MAX_LENGTH,
+        packing=PACKING,
+    )
+    tokenized_dataset = load_or_build(key, lambda: build_tokenized_dataset(data_path, tokenizer))
+
+    if PACKING["packing"]:
+        data_collator = PackedDataCollator(tokenizer.pad_token_id, PACKING["packing_mask"], mask_dtype=model.dtype)
+    else:
+        data_collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
     
     # Training Arguments
     training_args = TrainingArguments(
@@ -152,7 +182,7 @@ def main():
         model=model,
         args=training_args,
         train_dataset=tokenized_dataset,
-        data_collator=DataCollatorForLanguageModeling(tokenizer, mlm=False),
+        data_collator=data_collator,
     )
     
     print(f"🚀 Starting Cyclic Training: {CYCLES} Cycles x {EPOCHS_PER_CYCLE} Epochs")
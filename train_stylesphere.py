@@ -6,6 +6,8 @@ from llama_cpp import Llama
 from tqdm import tqdm
 import yaml
 from typing import List, Dict, Any
+from text_metrics import calculate_loss
+from llama_eval import EVAL_MODES, EVAL_N_BATCH, evaluate_nll
 
 def load_config(config_path="train_stylesphere.yaml"):
     """加载配置文件"""
@@ -15,6 +17,10 @@ def load_config(config_path="train_stylesphere.yaml"):
 
 # 加载StyleSphere配置
 CONFIG = load_config()
+# 评估方式：nll (一次前向计算目标文本的对数似然) 或 generate (生成后比较字符串)
+EVAL_MODE = CONFIG.get('eval_mode', 'generate')
+if EVAL_MODE not in EVAL_MODES:
+    raise ValueError(f"未知的 eval_mode: {EVAL_MODE}")
 
 def load_training_data(file_path):
     """加载训练数据"""
@@ -42,37 +48,6 @@ def get_learning_rate(current_step, total_steps, config):
         progress = (current_step - warmup_steps) / (total_steps - warmup_steps)
         return min_lr + 0.5 * (max_lr - min_lr) * (1 + math.cos(math.pi * progress))
 
-def calculate_loss(output_text, target_text):
-    """计算生成文本与目标文本之间的损失"""
-    if not output_text:
-        return 1.0
-    
-    # 计算最长公共子序列
-    def lcs_length(text1, text2):
-        m, n = len(text1), len(text2)
-        dp = [[0] * (n + 1) for _ in range(m + 1)]
-        for i in range(1, m + 1):
-            for j in range(1, n + 1):
-                if text1[i-1] == text2[j-1]:
-                    dp[i][j] = dp[i-1][j-1] + 1
-                else:
-                    dp[i][j] = max(dp[i-1][j], dp[i][j-1])
-        return dp[m][n]
-    
-    # 结合字符匹配度和最长公共子序列
-    char_match = sum(1 for a, b in zip(output_text, target_text) if a == b)
-    lcs = lcs_length(output_text, target_text)
-    total_length = max(len(output_text), len(target_text))
-    
-    # 综合考虑多个指标
-    char_match_ratio = char_match / total_length if total_length > 0 else 0
-    lcs_ratio = lcs / total_length if total_length > 0 else 0
-    length_penalty = abs(len(output_text) - len(target_text)) / total_length
-    
-    # 计算加权loss
-    loss = 1.0 - (0.4 * char_match_ratio + 0.4 * lcs_ratio - 0.2 * length_penalty)
-    return min(max(loss, 0.0), 1.0)
-
 def apply_data_augmentation(text):
     """StyleSphere专用的数据增强方法"""
     # 添加时尚相关的表情符号
@@ -90,19 +65,29 @@ def apply_data_augmentation(text):
 def initialize_model(config):
     """初始化模型"""
     model_params = config.get('model_params', {})
+    use_nll = EVAL_MODE == 'nll'
+    n_batch = config.get('per_device_train_batch_size', 2)
     return Llama(
         model_path=config['model_name_or_path'],
         n_ctx=model_params.get('n_ctx', config.get('max_source_length', 2048)),
-        n_batch=config.get('per_device_train_batch_size', 2),
+        # nll 评估一次 prefill 整条样本，批大小决定了它有多快
+        n_batch=max(n_batch, EVAL_N_BATCH) if use_nll else n_batch,
         n_threads=6,
         n_gpu_layers=model_params.get('n_gpu_layers', 0),  # 从 model_params 读取 n_gpu_layers
         verbose=True,
-        embedding=True,
+        # nll 评估需要每个位置的 logits，嵌入模式下不输出 logits
+        logits_all=use_nll,
+        embedding=not use_nll,
         seed=42
     )
 
-def evaluate_model(llm, eval_data):
-    """评估模型性能"""
+def evaluate_model(llm, eval_data, eval_mode=EVAL_MODE):
+    """评估模型性能 (nll 模式返回目标文本每个 token 的平均负对数似然)"""
+    if eval_mode == 'nll':
+        mean_nll, perplexity = evaluate_nll(llm, eval_data, format_prompt)
+        print(f"验证集 NLL: {mean_nll:.4f}，困惑度: {perplexity:.2f}")
+        return mean_nll
+
     total_loss = 0
     for item in eval_data:
         prompt = format_prompt(item["instruction"], item["input"])
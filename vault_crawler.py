@@ -0,0 +1,136 @@
+"""
+遍历 vault，用进程池并行读取和解析笔记
+
+ObsidianLoader 重建索引时要读取、解码、去掉 frontmatter、分词每一篇笔记，原来都在主进程里逐篇完成，
+CPU 几乎全花在分词上，几万篇笔记的首次建索引只能用满一个核。这里：
+  - iter_notes：用 os.scandir 遍历 (DirEntry 自带文件类型，不用对每一项再 stat 一次判断是不是目录)，
+    边遍历边产出 (相对路径, mtime_ns, 大小)；
+  - crawl：把笔记按 BATCH_NOTES 篇一批交给进程池解析，在途的批次不超过 worker 数 × MAX_PENDING_PER_WORKER，
+    按提交顺序逐批产出结果。调用方 (索引构建) 边收边处理，内存中只有少数几批笔记的原文，
+    不会因为 vault 大小而增长；
+  - 笔记少于 PARALLEL_MIN_NOTES 篇 (增量更新通常只有几篇) 时在当前进程解析，省去启动进程的开销
+    (Windows 上每个子进程要重新 import numpy 等模块，约 1 秒)。
+解析函数由调用方提供，必须是模块顶层函数 (子进程按名字导入)。CrawlStats 统计 篇/s 和 MB/s。
+
+命令行：python vault_crawler.py <vault> [--workers N]  比较单进程和多进程建索引时的解析速度
+"""
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# 每批交给子进程的笔记数：太小时进程间通信开销明显，太大时负载不均衡
+BATCH_NOTES = 64
+# 每个 worker 最多有这么多批在途 (已提交未取走)，限制内存占用
+MAX_PENDING_PER_WORKER = 2
+# 少于这么多篇笔记时不启动进程池
+PARALLEL_MIN_NOTES = 1000
+
+
+def _hidden(name):
+    return name.startswith(".")
+
+
+def iter_notes(root, skip_dir=_hidden, suffix=".md"):
+    """遍历 root 下的笔记，产出 (相对路径 (/ 分隔), mtime_ns, 大小)；skip_dir(目录名) 为真的目录不进入"""
+    stack = [(root, "")]
+    while stack:
+        path, prefix = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not skip_dir(entry.name):
+                        stack.append((entry.path, prefix + entry.name + "/"))
+                elif entry.name.endswith(suffix):
+                    st = entry.stat()
+                    yield prefix + entry.name, st.st_mtime_ns, st.st_size
+            except OSError:
+                continue  # 遍历期间被删除
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+class CrawlStats:
+    """读取的文件数、字节数和耗时"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.workers = 1
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, files, n_bytes):
+        self.files += files
+        self.bytes += n_bytes
+        self.elapsed = time.perf_counter() - self.start
+
+    @property
+    def files_per_second(self):
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.bytes / 2 ** 20 / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.files} 个文件，{self.bytes / 2 ** 20:.1f} MB，{self.elapsed:.2f}s "
+                f"({self.files_per_second:.0f} 篇/s，{self.mb_per_second:.1f} MB/s，{self.workers} 个进程)")
+
+
+def crawl(parse_batch, context, items, workers=None, batch_size=BATCH_NOTES, stats=None):
+    """对 items 分批调用 parse_batch(context, batch)，按原顺序逐个产出解析结果
+
+    parse_batch 返回 (结果列表, 读取的字节数)。workers 为 None 时取 CPU 核数。
+    """
+    stats = stats if stats is not None else CrawlStats()
+    workers = default_workers() if workers is None else workers
+    batches = (items[i:i + batch_size] for i in range(0, len(items), batch_size))
+    if workers <= 1 or len(items) < PARALLEL_MIN_NOTES:
+        for batch in batches:
+            results, n_bytes = parse_batch(context, batch)
+            stats.add(len(batch), n_bytes)
+            yield from results
+        return
+
+    stats.workers = workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque((pool.submit(parse_batch, context, batch), len(batch))
+                        for batch in islice(batches, workers * MAX_PENDING_PER_WORKER))
+        while pending:
+            future, n_files = pending.popleft()
+            results, n_bytes = future.result()
+            # 取走一批再提交一批，在途的批次数保持不变
+            for batch in islice(batches, 1):
+                pending.append((pool.submit(parse_batch, context, batch), len(batch)))
+            stats.add(n_files, n_bytes)
+            yield from results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较单进程和多进程解析 vault 的速度")
+    parser.add_argument("vault", help="vault 路径")
+    parser.add_argument("--workers", type=int, action="append", default=[],
+                        help="进程数 (可重复，默认 1 和 CPU 核数)")
+    args = parser.parse_args()
+    from obsidian_loader import _index_batch, scan_vault
+
+    start = time.perf_counter()
+    notes = list(scan_vault(args.vault).items())
+    print(f"遍历：{len(notes)} 篇笔记，{(time.perf_counter() - start) * 1000:.0f} ms")
+    for workers in args.workers or sorted({1, default_workers()}):
+        stats = CrawlStats()
+        n_docs = sum(1 for _ in crawl(_index_batch, args.vault, notes, workers, stats=stats))
+        print(f"{workers} 个进程：解析 {n_docs} 篇，{stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Watch training outputs and convert every new LoRA checkpoint to GGUF
+#
+# train_python_real.py saves a PEFT adapter into `checkpoint-*` every epoch and into
+# the MODEL_ZOO output_dir after every cycle. This daemon polls those directories
+# and, as soon as an adapter has been completely written, produces
+# `<adapter dir>/<adapter dir name>-q8_0.gguf`, which chat.py picks up directly.
+#
+# No merged model is ever written to disk: the base checkpoint is indexed with
+# convert_hf_to_gguf.py and every adapted weight is replaced by the lazy expression
+# W + scale * B @ A. Tensors that no adapter touches (embeddings, output, norms) are
+# identical for every checkpoint, so their quantized form is cached on first use and
+# memory-mapped for the next checkpoints; only the adapted tensors are recomputed.
+#
+#   python watch_checkpoints.py                         # every MODEL_ZOO entry
+#   python watch_checkpoints.py --models llama3-8b --once
+#   python watch_checkpoints.py --base llama3-8b=E:/models/llama-3-8b-Instruct
+#   python watch_checkpoints.py --selftest                # convert a tiny synthetic LoRA checkpoint
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import torch
+
+import convert_hf_to_gguf as hf
+from convert_hf_to_gguf import LazyTorchTensor, ModelBase, ModelType, gguf
+from convert_zoo_to_gguf import fingerprint_sources
+
+logger = logging.getLogger("watch-checkpoints")
+
+ADAPTER_FILES = ("adapter_model.safetensors", "adapter_model.bin")
+CACHE_DIR_NAME = ".gguf_base_cache"
+# files of a base model needed for the conversion (no original/ consolidated weights)
+BASE_PATTERNS = ["*.json", "*.safetensors", "tokenizer.model", "*.txt"]
+
+
+@dataclass
+class LoraAdapter:
+    path: Path
+    # base tensor name -> (lora_A, lora_B) generators
+    pairs: dict[str, tuple[Callable[[], torch.Tensor], Callable[[], torch.Tensor]]]
+    scale: float
+
+    @classmethod
+    def load(cls, path: Path) -> LoraAdapter:
+        with open(path / "adapter_config.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+        r = config["r"]
+        alpha = config.get("lora_alpha", r)
+        scale = alpha / math.sqrt(r) if config.get("use_rslora") else alpha / r
+
+        tensors: dict[str, Callable[[], torch.Tensor]] = {}
+        if (path / ADAPTER_FILES[0]).is_file():
+            with gguf.utility.SafetensorsLocal(path / ADAPTER_FILES[0]) as st:
+                for name in st.keys():
+                    tensors[name] = lambda t=st[name]: LazyTorchTensor.from_local_tensor(t)
+        else:
+            state = torch.load(str(path / ADAPTER_FILES[1]), map_location="cpu", weights_only=True)
+            for name, t in state.items():
+                tensors[name] = lambda t=t: LazyTorchTensor.from_eager(t)
+
+        pairs = {}
+        for name, gen_a in tensors.items():
+            if ".lora_A." not in name:
+                continue
+            gen_b = tensors.get(name.replace(".lora_A.", ".lora_B."))
+            if gen_b is None:
+                raise ValueError(f"{path}: {name} has no matching lora_B")
+            # base_model.model.model.layers.0.self_attn.q_proj.lora_A.weight -> model.layers.0.self_attn.q_proj.weight
+            base_name = name.removeprefix("base_model.model.").replace(".lora_A", "")
+            pairs[base_name] = (gen_a, gen_b)
+        if not pairs:
+            raise ValueError(f"{path}: no LoRA weights found")
+        return cls(path=path, pairs=pairs, scale=scale)
+
+
+class BaseTensorCache:
+    """Quantized output tensors of the base model, one .npy per GGUF tensor name.
+
+    The cache is tied to the base checkpoint, the output type and the converter
+    version, and is cleared automatically when any of them changes.
+    """
+
+    def __init__(self, root: Path, fingerprint: dict[str, Any]):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        stamp = root / "base.json"
+        if stamp.is_file():
+            with open(stamp, "r", encoding="utf-8") as f:
+                if json.load(f) != fingerprint:
+                    logger.info(f"Base model changed, clearing {root}")
+                    shutil.rmtree(root)
+        if not stamp.is_file():
+            root.mkdir(parents=True, exist_ok=True)
+            with open(stamp, "w", encoding="utf-8") as f:
+                json.dump(fingerprint, f, indent=2)
+
+    def _path(self, new_name: str, qtype: gguf.GGMLQuantizationType) -> Path:
+        return self.root / f"{new_name}.{qtype.name}.npy"
+
+    def get(self, new_name: str, qtype: gguf.GGMLQuantizationType) -> np.ndarray | None:
+        path = self._path(new_name, qtype)
+        if not path.is_file():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.load(path, mmap_mode="r")
+
+    def store(self, new_name: str, qtype: gguf.GGMLQuantizationType, data: np.ndarray) -> np.ndarray:
+        # lazy tensors are stored when the writer evaluates them, not before
+        if isinstance(data, gguf.LazyNumpyTensor):
+            return gguf.LazyNumpyTensor._wrap_fn(lambda d: self.store(new_name, qtype, d), meta_noop=True)(data)
+        path = self._path(new_name, qtype)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, path)
+        return data
+
+
+def make_merged_model_class(model_class: type[ModelBase], adapter: LoraAdapter, cache: BaseTensorCache) -> type[ModelBase]:
+    class MergedModel(model_class):  # type: ignore[valid-type, misc]
+        # TextModel.__init_subclass__ requires every subclass to declare its architecture
+        model_arch = model_class.model_arch
+
+        def index_tensors(self, remote_hf_model_id: str | None = None) -> dict[str, Callable[[], torch.Tensor]]:
+            tensors = super().index_tensors(remote_hf_model_id)
+            missing = sorted(set(adapter.pairs) - set(tensors))
+            if missing:
+                raise ValueError(f"{adapter.path}: adapter weights without a base tensor: {missing[:4]}")
+            for name, (gen_a, gen_b) in adapter.pairs.items():
+                tensors[name] = lambda w=tensors[name], a=gen_a, b=gen_b: \
+                    w().to(torch.float32) + adapter.scale * (b().to(torch.float32) @ a().to(torch.float32))
+            return tensors
+
+        def quantize_tensor(self, name: str, new_name: str, data: np.ndarray, data_qtype: gguf.GGMLQuantizationType) -> np.ndarray:
+            if name in adapter.pairs:
+                return super().quantize_tensor(name, new_name, data, data_qtype)
+            cached = cache.get(new_name, data_qtype)
+            if cached is not None:
+                return cached
+            return cache.store(new_name, data_qtype, super().quantize_tensor(name, new_name, data, data_qtype))
+
+    MergedModel.__name__ = f"Merged{model_class.__name__}"
+    return MergedModel
+
+
+def resolve_base_dir(model_id: str) -> Path:
+    if Path(model_id).is_dir():
+        return Path(model_id)
+    from huggingface_hub import snapshot_download
+    return Path(snapshot_download(repo_id=model_id, allow_patterns=BASE_PATTERNS))
+
+
+def adapter_dirs(output_dir: Path) -> list[Path]:
+    candidates = [output_dir] + sorted(output_dir.glob("checkpoint-*"))
+    return [d for d in candidates if (d / "adapter_config.json").is_file() and any((d / f).is_file() for f in ADAPTER_FILES)]
+
+
+def gguf_path(adapter_dir: Path, outtype: str) -> Path:
+    return adapter_dir / f"{adapter_dir.name}-{outtype}.gguf"
+
+
+def adapter_mtime(adapter_dir: Path) -> float:
+    return max((adapter_dir / f).stat().st_mtime for f in ("adapter_config.json", *ADAPTER_FILES) if (adapter_dir / f).is_file())
+
+
+def needs_conversion(adapter_dir: Path, outtype: str, settle: float) -> bool:
+    mtime = adapter_mtime(adapter_dir)
+    # the trainer may still be writing the checkpoint
+    if time.time() - mtime < settle:
+        return False
+    out = gguf_path(adapter_dir, outtype)
+    return not out.is_file() or out.stat().st_mtime < mtime
+
+
+def convert_adapter(adapter_dir: Path, base_dir: Path, outtype: str, cache: BaseTensorCache, threads: int | None,
+                    base_class: type[ModelBase] | None = None) -> Path:
+    adapter = LoraAdapter.load(adapter_dir)
+    hparams = ModelBase.load_hparams(base_dir, False)
+    if base_class is None:
+        base_class = hf.get_model_class(hparams, ModelType.TEXT)
+    model_class = make_merged_model_class(base_class, adapter, cache)
+    fname_out = gguf_path(adapter_dir, outtype)
+    # chat.py takes the first .gguf it finds, so never leave a partial one behind
+    tmp_out = fname_out.with_name(fname_out.name + ".tmp")
+    with torch.inference_mode():
+        model_instance = model_class(base_dir, hf.FTYPE_MAP[outtype], tmp_out, hparams=hparams,
+                                     model_name=adapter_dir.name, quant_threads=threads)
+        model_instance.write(progress=False)
+    os.replace(tmp_out, fname_out)
+    return fname_out
+
+
+# --- self-test with a tiny synthetic Llama and two LoRA checkpoints ---
+
+
+class _TinyLlamaModel(hf.LlamaModel):
+    model_arch = gguf.MODEL_ARCH.LLAMA
+
+    # the synthetic checkpoint has no tokenizer files
+    def set_vocab(self):
+        n_vocab = self.hparams["vocab_size"]
+        self.gguf_writer.add_tokenizer_model("gpt2")
+        self.gguf_writer.add_tokenizer_pre("default")
+        self.gguf_writer.add_token_list([f"<{i}>" for i in range(n_vocab)])
+        self.gguf_writer.add_token_types([gguf.TokenType.NORMAL] * n_vocab)
+
+
+def _write_safetensors(path: Path, tensors: dict[str, np.ndarray]):
+    header: dict[str, Any] = {}
+    offset = 0
+    for name, t in tensors.items():
+        header[name] = {"dtype": "F32", "shape": list(t.shape), "data_offsets": [offset, offset + t.nbytes]}
+        offset += t.nbytes
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for t in tensors.values():
+            f.write(np.ascontiguousarray(t, dtype="<f4").tobytes())
+
+
+def selftest():
+    n_embd, n_ff, n_head, n_head_kv, n_vocab, rank, alpha = 64, 128, 4, 2, 32, 4, 8
+    n_embd_kv = n_embd // n_head * n_head_kv
+    rng = np.random.default_rng(0)
+    tmp = Path(tempfile.mkdtemp(prefix="watch-checkpoints-"))
+    try:
+        base_dir = tmp / "base"
+        base_dir.mkdir()
+        with open(base_dir / "config.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "architectures": ["LlamaForCausalLM"], "model_type": "llama", "torch_dtype": "float32",
+                "hidden_size": n_embd, "intermediate_size": n_ff, "num_hidden_layers": 1,
+                "num_attention_heads": n_head, "num_key_value_heads": n_head_kv, "vocab_size": n_vocab,
+                "max_position_embeddings": 128, "rms_norm_eps": 1e-5, "rope_theta": 10000.0,
+            }, f)
+        shapes = {
+            "model.embed_tokens.weight": (n_vocab, n_embd),
+            "model.layers.0.input_layernorm.weight": (n_embd,),
+            "model.layers.0.self_attn.q_proj.weight": (n_embd, n_embd),
+            "model.layers.0.self_attn.k_proj.weight": (n_embd_kv, n_embd),
+            "model.layers.0.self_attn.v_proj.weight": (n_embd_kv, n_embd),
+            "model.layers.0.self_attn.o_proj.weight": (n_embd, n_embd),
+            "model.layers.0.post_attention_layernorm.weight": (n_embd,),
+            "model.layers.0.mlp.gate_proj.weight": (n_ff, n_embd),
+            "model.layers.0.mlp.up_proj.weight": (n_ff, n_embd),
+            "model.layers.0.mlp.down_proj.weight": (n_embd, n_ff),
+            "model.norm.weight": (n_embd,),
+            "lm_head.weight": (n_vocab, n_embd),
+        }
+        base = {name: rng.standard_normal(shape).astype(np.float32) for name, shape in shapes.items()}
+        _write_safetensors(base_dir / "model.safetensors", base)
+
+        targets = {"v_proj": ("model.layers.0.self_attn.v_proj.weight", "blk.0.attn_v.weight"),
+                   "o_proj": ("model.layers.0.self_attn.o_proj.weight", "blk.0.attn_output.weight")}
+        cache = BaseTensorCache(tmp / CACHE_DIR_NAME / "f32", {"selftest": 1})
+        for step in (1, 2):
+            adapter_dir = tmp / "output" / f"checkpoint-{step}"
+            adapter_dir.mkdir(parents=True)
+            with open(adapter_dir / "adapter_config.json", "w", encoding="utf-8") as f:
+                json.dump({"r": rank, "lora_alpha": alpha, "target_modules": list(targets)}, f)
+            lora: dict[str, np.ndarray] = {}
+            for base_name, _ in targets.values():
+                n_out, n_in = shapes[base_name]
+                prefix = "base_model.model." + base_name.removesuffix(".weight")
+                lora[f"{prefix}.lora_A.weight"] = rng.standard_normal((rank, n_in)).astype(np.float32)
+                lora[f"{prefix}.lora_B.weight"] = rng.standard_normal((n_out, rank)).astype(np.float32)
+            _write_safetensors(adapter_dir / ADAPTER_FILES[0], lora)
+
+            cache.hits = cache.misses = 0
+            out = convert_adapter(adapter_dir, base_dir, "f32", cache, threads=2, base_class=_TinyLlamaModel)
+            written = {t.name: np.asarray(t.data) for t in gguf.GGUFReader(out).tensors}
+            for base_name, gguf_name in targets.values():
+                prefix = "base_model.model." + base_name.removesuffix(".weight")
+                expected = base[base_name] + alpha / rank * (lora[f"{prefix}.lora_B.weight"] @ lora[f"{prefix}.lora_A.weight"])
+                np.testing.assert_allclose(written[gguf_name], expected, rtol=1e-5, atol=1e-5, err_msg=gguf_name)
+            np.testing.assert_array_equal(written["token_embd.weight"], base["model.embed_tokens.weight"])
+            n_cached = len(shapes) - len(targets)
+            expected_stats = (0, n_cached) if step == 1 else (n_cached, 0)
+            assert (cache.hits, cache.misses) == expected_stats, \
+                f"checkpoint-{step}: base cache {cache.hits} hits, {cache.misses} misses, expected {expected_stats}"
+            print(f"checkpoint-{step}: {len(written)} tensors, base cache {cache.hits} hits, {cache.misses} misses")
+        print("selftest OK")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert new LoRA checkpoints of the MODEL_ZOO to GGUF as they appear")
+    parser.add_argument("--models", nargs="*", help="MODEL_ZOO keys to watch (default: all)")
+    parser.add_argument("--base", action="append", default=[], metavar="KEY=DIR",
+                        help="local base model directory for a MODEL_ZOO key (default: the HF cache of its model_id)")
+    parser.add_argument("--outtype", choices=["q8_0", "f16", "bf16", "f32"], default="q8_0")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between scans")
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds an adapter must be unchanged before converting")
+    parser.add_argument("--threads", type=int, default=None, help="quantization threads (default: number of CPUs)")
+    parser.add_argument("--once", action="store_true", help="convert what is pending and exit")
+    parser.add_argument("--selftest", action="store_true", help="convert a tiny synthetic LoRA checkpoint and check the result")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    # the converter logs every tensor; one line per checkpoint is enough here
+    if not args.verbose:
+        hf.logger.setLevel(logging.WARNING)
+    if args.selftest:
+        selftest()
+        return
+
+    from model_config import MODEL_ZOO
+
+    keys = args.models or list(MODEL_ZOO)
+    unknown = [k for k in keys if k not in MODEL_ZOO]
+    if unknown:
+        logger.error(f"Unknown MODEL_ZOO keys: {unknown}")
+        sys.exit(1)
+    base_overrides = dict(item.split("=", 1) for item in args.base)
+
+    base_dirs: dict[str, Path] = {}
+    caches: dict[str, BaseTensorCache] = {}
+    failed: set[tuple[Path, float]] = set()
+
+    logger.info(f"Watching {', '.join(MODEL_ZOO[k]['output_dir'] for k in keys)} (Ctrl+C to stop)")
+    try:
+        while True:
+            for key in keys:
+                output_dir = Path(MODEL_ZOO[key]["output_dir"])
+                if not output_dir.is_dir():
+                    continue
+                for adapter_dir in adapter_dirs(output_dir):
+                    if not needs_conversion(adapter_dir, args.outtype, args.settle):
+                        continue
+                    # a broken checkpoint is retried only after it changes
+                    attempt = (adapter_dir, adapter_mtime(adapter_dir))
+                    if attempt in failed:
+                        continue
+                    if key not in base_dirs:
+                        base_dirs[key] = resolve_base_dir(base_overrides.get(key, MODEL_ZOO[key]["model_id"]))
+                        caches[key] = BaseTensorCache(output_dir / CACHE_DIR_NAME / args.outtype,
+                                                      fingerprint_sources(base_dirs[key], args.outtype, False))
+                    caches[key].hits = caches[key].misses = 0
+                    start = time.perf_counter()
+                    try:
+                        out = convert_adapter(adapter_dir, base_dirs[key], args.outtype, caches[key], args.threads)
+                    except Exception:
+                        logger.exception(f"[{key}] failed to convert {adapter_dir}")
+                        failed.add(attempt)
+                        continue
+                    cache = caches[key]
+                    logger.info(f"[{key}] {out} written in {time.perf_counter() - start:.1f}s "
+                                f"({time.time() - attempt[1]:.1f}s after the checkpoint was saved; "
+                                f"base cache {cache.hits} hits, {cache.misses} misses)")
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+
+
+if __name__ == "__main__":
+    main()